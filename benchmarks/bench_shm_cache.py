@@ -0,0 +1,86 @@
+# -*- coding: UTF-8 -*-
+"""
+Compares the shared memory cache to a plain per-process dict.
+
+Reports the cost of a lookup, and the hit rate each approach gets when several
+worker processes look up the same set of keys. Example::
+
+    python -m benchmarks.bench_shm_cache --workers 4
+"""
+import os
+import time
+import random
+import argparse
+import tempfile
+from multiprocessing import Pool
+
+from vlab_api_gateway import shm_cache
+
+
+def time_op(func, iterations):
+    """Run a function many times
+
+    :Returns: Float (nanoseconds per call)
+    """
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) * 1e9 / iterations
+
+
+def worker(args):
+    """Simulate one gunicorn worker looking up keys
+
+    :Returns: Tuple (local_hits, shared_hits, lookups)
+    """
+    path, slots, keys, lookups, seed = args
+    rand = random.Random(seed)
+    cache = shm_cache.SharedCache(path, slots)
+    local = {}
+    local_hits = shared_hits = 0
+    for _ in range(lookups):
+        # skewed traffic; a few users are very busy
+        key = b'ipam:%d' % int(rand.paretovariate(1.2) * keys / 10 % keys)
+        if key in local:
+            local_hits += 1
+        else:
+            local[key] = b'sandy.vlab.local'
+        if cache.get(key) is not None:
+            shared_hits += 1
+        else:
+            cache.set(key, b'sandy.vlab.local', ttl=60)
+    cache.close()
+    return local_hits, shared_hits, lookups
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=4, help='Number of worker processes. Default 4')
+    parser.add_argument('--keys', type=int, default=5000, help='Number of distinct keys. Default 5000')
+    parser.add_argument('--lookups', type=int, default=20000, help='Lookups per worker. Default 20000')
+    parser.add_argument('--iterations', type=int, default=200000, help='Iterations for timing. Default 200000')
+    args = parser.parse_args()
+
+    slots = args.keys * 2
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'cache')
+        cache = shm_cache.SharedCache(path, slots)
+        local = {b'dns:auth-api:5000' : b'10.0.0.2'}
+        cache.set(b'dns:auth-api:5000', b'10.0.0.2', ttl=60)
+        print('dict get         {:>8.0f} ns/op'.format(time_op(lambda: local.get(b'dns:auth-api:5000'), args.iterations)))
+        print('shared get       {:>8.0f} ns/op'.format(time_op(lambda: cache.get(b'dns:auth-api:5000'), args.iterations)))
+        print('shared get miss  {:>8.0f} ns/op'.format(time_op(lambda: cache.get(b'dns:nope:5000'), args.iterations)))
+        print('shared set       {:>8.0f} ns/op'.format(time_op(lambda: cache.set(b'dns:auth-api:5000', b'10.0.0.2', 60),
+                                                                 args.iterations)))
+        cache.close()
+
+        with Pool(args.workers) as pool:
+            jobs = [(path, slots, args.keys, args.lookups, seed) for seed in range(args.workers)]
+            results = pool.map(worker, jobs)
+        lookups = sum(x[2] for x in results)
+        print('per-process dict hit rate  {:.1%}'.format(sum(x[0] for x in results) / lookups))
+        print('shared cache hit rate      {:.1%}'.format(sum(x[1] for x in results) / lookups))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+# -*- coding: UTF-8 -*-
+"""
+Measures the throughput of relaying a request body to a back-end service.
+
+Every upload goes through ``RelayQuery``, the same path ``server.application``
+uses; the body is read from the client in blocks, and sent upstream by the
+``upstream`` client (with chunked encoding when there's no Content-Length). A
+local sink server reads and discards the upload before it answers, so the
+numbers reflect the cost of the API gateway's body handling; not the network.
+Example::
+
+    python -m benchmarks.bench_upload --size 2048 --block-size 65536
+"""
+import argparse
+import socket
+import threading
+import time
+
+from vlab_api_gateway import upload
+from vlab_api_gateway.relay import RelayQuery
+
+RESPONSE = b'HTTP/1.1 201 Created\r\nContent-Type: application/json\r\nContent-Length: 2\r\n\r\n{}'
+
+
+class ZeroStream:
+    """A file-like object that produces ``size`` bytes without holding them in RAM"""
+    def __init__(self, size, block_size):
+        self.remaining = size
+        self._block = bytes(block_size)
+
+    def read(self, size):
+        size = min(size, self.remaining, len(self._block))
+        self.remaining -= size
+        return self._block[:size]
+
+
+def _discard_body(client, head, extra):
+    """Read (and throw away) the body of a request, per its framing"""
+    headers = {}
+    for line in head.split(b'\r\n')[1:]:
+        name, _, value = line.partition(b':')
+        headers[name.strip().lower()] = value.strip()
+    buf = bytearray(1048576)
+    if b'content-length' in headers:
+        remaining = int(headers[b'content-length']) - len(extra)
+        while remaining > 0:
+            remaining -= client.recv_into(buf, min(remaining, len(buf)))
+        return
+    # chunked; the body ends with the zero length chunk
+    tail = extra[-5:]
+    while not tail.endswith(b'0\r\n\r\n'):
+        size = client.recv_into(buf)
+        if not size:
+            return
+        tail = (tail + bytes(buf[max(0, size - 5):size]))[-5:]
+
+
+def sink_server():
+    """Start a minimal HTTP server that discards request bodies, then answers
+    with a HTTP 201
+
+    :Returns: Integer (the port the server listens on)
+    """
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(8)
+
+    def serve(client):
+        data = b''
+        while True:
+            while b'\r\n\r\n' not in data:
+                more = client.recv(65536)
+                if not more:
+                    client.close()
+                    return
+                data += more
+            head, _, extra = data.partition(b'\r\n\r\n')
+            _discard_body(client, head, extra)
+            client.sendall(RESPONSE)
+            data = b''
+
+    def accept():
+        while True:
+            client, _ = listener.accept()
+            threading.Thread(target=serve, args=(client,), daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    return listener.getsockname()[1]
+
+
+def relay_upload(port, body):
+    """Send the body to the sink server the way the API gateway would
+
+    :Returns: String (the status of the response)
+    """
+    headers = {'Content-Type' : 'application/octet-stream'}
+    if body.length is not None:
+        headers['Content-Length'] = str(body.length)
+    resp = RelayQuery(host='127.0.0.1', uri='/api/2/inf/deployment', method='POST', headers=headers,
+                      body=body, port=port, keepalive=False)
+    for _ in resp:
+        pass
+    resp.close()
+    return resp.status
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=2048, help='Upload size in MB. Default 2048')
+    parser.add_argument('--block-size', type=int, default=65536, help='Bytes read per block. Default 65536')
+    parser.add_argument('--spool', action='store_true', help='Also benchmark spooling to disk')
+    args = parser.parse_args()
+
+    size = args.size * 1048576
+    max_size = size + 1
+    port = sink_server()
+    cases = [
+        ('content-length', lambda: upload.RequestBody(ZeroStream(size, args.block_size), size,
+                                                      max_size=max_size, block_size=args.block_size)),
+        ('chunked', lambda: upload.RequestBody(ZeroStream(size, args.block_size), None,
+                                               max_size=max_size, block_size=args.block_size)),
+    ]
+    if args.spool:
+        cases.append(('spooled', lambda: upload.SpooledRequestBody(ZeroStream(size, args.block_size), None,
+                                                                   max_size=max_size,
+                                                                   block_size=args.block_size)))
+    for name, make_body in cases:
+        start = time.perf_counter()
+        status = relay_upload(port, make_body())
+        elapsed = time.perf_counter() - start
+        assert status.startswith('201'), '{} upload failed: {}'.format(name, status)
+        print('{:<16} {:>8.1f} MB/s  ({:.2f}s)'.format(name, args.size / elapsed, elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+# -*- coding: UTF-8 -*-
+"""
+Compares the ``upstream`` client to http.client for relaying responses.
+
+Each client reads canned back-end responses (see ``microbench.make_response``)
+from a fake socket: the head is parsed, the headers collected, and the body read
+to the end. http.client is measured both line by line (how ``RelayQuery`` used
+to read it) and in blocks. The "framing" column shows if the headers a client
+hands back describe the body it hands back; a relayed response is broken when
+they don't. Example::
+
+    python -m benchmarks.bench_upstream
+    python -m benchmarks.bench_upstream --size 1048576 --pipeline 20
+"""
+import argparse
+import http.client
+
+from vlab_api_gateway import upstream
+from benchmarks.microbench import FakeSocket, inventory_body, make_response, measure
+
+
+class StdlibConnection(http.client.HTTPConnection):
+    response = b''
+
+    def connect(self):
+        self.sock = FakeSocket(self.response)
+
+
+class UpstreamConnection(upstream.HTTPConnection):
+    response = b''
+
+    def connect(self):
+        self.sock = FakeSocket(self.response)
+
+
+def framing(headers, body):
+    """Check that the headers are correct for relaying the body as-is
+
+    :Returns: String
+    """
+    headers = {name.lower() : value for name, value in headers}
+    if 'transfer-encoding' in headers:
+        return 'BROKEN'
+    if 'content-length' in headers and int(headers['content-length']) != len(body):
+        return 'BROKEN'
+    return 'ok'
+
+
+def stdlib_lines():
+    conn = StdlibConnection('onefs-api', 5000)
+    conn.request('GET', '/api/2/inf/onefs', headers={})
+    resp = conn.getresponse()
+    headers = resp.getheaders()
+    body = b''.join(iter(resp.readline, b''))
+    conn.close()
+    return headers, body
+
+
+def stdlib_blocks():
+    conn = StdlibConnection('onefs-api', 5000)
+    conn.request('GET', '/api/2/inf/onefs', headers={})
+    resp = conn.getresponse()
+    headers = resp.getheaders()
+    body = b''.join(iter(lambda: resp.read(upstream.BLOCK_SIZE), b''))
+    conn.close()
+    return headers, body
+
+
+def upstream_blocks():
+    conn = UpstreamConnection('onefs-api', 5000)
+    conn.request('GET', '/api/2/inf/onefs', headers={})
+    resp = conn.getresponse()
+    headers = resp.getheaders()
+    body = b''.join(iter(resp.read1, b''))
+    conn.close()
+    return headers, body
+
+
+def upstream_pipelined(count):
+    def run():
+        conn = UpstreamConnection('onefs-api', 5000)
+        for _ in range(count):
+            conn.request('GET', '/api/2/inf/onefs', headers={})
+        for _ in range(count):
+            resp = conn.getresponse()
+            resp.getheaders()
+            for _ in iter(resp.read1, b''):
+                pass
+        conn.close()
+    return run
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=0,
+                        help='Size of the response body in bytes. Default is an inventory listing (~30KB)')
+    parser.add_argument('--pipeline', type=int, default=10, help='Requests per pipelined batch. Default 10')
+    args = parser.parse_args()
+
+    body = b'{"x": 1}\n' * (args.size // 9) if args.size else inventory_body()
+    print('{:<12} {:<22} {:>12} {:>16} {:>9}'.format('framing', 'client', 'ns/op', 'peak bytes/op', 'headers'))
+    for chunked in (False, True):
+        response = make_response(body, chunked=chunked)
+        kind = 'chunked' if chunked else 'length'
+        for name, func in (('http.client readline', stdlib_lines), ('http.client read', stdlib_blocks),
+                           ('upstream read1', upstream_blocks)):
+            StdlibConnection.response = UpstreamConnection.response = response
+            headers, relayed = func()
+            assert relayed == body, '{} read the wrong body'.format(name)
+            result = measure(func)
+            print('{:<12} {:<22} {:>12} {:>16} {:>9}'.format(kind, name, result['ns_per_op'],
+                                                             result['peak_bytes_per_op'], framing(headers, relayed)))
+        UpstreamConnection.response = response * args.pipeline
+        result = measure(upstream_pipelined(args.pipeline))
+        print('{:<12} {:<22} {:>12} {:>16} {:>9}'.format(kind, 'upstream pipelined',
+                                                         round(result['ns_per_op'] / args.pipeline, 1),
+                                                         result['peak_bytes_per_op'] // args.pipeline, 'ok'))
+
+
+if __name__ == '__main__':
+    main()
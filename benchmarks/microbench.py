@@ -0,0 +1,381 @@
+# -*- coding: UTF-8 -*-
+"""
+Microbenchmarks for the hot paths of the API gateway.
+
+Every benchmark runs in-process on realistic inputs; back-end services are
+replaced with canned responses so no network is needed. Results are compared to
+``benchmarks/baseline.json``, and the run fails if any benchmark is slower (or
+allocates more memory) than the baseline by more than the threshold. Example::
+
+    python -m benchmarks.microbench                 # compare to the baseline
+    python -m benchmarks.microbench --threshold 0.5 # allow a 50% regression
+    python -m benchmarks.microbench --update        # record a new baseline
+
+Timings depend on the host, so record the baseline on the machine that runs
+the comparison. To keep sub-microsecond benchmarks from failing on noise, a
+benchmark can have its own threshold, a slowdown must also exceed an absolute
+noise floor, and a benchmark that looks slower is re-run, keeping its best result.
+"""
+import os
+import sys
+import time
+import json
+import atexit
+import shutil
+import base64
+import logging
+import argparse
+import tempfile
+import tracemalloc
+from io import BytesIO, BufferedReader
+
+from vlab_api_gateway import compress, relay, router, server, shm_cache, upstream
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+BENCHMARKS = {}
+# benchmarks that allow more (or less) regression than ``--threshold``
+THRESHOLDS = {}
+METRICS = ('ns_per_op', 'peak_bytes_per_op', 'retained_blocks_per_op')
+
+
+def benchmark(name, threshold=None):
+    """Register a benchmark. The decorated function does any setup, and returns
+    the zero-argument callable to measure.
+
+    :param threshold: The allowed regression, if different from ``--threshold``
+    :type threshold: Float
+    """
+    def register(func):
+        BENCHMARKS[name] = func
+        if threshold is not None:
+            THRESHOLDS[name] = threshold
+        return func
+    return register
+
+
+def make_token(username='sandy'):
+    """Create a JWT-shaped auth token; the signature isn't checked by these code paths"""
+    header = base64.urlsafe_b64encode(b'{"alg":"RS256","typ":"JWT"}').rstrip(b'=')
+    claims = {'username' : username, 'version' : 2, 'client_ip' : '10.1.1.1',
+              'exp' : int(time.time()) + 3600, 'iat' : int(time.time())}
+    payload = base64.urlsafe_b64encode(json.dumps(claims).encode()).rstrip(b'=')
+    return header + b'.' + payload + b'.' + base64.urlsafe_b64encode(os.urandom(256)).rstrip(b'=')
+
+
+def make_response(body, chunked=False):
+    """Create the raw bytes of an HTTP response from a back-end service"""
+    head = b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nServer: Werkzeug/1.0.1 Python/3.8\r\n'
+    if chunked:
+        chunks = b''.join(b'%x\r\n%s\r\n' % (len(body[i:i+4096]), body[i:i+4096]) for i in range(0, len(body), 4096))
+        return head + b'Transfer-Encoding: chunked\r\n\r\n' + chunks + b'0\r\n\r\n'
+    return head + b'Content-Length: %d\r\n\r\n' % len(body) + body
+
+
+def inventory_body():
+    """A JSON body shaped like an inventory listing"""
+    inventory = {'content' : {'vm%d' % x : {'state' : 'poweredOn', 'console' : 'https://vlab.local/console/%d' % x,
+                                            'ips' : ['10.1.1.%d' % x], 'meta' : {'component' : 'OneFS',
+                                            'version' : '8.2.2', 'configured' : True}}
+                              for x in range(100)},
+                 'error' : None, 'params' : {}}
+    return json.dumps(inventory, indent=2).encode()
+
+
+class FakeSocket:
+    """Stands in for the socket to a back-end service; it works with http.client
+    and the ``upstream`` client, so they can be compared"""
+    def __init__(self, response):
+        self._response = response
+        self._stream = BytesIO(response)
+
+    def makefile(self, mode):
+        return BufferedReader(BytesIO(self._response))
+
+    def recv_into(self, buf):
+        return self._stream.readinto(buf)
+
+    def recv(self, size):
+        return self._stream.read(size)
+
+    def sendall(self, data):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeConnection(upstream.HTTPConnection):
+    """An HTTPConnection that sends nowhere, and always gets the same response"""
+    response = b''
+
+    def connect(self):
+        self.sock = FakeSocket(self.response)
+
+
+class FakeRelayQuery:
+    """Stands in for RelayQuery, so only the work done by ``server.application`` is measured"""
+    status = '200 OK'
+    headers = []
+
+    def __init__(self, **kwargs):
+        pass
+
+
+@benchmark('router.get_host[inf]', threshold=0.5)
+def bench_get_host_inf():
+    return lambda: router.get_host(uri='/api/2/inf/onefs/image', token=b'')
+
+
+@benchmark('router.get_host[auth]', threshold=0.5)
+def bench_get_host_auth():
+    return lambda: router.get_host(uri='/api/2/auth/token', token=b'')
+
+
+@benchmark('router.get_host[docs]', threshold=0.5)
+def bench_get_host_docs():
+    return lambda: router.get_host(uri='/index.html', token=b'')
+
+
+@benchmark('router.get_host[ipam]')
+def bench_get_host_ipam():
+    token = make_token()
+    return lambda: router.get_host(uri='/api/1/ipam/portmap', token=token)
+
+
+@benchmark('router._user_ipam_server')
+def bench_user_ipam_server():
+    token = make_token()
+    return lambda: router._user_ipam_server(token)
+
+
+@benchmark('server.application')
+def bench_application():
+    env = {
+        'REQUEST_METHOD' : 'GET',
+        'PATH_INFO' : '/api/2/inf/onefs',
+        'QUERY_STRING' : 'verbose=true',
+        'SERVER_PROTOCOL' : 'HTTP/1.1',
+        'CONTENT_TYPE' : 'application/json',
+        'HTTP_HOST' : 'vlab.local',
+        'HTTP_USER_AGENT' : 'python-requests/2.25.1',
+        'HTTP_ACCEPT' : '*/*',
+        'HTTP_ACCEPT_ENCODING' : 'gzip, deflate',
+        'HTTP_CONNECTION' : 'keep-alive',
+        'HTTP_X_FORWARDED_FOR' : '10.1.1.1',
+        'HTTP_X_AUTH' : make_token().decode(),
+        'wsgi.input' : BytesIO(b''),
+    }
+    start_response = lambda status, headers: None
+    return lambda: server.application(env, start_response)
+
+
+def _relay(response):
+    FakeConnection.response = response
+    def run():
+        resp = relay.RelayQuery(host='onefs-api', uri='/api/2/inf/onefs', method='GET',
+                                headers={}, body=None, port=5000, keepalive=False)
+        for _ in resp:
+            pass
+        resp.close()
+    return run
+
+
+@benchmark('RelayQuery[content-length]')
+def bench_relay():
+    return _relay(make_response(inventory_body()))
+
+
+@benchmark('RelayQuery[chunked]')
+def bench_relay_chunked():
+    return _relay(make_response(inventory_body(), chunked=True))
+
+
+@benchmark('CompressedResponse[gzip]')
+def bench_compressed_response():
+    lines = inventory_body().splitlines(keepends=True)
+    def run():
+        resp = compress.CompressedResponse(lines, 'gzip', level=6)
+        for _ in resp:
+            pass
+    return run
+
+
+@benchmark('SharedCache.get')
+def bench_shared_cache_get():
+    tmpdir = tempfile.mkdtemp()
+    atexit.register(shutil.rmtree, tmpdir, True)
+    cache = shm_cache.SharedCache(os.path.join(tmpdir, 'cache'), slots=1024)
+    cache.set(b'dns:onefs-api:5000', b'10.0.0.2', ttl=3600)
+    return lambda: cache.get(b'dns:onefs-api:5000')
+
+
+def measure(func, min_time=0.5, repeats=7):
+    """Time a function, and find how much memory a call allocates
+
+    ``ns_per_op`` is the best of ``repeats`` timed runs. ``peak_bytes_per_op``
+    is the most memory a call allocates at once, so it grows with the temporary
+    buffers and copies a call makes. ``retained_blocks_per_op`` is the number of
+    blocks a call leaves allocated (its result, anything cached, anything leaked).
+
+    :Returns: Dictionary
+    """
+    func() # warm up
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time / repeats:
+            break
+        loops *= 2
+    best = elapsed
+    for _ in range(repeats - 1):
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        best = min(best, time.perf_counter() - start)
+
+    calls = 100
+    peak = 0
+    for _ in range(calls):
+        # restarting resets the peak; tracemalloc.reset_peak() needs Python 3.9
+        tracemalloc.start()
+        func()
+        peak += tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    # hold on to every result, so the blocks a call hands back are counted
+    kept = [None] * calls
+    ignore = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot().filter_traces(ignore)
+    for index in range(calls):
+        kept[index] = func()
+    after = tracemalloc.take_snapshot().filter_traces(ignore)
+    tracemalloc.stop()
+    retained = sum(max(stat.count_diff, 0) for stat in after.compare_to(before, 'lineno'))
+    return {
+        'ns_per_op' : round(best * 1e9 / loops, 1),
+        'peak_bytes_per_op' : peak // calls,
+        'retained_blocks_per_op' : round(retained / calls, 2),
+    }
+
+
+def run(names):
+    """Run the benchmarks
+
+    :Returns: Dictionary
+    """
+    results = {}
+    # keep the cost of logging in the numbers, but not the spam in the output
+    devnull = open(os.devnull, 'w')
+    for name in logging.root.manager.loggerDict:
+        if name.startswith('vlab_api_gateway'):
+            for handler in logging.getLogger(name).handlers:
+                handler.setStream(devnull)
+    originals = (relay.HTTPConnection, server.RelayQuery)
+    relay.HTTPConnection = FakeConnection
+    try:
+        for name in names:
+            func = BENCHMARKS[name]()
+            if name == 'server.application':
+                server.RelayQuery = FakeRelayQuery
+            try:
+                results[name] = measure(func)
+            finally:
+                server.RelayQuery = originals[1]
+    finally:
+        relay.HTTPConnection = originals[0]
+    return results
+
+
+def compare(results, baseline, threshold, noise_floor=0):
+    """Find the benchmarks that regressed past the threshold
+
+    :Returns: List
+
+    :param threshold: The allowed regression, as a fraction of the baseline
+    :type threshold: Float
+
+    :param noise_floor: A slowdown of fewer nanoseconds than this is never a regression
+    :type noise_floor: Float
+    """
+    # the smallest change in each metric that can count as a regression
+    slack = {'ns_per_op' : noise_floor, 'peak_bytes_per_op' : 0, 'retained_blocks_per_op' : 1}
+    regressions = []
+    for name, result in results.items():
+        expected = baseline.get(name)
+        if not expected:
+            continue
+        allowed = THRESHOLDS.get(name, threshold)
+        for metric in METRICS:
+            if metric not in expected:
+                continue
+            limit = max(expected[metric] * (1 + allowed), expected[metric] + slack[metric])
+            if result[metric] > limit:
+                regressions.append('{} {}: {} -> {}'.format(name, metric, expected[metric], result[metric]))
+    return regressions
+
+
+def best_of(results, others):
+    """Keep the best value of every metric across runs of the same benchmarks
+
+    :Returns: Dictionary
+    """
+    best = {}
+    for name, result in results.items():
+        best[name] = {metric : min(result[metric], others[name][metric]) for metric in METRICS}
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threshold', type=float, default=float(os.environ.get('VLAB_BENCH_THRESHOLD', 0.25)),
+                        help='Allowed regression, as a fraction of the baseline. Default 0.25')
+    parser.add_argument('--baseline', default=BASELINE, help='The file of baseline results')
+    parser.add_argument('--update', action='store_true', help='Save the results as the new baseline')
+    parser.add_argument('--filter', default='', help='Only run benchmarks whose name contains this')
+    parser.add_argument('--noise-floor', type=float, default=100,
+                        help='A slowdown of fewer ns/op than this is never a regression. Default 100')
+    parser.add_argument('--retries', type=int, default=2,
+                        help='Times to re-run a benchmark that regressed, keeping its best result. Default 2')
+    args = parser.parse_args()
+
+    names = [x for x in BENCHMARKS if args.filter in x]
+    results = run(names)
+    try:
+        with open(args.baseline) as the_file:
+            baseline = json.load(the_file)
+    except FileNotFoundError:
+        baseline = {}
+
+    if not args.update:
+        for _ in range(args.retries):
+            regressed = {x.split()[0] for x in compare(results, baseline, args.threshold, args.noise_floor)}
+            if not regressed:
+                break
+            results.update(best_of({x : results[x] for x in regressed}, run(sorted(regressed))))
+
+    print('{:<30} {:>12} {:>12} {:>16} {:>18}'.format('benchmark', 'ns/op', 'baseline', 'peak bytes/op',
+                                                      'retained blocks/op'))
+    for name, result in results.items():
+        expected = baseline.get(name, {}).get('ns_per_op', '-')
+        print('{:<30} {:>12} {:>12} {:>16} {:>18}'.format(name, result['ns_per_op'], expected,
+                                                          result['peak_bytes_per_op'],
+                                                          result['retained_blocks_per_op']))
+    if args.update:
+        baseline.update(results)
+        with open(args.baseline, 'w') as the_file:
+            json.dump(baseline, the_file, indent=2, sort_keys=True)
+            the_file.write('\n')
+        print('Saved baseline to {}'.format(args.baseline))
+        return 0
+
+    regressions = compare(results, baseline, args.threshold, args.noise_floor)
+    for regression in regressions:
+        print('REGRESSION {}'.format(regression))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,232 @@
+# -*- coding: UTF-8 -*-
+"""
+Replays traffic recorded by the API gateway (see ``VLAB_CAPTURE_DIR``) to
+reproduce the mix of routes, body sizes and users seen in production.
+
+By default, the gateway runs in-process, and every back-end service is replaced
+with a local stub that returns a response of the recorded status and size. Use
+``--target`` to replay against a gateway that's already running instead. Example::
+
+    python -m benchmarks.replay /tmp/vlab-capture-*.jsonl.gz                   # real time
+    python -m benchmarks.replay --speed 4 --output run2.json capture.jsonl.gz  # 4x faster
+    python -m benchmarks.replay --compare run1.json capture.jsonl.gz           # compare runs
+
+Every request is sent at its recorded offset (divided by ``--speed``) from the
+start of the capture, so bursts and lulls are kept.
+"""
+from gevent import monkey; monkey.patch_all()
+
+import sys
+import time
+import json
+import base64
+import argparse
+from urllib.parse import urlsplit
+from http.client import HTTPConnection, HTTPException
+
+import gevent
+from gevent.pool import Pool
+from gevent.pywsgi import WSGIServer
+
+from vlab_api_gateway import capture, router, server
+
+DEFAULT_ID = '1'
+
+
+class StubLog:
+    """Discards the access log of the local servers"""
+    def write(self, data):
+        pass
+
+
+def stub_backend(env, start_response):
+    """A back-end service that responds with the status and size it's asked for"""
+    stream = env['wsgi.input']
+    while stream.read(65536):
+        pass
+    delay = float(env.get('HTTP_X_VLAB_REPLAY_DELAY', 0))
+    if delay:
+        gevent.sleep(delay)
+    size = int(env.get('HTTP_X_VLAB_REPLAY_SIZE', 0))
+    status = env.get('HTTP_X_VLAB_REPLAY_STATUS', '200')
+    start_response('{} Replay'.format(status), [('Content-Type', 'application/json'),
+                                                ('Content-Length', str(size))])
+    return [b' ' * size]
+
+
+def start_local_gateway():
+    """Run the gateway, and a stub for every back-end service, in this process
+
+    :Returns: Tuple (host, port) of the gateway
+    """
+    stub = WSGIServer(('127.0.0.1', 0), stub_backend, log=StubLog())
+    stub.start()
+    for resource in router.SERVICE_MAP:
+        router.SERVICE_MAP[resource] = ('127.0.0.1', False, stub.server_port)
+    gateway = WSGIServer(('127.0.0.1', 0), server.application, log=StubLog())
+    gateway.start()
+    return '127.0.0.1', gateway.server_port
+
+
+def make_token(token_hash):
+    """Create a JWT-shaped token, so every recorded user is a different user in the replay"""
+    if not token_hash:
+        return ''
+    header = base64.urlsafe_b64encode(b'{"alg":"HS256","typ":"JWT"}').rstrip(b'=')
+    claims = {'username' : 'replay{}'.format(token_hash[:8]), 'version' : 2,
+              'exp' : int(time.time()) + 86400}
+    payload = base64.urlsafe_b64encode(json.dumps(claims).encode()).rstrip(b'=')
+    return (header + b'.' + payload + b'.' + token_hash.encode()).decode()
+
+
+def build_request(record, tokens, backend_latency):
+    """Turn a capture record into the URI, headers and body to send
+
+    :Returns: Tuple (uri, headers, body)
+    """
+    uri = record['uri'].replace(capture.PLACEHOLDER, DEFAULT_ID)
+    if record['query']:
+        uri += '?' + '&'.join('{}={}'.format(x, DEFAULT_ID) for x in record['query'])
+    token = tokens.get(record['token'])
+    if token is None:
+        token = tokens[record['token']] = make_token(record['token'])
+    headers = {'X-Vlab-Replay-Size' : str(record.get('response_bytes', 0)),
+               'X-Vlab-Replay-Status' : str(record.get('status', 200))}
+    if backend_latency:
+        headers['X-Vlab-Replay-Delay'] = str(record.get('head_ms', 0) / 1000.0)
+    if token:
+        headers['X-Auth'] = token
+    body = None
+    if record['request_bytes'] or record['method'] in ('POST', 'PUT', 'PATCH'):
+        body = b' ' * record['request_bytes']
+    return uri, headers, body
+
+
+def send(host, port, record, tokens, backend_latency, due, results):
+    """Send one request, and record the outcome"""
+    uri, headers, body = build_request(record, tokens, backend_latency)
+    result = {'resource' : record['resource'], 'lag_ms' : (time.perf_counter() - due) * 1000}
+    started = time.perf_counter()
+    conn = HTTPConnection(host, port, timeout=60)
+    try:
+        conn.request(record['method'], uri, body=body, headers=headers)
+        resp = conn.getresponse()
+        size = len(resp.read())
+    except (OSError, HTTPException) as doh:
+        result['error'] = str(doh)
+    else:
+        result['status'] = resp.status
+        result['mismatch'] = resp.status != record.get('status', 200) or size != record.get('response_bytes', 0)
+    finally:
+        conn.close()
+    result['ms'] = (time.perf_counter() - started) * 1000
+    results.append(result)
+
+
+def replay(records, host, port, speed, concurrency, backend_latency):
+    """Send the recorded requests at the recorded pace (times ``speed``)
+
+    :Returns: Tuple (results, elapsed_seconds)
+    """
+    results = []
+    tokens = {}
+    pool = Pool(size=concurrency)
+    first = records[0]['ts']
+    started = time.perf_counter()
+    for record in records:
+        due = started + (record['ts'] - first) / speed
+        wait = due - time.perf_counter()
+        if wait > 0:
+            gevent.sleep(wait)
+        pool.spawn(send, host, port, record, tokens, backend_latency, due, results)
+    pool.join()
+    return results, time.perf_counter() - started
+
+
+def percentile(values, pct):
+    if not values:
+        return 0
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * pct / 100))], 2)
+
+
+def summarize(results, elapsed):
+    """Reduce the outcome of every request to a few comparable numbers
+
+    :Returns: Dictionary
+    """
+    latencies = [x['ms'] for x in results if 'error' not in x]
+    summary = {
+        'requests' : len(results),
+        'errors' : sum(1 for x in results if 'error' in x),
+        'mismatches' : sum(1 for x in results if x.get('mismatch')),
+        'rps' : round(len(results) / elapsed, 1) if elapsed else 0,
+        'p50_ms' : percentile(latencies, 50),
+        'p90_ms' : percentile(latencies, 90),
+        'p99_ms' : percentile(latencies, 99),
+        'max_ms' : round(max(latencies), 2) if latencies else 0,
+        'lag_p99_ms' : percentile([x['lag_ms'] for x in results], 99),
+        'resources' : {},
+    }
+    for resource in sorted({x['resource'] for x in results}):
+        times = [x['ms'] for x in results if x['resource'] == resource and 'error' not in x]
+        summary['resources'][resource] = {'requests' : sum(1 for x in results if x['resource'] == resource),
+                                          'p50_ms' : percentile(times, 50),
+                                          'p99_ms' : percentile(times, 99)}
+    return summary
+
+
+def print_summary(summary, other=None):
+    """Print the summary of a run, and how it differs from another run"""
+    for metric in ('requests', 'errors', 'mismatches', 'rps', 'p50_ms', 'p90_ms', 'p99_ms', 'max_ms', 'lag_p99_ms'):
+        line = '{:<12} {:>12}'.format(metric, summary[metric])
+        if other and other.get(metric):
+            line += ' {:>12} {:>+8.1f}%'.format(other[metric], (summary[metric] - other[metric]) * 100.0 / other[metric])
+        print(line)
+    print()
+    print('{:<16} {:>10} {:>10} {:>10}'.format('resource', 'requests', 'p50_ms', 'p99_ms'))
+    for resource, stats in summary['resources'].items():
+        print('{:<16} {:>10} {:>10} {:>10}'.format(resource, stats['requests'], stats['p50_ms'], stats['p99_ms']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('captures', nargs='+', help='The capture files to replay')
+    parser.add_argument('--speed', type=float, default=1.0, help='Replay this many times faster than recorded. Default 1')
+    parser.add_argument('--target', default='', help='URL of a running gateway, i.e. http://localhost:8000')
+    parser.add_argument('--concurrency', type=int, default=1000, help='Max requests in flight. Default 1000')
+    parser.add_argument('--limit', type=int, default=0, help='Only replay the first N requests')
+    parser.add_argument('--backend-latency', action='store_true',
+                        help='Make the stub back-ends take as long as the recorded responses did')
+    parser.add_argument('--output', default='', help='Save the summary of this run to a file')
+    parser.add_argument('--compare', default='', help='A summary saved by --output to compare this run to')
+    args = parser.parse_args()
+
+    records = capture.read_capture(args.captures)
+    if args.limit:
+        records = records[:args.limit]
+    if not records:
+        print('No requests in {}'.format(' '.join(args.captures)))
+        return 1
+    if args.target:
+        target = urlsplit(args.target)
+        host, port = target.hostname, target.port or 80
+    else:
+        host, port = start_local_gateway()
+    print('Replaying {} requests at {}x against {}:{}'.format(len(records), args.speed, host, port))
+    results, elapsed = replay(records, host, port, args.speed, args.concurrency, args.backend_latency)
+    summary = summarize(results, elapsed)
+
+    other = None
+    if args.compare:
+        with open(args.compare) as the_file:
+            other = json.load(the_file)
+    print_summary(summary, other)
+    if args.output:
+        with open(args.output, 'w') as the_file:
+            json.dump(summary, the_file, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -10,4 +10,5 @@ setup(name="vlab-api-gateway",
       packages=find_packages(),
       description="Routes requests to vLab services",
       install_requires=['gunicorn', 'gevent', 'ujson', 'cffi>=1.11.5'],
+      extras_require={'verify' : ['pyjwt', 'cryptography']},
       )
@@ -0,0 +1,132 @@
+# -*- coding: UTF-8 -*-
+"""A suite of unit tests for the ``admin.py`` module"""
+import unittest
+from unittest.mock import MagicMock, patch
+
+import ujson
+
+from vlab_api_gateway import admin
+
+admin.logger = MagicMock() # prevent SPAM in output while running tests
+
+
+@patch.object(admin, 'const')
+class TestAdmin(unittest.TestCase):
+    """A suite of test cases for the ``admin.py`` module"""
+
+    def test_disabled(self, fake_const):
+        """``is_admin_request`` is False when no admin token is configured"""
+        fake_const.VLAB_ADMIN_TOKEN = ''
+
+        self.assertFalse(admin.is_admin_request('/__admin/profile'))
+
+    def test_enabled(self, fake_const):
+        """``is_admin_request`` is True for admin end points when an admin token is configured"""
+        fake_const.VLAB_ADMIN_TOKEN = 'sekret'
+
+        self.assertTrue(admin.is_admin_request('/__admin/profile'))
+        self.assertFalse(admin.is_admin_request('/api/2/inf/onefs'))
+
+    def test_bad_token(self, fake_const):
+        """``application`` returns HTTP 403 when the admin token is wrong"""
+        fake_const.VLAB_ADMIN_TOKEN = 'sekret'
+        fake_start_response = MagicMock()
+        env = {'HTTP_X_ADMIN_TOKEN' : 'guess'}
+
+        admin.application(env, fake_start_response, '/__admin/profile')
+        call_args, _ = fake_start_response.call_args
+
+        self.assertEqual(call_args[0], '403 Forbidden')
+
+    def test_not_found(self, fake_const):
+        """``application`` returns HTTP 404 for unknown admin end points"""
+        fake_const.VLAB_ADMIN_TOKEN = 'sekret'
+        fake_start_response = MagicMock()
+        env = {'HTTP_X_ADMIN_TOKEN' : 'sekret'}
+
+        admin.application(env, fake_start_response, '/__admin/nope')
+        call_args, _ = fake_start_response.call_args
+
+        self.assertEqual(call_args[0], '404 Not Found')
+
+    def test_stats(self, fake_const):
+        """``application`` returns the counters of the worker for the stats end point"""
+        fake_const.VLAB_ADMIN_TOKEN = 'sekret'
+        fake_start_response = MagicMock()
+        env = {'HTTP_X_ADMIN_TOKEN' : 'sekret'}
+
+        body = admin.application(env, fake_start_response, '/__admin/stats')
+        stats = ujson.loads(body[0])
+
+        self.assertEqual(fake_start_response.call_args[0][0], '200 OK')
+        self.assertEqual(stats['spool'], admin.spool.get_stats())
+        self.assertTrue('bytes_saved' in stats['compression'])
+        self.assertTrue('idle' in stats['pool'])
+
+    @patch.object(admin.shm_cache, 'CACHE')
+    def test_stats_optional(self, fake_CACHE, fake_const):
+        """``get_stats`` includes the counters of optional subsystems only when they're enabled"""
+        fake_CACHE.get_stats.return_value = {'hits' : 1}
+        with patch.object(admin.capture, 'RECORDER', None):
+            stats = admin.get_stats()
+
+        self.assertEqual(stats['shm_cache'], {'hits' : 1})
+        self.assertTrue(stats['capture'] is None)
+
+    @patch.object(admin.profiler, 'PROFILER')
+    def test_profile(self, fake_PROFILER, fake_const):
+        """``application`` returns collapsed stacks for the profile end point"""
+        fake_const.VLAB_ADMIN_TOKEN = 'sekret'
+        fake_PROFILER.running = False
+        fake_PROFILER.profile.return_value = 'hub;-;hub.py:run 1\n'
+        fake_start_response = MagicMock()
+        env = {'HTTP_X_ADMIN_TOKEN' : 'sekret', 'QUERY_STRING' : 'seconds=5'}
+
+        body = admin.application(env, fake_start_response, '/__admin/profile')
+
+        fake_PROFILER.profile.assert_called_with(5.0)
+        self.assertEqual(body, [b'hub;-;hub.py:run 1\n'])
+
+    @patch.object(admin.profiler, 'PROFILER')
+    def test_profile_json(self, fake_PROFILER, fake_const):
+        """``application`` supports a JSON report for the profile end point"""
+        fake_const.VLAB_ADMIN_TOKEN = 'sekret'
+        fake_PROFILER.running = False
+        fake_PROFILER.report.return_value = {'samples' : 1, 'stacks' : '', 'blocking' : []}
+        fake_start_response = MagicMock()
+        env = {'HTTP_X_ADMIN_TOKEN' : 'sekret', 'QUERY_STRING' : 'seconds=5&format=json'}
+
+        body = admin.application(env, fake_start_response, '/__admin/profile')
+
+        self.assertEqual(ujson.loads(body[0])['samples'], 1)
+
+    @patch.object(admin.profiler, 'PROFILER')
+    def test_profile_bad_seconds(self, fake_PROFILER, fake_const):
+        """``application`` returns HTTP 400 when the profile duration is invalid"""
+        fake_const.VLAB_ADMIN_TOKEN = 'sekret'
+        fake_PROFILER.running = False
+        fake_start_response = MagicMock()
+        env = {'HTTP_X_ADMIN_TOKEN' : 'sekret', 'QUERY_STRING' : 'seconds=9001'}
+
+        admin.application(env, fake_start_response, '/__admin/profile')
+        call_args, _ = fake_start_response.call_args
+
+        self.assertEqual(call_args[0], '400 Bad Request')
+        self.assertFalse(fake_PROFILER.profile.called)
+
+    @patch.object(admin.profiler, 'PROFILER')
+    def test_profile_running(self, fake_PROFILER, fake_const):
+        """``application`` returns HTTP 409 when a profile is already running"""
+        fake_const.VLAB_ADMIN_TOKEN = 'sekret'
+        fake_PROFILER.running = True
+        fake_start_response = MagicMock()
+        env = {'HTTP_X_ADMIN_TOKEN' : 'sekret'}
+
+        admin.application(env, fake_start_response, '/__admin/profile')
+        call_args, _ = fake_start_response.call_args
+
+        self.assertEqual(call_args[0], '409 Conflict')
+
+
+if __name__ == '__main__':
+    unittest.main()
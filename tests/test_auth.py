@@ -0,0 +1,187 @@
+# -*- coding: UTF-8 -*-
+"""A suite of unit tests for the ``auth.py`` module"""
+import os
+import time
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+import ujson
+import jwt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from vlab_api_gateway import auth, shm_cache
+
+auth.logger = MagicMock() # prevent SPAM in output while running tests
+
+
+def make_key():
+    """Create an RSA key pair for signing test tokens
+
+    :Returns: Tuple (private_key, public_key_pem)
+    """
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    public_pem = private_key.public_key().public_bytes(encoding=serialization.Encoding.PEM,
+                                                       format=serialization.PublicFormat.SubjectPublicKeyInfo)
+    return private_key, public_pem.decode()
+
+
+PRIVATE_KEY, PUBLIC_KEY = make_key()
+OTHER_PRIVATE_KEY, OTHER_PUBLIC_KEY = make_key()
+
+
+def make_token(private_key=PRIVATE_KEY, expires_in=300):
+    """Create a signed JWT"""
+    claims = {'username' : 'sandy', 'exp' : int(time.time()) + expires_in}
+    return jwt.encode(claims, private_key, algorithm='RS256').encode()
+
+
+def key_response(public_key):
+    """Create the response the auth service sends for its public key"""
+    resp = MagicMock()
+    resp.read.return_value = ujson.dumps({'content' : {'key' : public_key, 'algorithm' : 'RS256', 'format' : 'pem'}})
+    return resp
+
+
+@patch.object(auth, 'HTTPConnection')
+class TestTokenVerifier(unittest.TestCase):
+    """A suite of test cases for the ``TokenVerifier`` object"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.verifier = auth.TokenVerifier(key_ttl=3600, cache_size=10, cache_ttl=60)
+
+    def test_valid(self, fake_HTTPConnection):
+        """``TokenVerifier`` accepts tokens signed by the auth service"""
+        fake_HTTPConnection.return_value.getresponse.return_value = key_response(PUBLIC_KEY)
+
+        self.assertTrue(self.verifier.verify(make_token()))
+
+    def test_forged(self, fake_HTTPConnection):
+        """``TokenVerifier`` rejects tokens not signed by the auth service"""
+        fake_HTTPConnection.return_value.getresponse.return_value = key_response(PUBLIC_KEY)
+
+        self.assertFalse(self.verifier.verify(make_token(private_key=OTHER_PRIVATE_KEY)))
+
+    def test_expired(self, fake_HTTPConnection):
+        """``TokenVerifier`` rejects expired tokens"""
+        fake_HTTPConnection.return_value.getresponse.return_value = key_response(PUBLIC_KEY)
+
+        self.assertFalse(self.verifier.verify(make_token(expires_in=-300)))
+
+    def test_garbage(self, fake_HTTPConnection):
+        """``TokenVerifier`` rejects tokens that aren't a JWT"""
+        fake_HTTPConnection.return_value.getresponse.return_value = key_response(PUBLIC_KEY)
+
+        self.assertFalse(self.verifier.verify(b'asdf.asdf.asdf'))
+
+    def test_cached_verdict(self, fake_HTTPConnection):
+        """``TokenVerifier`` remembers verdicts"""
+        fake_HTTPConnection.return_value.getresponse.return_value = key_response(PUBLIC_KEY)
+        token = make_token()
+        self.verifier.verify(token)
+        self.verifier.verify(token)
+
+        self.assertEqual(self.verifier.get_stats()['hits'], 1)
+        self.assertEqual(self.verifier.get_stats()['key_fetches'], 1)
+
+    def test_cache_size(self, fake_HTTPConnection):
+        """``TokenVerifier`` only remembers up to ``cache_size`` verdicts"""
+        fake_HTTPConnection.return_value.getresponse.return_value = key_response(PUBLIC_KEY)
+        for idx in range(20):
+            self.verifier.verify(b'asdf.asdf.%d' % idx)
+
+        self.assertEqual(self.verifier.get_stats()['cached'], 10)
+
+    def test_fail_open(self, fake_HTTPConnection):
+        """``TokenVerifier`` accepts tokens if the auth service cannot be reached"""
+        fake_HTTPConnection.return_value.request.side_effect = ConnectionRefusedError('testing')
+
+        self.assertTrue(self.verifier.verify(make_token(private_key=OTHER_PRIVATE_KEY)))
+        self.assertEqual(self.verifier.get_stats()['cached'], 0)
+
+    def test_key_timeout(self, fake_HTTPConnection):
+        """``TokenVerifier`` doesn't wait forever on the auth service for the public key"""
+        fake_HTTPConnection.return_value.getresponse.return_value = key_response(PUBLIC_KEY)
+        self.verifier.verify(make_token())
+
+        _, kwargs = fake_HTTPConnection.call_args
+        self.assertEqual(kwargs['timeout'], auth.const.VLAB_AUTH_KEY_TIMEOUT)
+
+    def test_no_rotation_spam(self, fake_HTTPConnection):
+        """``TokenVerifier`` doesn't refetch the public key for every bad signature"""
+        fake_HTTPConnection.return_value.getresponse.return_value = key_response(PUBLIC_KEY)
+        self.verifier.verify(make_token(private_key=OTHER_PRIVATE_KEY))
+        self.verifier.verify(make_token(private_key=OTHER_PRIVATE_KEY, expires_in=301))
+
+        self.assertEqual(self.verifier.get_stats()['key_fetches'], 1)
+
+    def test_key_rotation(self, fake_HTTPConnection):
+        """``TokenVerifier`` fetches the public key again when the auth service rotates it"""
+        fake_HTTPConnection.return_value.getresponse.side_effect = [key_response(PUBLIC_KEY),
+                                                                    key_response(OTHER_PUBLIC_KEY)]
+        self.verifier.verify(make_token())
+        self.verifier._key_fetched_at -= auth.MIN_KEY_REFRESH + 1
+
+        self.assertTrue(self.verifier.verify(make_token(private_key=OTHER_PRIVATE_KEY)))
+        self.assertEqual(self.verifier.get_stats()['key_fetches'], 2)
+
+
+@patch.object(auth, 'HTTPConnection')
+class TestTokenVerifierShared(unittest.TestCase):
+    """A suite of test cases for ``TokenVerifier`` when the shared cache is enabled"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache = shm_cache.SharedCache(os.path.join(self.tmpdir.name, 'cache'), slots=16)
+        self.patcher = patch.object(auth.shm_cache, 'CACHE', self.cache)
+        self.patcher.start()
+
+    def tearDown(self):
+        """Runs after every test case"""
+        self.patcher.stop()
+        self.cache.close()
+        self.tmpdir.cleanup()
+
+    def test_shared_verdict(self, fake_HTTPConnection):
+        """``TokenVerifier`` reuses verdicts made by other workers"""
+        fake_HTTPConnection.return_value.getresponse.return_value = key_response(PUBLIC_KEY)
+        token = make_token(private_key=OTHER_PRIVATE_KEY)
+        worker1 = auth.TokenVerifier(key_ttl=3600, cache_size=10, cache_ttl=60)
+        worker2 = auth.TokenVerifier(key_ttl=3600, cache_size=10, cache_ttl=60)
+        worker1.verify(token)
+
+        self.assertFalse(worker2.verify(token))
+        self.assertEqual(worker2.get_stats()['key_fetches'], 0)
+
+
+class TestGetVerifier(unittest.TestCase):
+    """A suite of test cases for the ``_get_verifier`` function"""
+
+    @patch.object(auth, 'const')
+    def test_disabled(self, fake_const):
+        """``_get_verifier`` returns None when verification is disabled"""
+        fake_const.VLAB_VERIFY_TOKENS = False
+
+        self.assertTrue(auth._get_verifier() is None)
+
+    @patch.object(auth, 'const')
+    def test_enabled(self, fake_const):
+        """``_get_verifier`` returns a TokenVerifier when verification is enabled"""
+        fake_const.VLAB_VERIFY_TOKENS = True
+
+        self.assertTrue(isinstance(auth._get_verifier(), auth.TokenVerifier))
+
+    @patch.object(auth, 'jwt', None)
+    @patch.object(auth, 'const')
+    def test_no_pyjwt(self, fake_const):
+        """``_get_verifier`` returns None when PyJWT is not installed"""
+        fake_const.VLAB_VERIFY_TOKENS = True
+
+        self.assertTrue(auth._get_verifier() is None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,213 @@
+# -*- coding: UTF-8 -*-
+"""A suite of unit tests for the ``capture.py`` module"""
+import os
+import gzip
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+import gevent
+
+from vlab_api_gateway import capture
+
+capture.logger = MagicMock() # prevent SPAM in output while running tests
+
+
+def fake_app(env, start_response):
+    """A WSGI application that always returns the same response"""
+    start_response('200 OK', [('Content-Type', 'application/json')])
+    return [b'{"content": ', b'{}}']
+
+
+class TestHelpers(unittest.TestCase):
+    """A suite of test cases for the sanitizing functions"""
+
+    def test_uri_template(self):
+        """``uri_template`` replaces IDs in the URI with a placeholder"""
+        uri = '/api/2/inf/onefs/1234/c0ffee00/10.7.1.1'
+        expected = '/api/2/inf/onefs/{id}/{id}/{id}'
+
+        self.assertEqual(capture.uri_template(uri), expected)
+
+    def test_uri_template_uuid(self):
+        """``uri_template`` replaces UUIDs in the URI"""
+        uri = '/api/1/ipam/5f0b9c61-0c36-4d6b-9a58-3a1e0f2b7c11'
+
+        self.assertEqual(capture.uri_template(uri), '/api/1/ipam/{id}')
+
+    def test_uri_template_static(self):
+        """``uri_template`` does not change URIs without IDs"""
+        uri = '/api/2/inf/onefs/image'
+
+        self.assertEqual(capture.uri_template(uri), uri)
+
+    def test_token_hash(self):
+        """``token_hash`` does not include the token"""
+        hashed = capture.token_hash(b'aa.bb.cc')
+
+        self.assertEqual(len(hashed), 16)
+        self.assertFalse('aa' in hashed)
+
+    def test_token_hash_no_token(self):
+        """``token_hash`` returns an empty string when there's no token"""
+        self.assertEqual(capture.token_hash(b''), '')
+
+
+class TestRecorder(unittest.TestCase):
+    """A suite of test cases for the ``Recorder`` object"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'capture.jsonl.gz')
+        self.recorder = capture.Recorder(self.path, batch_size=2, flush_interval=60)
+        self.env = {'REQUEST_METHOD' : 'POST',
+                    'PATH_INFO' : '/api/2/inf/onefs/1234',
+                    'QUERY_STRING' : 'verbose=true',
+                    'CONTENT_LENGTH' : '12',
+                    'HTTP_X_AUTH' : 'aa.bb.cc'}
+
+    def tearDown(self):
+        """Runs after every test case"""
+        self.recorder.close()
+        self.tmpdir.cleanup()
+
+    def _request(self):
+        resp = self.recorder.wrap(fake_app, self.env, MagicMock())
+        for _ in resp:
+            pass
+        resp.close()
+
+    def test_wrap(self):
+        """``Recorder.wrap`` records the shape of the request, not its contents"""
+        self._request()
+        self.recorder.flush()
+        record = capture.read_capture([self.path])[0]
+
+        self.assertEqual(record['method'], 'POST')
+        self.assertEqual(record['uri'], '/api/2/inf/onefs/{id}')
+        self.assertEqual(record['query'], ['verbose'])
+        self.assertEqual(record['resource'], 'onefs')
+        self.assertEqual(record['request_bytes'], 12)
+        self.assertEqual(record['response_bytes'], 15)
+        self.assertEqual(record['status'], 200)
+        self.assertEqual(record['token'], capture.token_hash(b'aa.bb.cc'))
+
+    def test_wrap_bad_length(self):
+        """``Recorder.wrap`` records a malformed Content-Length as no body"""
+        self.env['CONTENT_LENGTH'] = 'asdf'
+        self._request()
+        self.recorder.flush()
+
+        self.assertEqual(capture.read_capture([self.path])[0]['request_bytes'], 0)
+
+    def test_wrap_start_response(self):
+        """``Recorder.wrap`` passes along the status and headers"""
+        fake_start_response = MagicMock()
+
+        self.recorder.wrap(fake_app, self.env, fake_start_response)
+
+        fake_start_response.assert_called_with('200 OK', [('Content-Type', 'application/json')])
+
+    def test_batches(self):
+        """``Recorder`` only writes to the file once a batch is full"""
+        self._request()
+        size_before = os.path.getsize(self.path)
+        self._request()
+
+        self.assertEqual(size_before, 0)
+        self.assertEqual(len(capture.read_capture([self.path])), 2)
+
+    def test_flush_interval(self):
+        """``Recorder`` writes a partial batch once it's old"""
+        self.recorder.flush_interval = 0
+        self._request()
+
+        self.assertEqual(len(capture.read_capture([self.path])), 1)
+
+    def test_flusher_batch(self):
+        """``Recorder`` writes a full batch from the flusher, not the request"""
+        self.recorder.start_flusher()
+        self._request()
+        self._request()
+        size_before = os.path.getsize(self.path)
+        gevent.sleep(0)
+
+        self.assertEqual(size_before, 0)
+        self.assertEqual(len(capture.read_capture([self.path])), 2)
+
+    def test_flusher_interval(self):
+        """``Recorder`` writes a partial batch once it's old, even if no more requests arrive"""
+        self.recorder.flush_interval = 0.01
+        self.recorder.start_flusher()
+        self._request()
+        gevent.sleep(0.05)
+
+        self.assertEqual(len(capture.read_capture([self.path])), 1)
+
+    def test_close(self):
+        """``Recorder.close`` writes the buffered records, and is safe to call twice"""
+        self.recorder.start_flusher()
+        self._request()
+        self.recorder.close()
+        self.recorder.close()
+
+        self.assertEqual(len(capture.read_capture([self.path])), 1)
+
+    def test_close_once(self):
+        """``CapturedResponse`` only records the request once, even if closed twice"""
+        resp = self.recorder.wrap(fake_app, self.env, MagicMock())
+        resp.close()
+        resp.close()
+
+        self.assertEqual(self.recorder.get_stats()['recorded'], 1)
+
+    def test_compressed(self):
+        """``Recorder`` writes gzip compressed batches"""
+        self._request()
+        self._request()
+
+        with open(self.path, 'rb') as the_file:
+            self.assertEqual(the_file.read(2), b'\x1f\x8b')
+
+    def test_read_capture_order(self):
+        """``read_capture`` merges files in the order requests were received"""
+        other_path = os.path.join(self.tmpdir.name, 'other.jsonl.gz')
+        with open(self.path, 'wb') as the_file:
+            the_file.write(gzip.compress(b'{"ts": 3}\n{"ts": 1}\n'))
+        with open(other_path, 'wb') as the_file:
+            the_file.write(gzip.compress(b'{"ts": 2}\n'))
+
+        records = capture.read_capture([self.path, other_path])
+
+        self.assertEqual([x['ts'] for x in records], [1, 2, 3])
+
+    @patch.object(capture.os, 'write')
+    def test_write_error(self, fake_write):
+        """``Recorder`` drops the batch if it cannot be written"""
+        fake_write.side_effect = OSError('disk full')
+        self._request()
+        self._request()
+
+        self.assertEqual(self.recorder.get_stats()['errors'], 1)
+
+
+@patch.object(capture, 'const')
+class TestGetRecorder(unittest.TestCase):
+    """A suite of test cases for the ``_get_recorder`` function"""
+
+    def test_disabled(self, fake_const):
+        """``_get_recorder`` returns None when capturing is disabled"""
+        fake_const.VLAB_CAPTURE_DIR = ''
+
+        self.assertTrue(capture._get_recorder() is None)
+
+    def test_bad_dir(self, fake_const):
+        """``_get_recorder`` returns None when the capture file cannot be created"""
+        fake_const.VLAB_CAPTURE_DIR = '/no/such/dir'
+
+        self.assertTrue(capture._get_recorder() is None)
+
+
+if __name__ == '__main__':
+    unittest.main()
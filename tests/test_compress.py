@@ -0,0 +1,218 @@
+# -*- coding: UTF-8 -*-
+"""A suite of unit tests for the ``compress.py`` module"""
+import gzip
+import zlib
+import unittest
+from unittest.mock import MagicMock, patch
+
+from vlab_api_gateway import compress
+
+
+class TestChooseEncoding(unittest.TestCase):
+    """A suite of test cases for the ``choose_encoding`` function"""
+
+    def test_gzip(self):
+        """``choose_encoding`` prefers gzip"""
+        self.assertEqual(compress.choose_encoding('deflate, gzip, br'), 'gzip')
+
+    def test_deflate(self):
+        """``choose_encoding`` supports deflate"""
+        self.assertEqual(compress.choose_encoding('deflate'), 'deflate')
+
+    def test_quality_zero(self):
+        """``choose_encoding`` honors a q value of zero"""
+        self.assertEqual(compress.choose_encoding('gzip;q=0, deflate;q=0.5'), 'deflate')
+
+    def test_wildcard(self):
+        """``choose_encoding`` supports the wildcard"""
+        self.assertEqual(compress.choose_encoding('*'), 'gzip')
+
+    def test_none(self):
+        """``choose_encoding`` returns None when no supported encoding is accepted"""
+        self.assertTrue(compress.choose_encoding('br') is None)
+        self.assertTrue(compress.choose_encoding('') is None)
+
+
+@patch.object(compress, 'const')
+class TestNegotiate(unittest.TestCase):
+    """A suite of test cases for the ``negotiate`` function"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.env = {'REQUEST_METHOD' : 'GET', 'HTTP_ACCEPT_ENCODING' : 'gzip, deflate'}
+        self.headers = [('Content-Type', 'application/json'), ('Content-Length', '9001')]
+
+    def _configure(self, fake_const):
+        fake_const.VLAB_COMPRESSION = True
+        fake_const.VLAB_COMPRESSION_SERVICES = ()
+        fake_const.VLAB_COMPRESSION_MIN_SIZE = 1024
+
+    def test_json(self, fake_const):
+        """``negotiate`` compresses JSON"""
+        self._configure(fake_const)
+
+        self.assertEqual(compress.negotiate(self.env, 'inventory', '200 OK', self.headers), 'gzip')
+
+    def test_disabled(self, fake_const):
+        """``negotiate`` does nothing when compression is disabled"""
+        self._configure(fake_const)
+        fake_const.VLAB_COMPRESSION = False
+
+        self.assertTrue(compress.negotiate(self.env, 'inventory', '200 OK', self.headers) is None)
+
+    def test_services(self, fake_const):
+        """``negotiate`` only compresses responses of the configured services"""
+        self._configure(fake_const)
+        fake_const.VLAB_COMPRESSION_SERVICES = ('deployment',)
+
+        self.assertTrue(compress.negotiate(self.env, 'inventory', '200 OK', self.headers) is None)
+        self.assertEqual(compress.negotiate(self.env, 'deployment', '200 OK', self.headers), 'gzip')
+
+    def test_already_encoded(self, fake_const):
+        """``negotiate`` doesn't compress a response the back-end already encoded"""
+        self._configure(fake_const)
+        self.headers.append(('Content-Encoding', 'br'))
+
+        self.assertTrue(compress.negotiate(self.env, 'inventory', '200 OK', self.headers) is None)
+
+    def test_no_transform(self, fake_const):
+        """``negotiate`` doesn't compress a response marked Cache-Control: no-transform"""
+        self._configure(fake_const)
+        self.headers.append(('Cache-Control', 'private, no-transform'))
+
+        self.assertTrue(compress.negotiate(self.env, 'inventory', '200 OK', self.headers) is None)
+
+    def test_not_accepted(self, fake_const):
+        """``negotiate`` doesn't compress when the client didn't ask for it"""
+        self._configure(fake_const)
+        self.env.pop('HTTP_ACCEPT_ENCODING')
+
+        self.assertTrue(compress.negotiate(self.env, 'inventory', '200 OK', self.headers) is None)
+
+    def test_content_type(self, fake_const):
+        """``negotiate`` doesn't compress content that's already compressed, or streamed"""
+        self._configure(fake_const)
+
+        for content_type in ('image/png', 'application/octet-stream', 'text/event-stream'):
+            headers = [('Content-Type', content_type)]
+            self.assertTrue(compress.negotiate(self.env, 'inventory', '200 OK', headers) is None)
+
+    def test_small(self, fake_const):
+        """``negotiate`` doesn't compress tiny responses"""
+        self._configure(fake_const)
+        headers = [('Content-Type', 'application/json'), ('Content-Length', '12')]
+
+        self.assertTrue(compress.negotiate(self.env, 'inventory', '200 OK', headers) is None)
+
+    def test_no_body(self, fake_const):
+        """``negotiate`` doesn't compress responses without a body"""
+        self._configure(fake_const)
+        self.env['REQUEST_METHOD'] = 'HEAD'
+
+        self.assertTrue(compress.negotiate(self.env, 'inventory', '200 OK', self.headers) is None)
+        self.env['REQUEST_METHOD'] = 'GET'
+        for status in ('101 Switching Protocols', '204 No Content', '304 Not Modified', '206 Partial Content'):
+            self.assertTrue(compress.negotiate(self.env, 'inventory', status, self.headers) is None)
+
+
+class TestCompressedHeaders(unittest.TestCase):
+    """A suite of test cases for the ``compressed_headers`` function"""
+
+    def test_headers(self):
+        """``compressed_headers`` drops Content-Length, and adds Content-Encoding and Vary"""
+        headers = [('Content-Type', 'application/json'), ('Content-Length', '9001')]
+
+        new_headers = compress.compressed_headers(headers, 'gzip')
+        expected = [('Content-Type', 'application/json'), ('Vary', 'Accept-Encoding'),
+                    ('Content-Encoding', 'gzip')]
+
+        self.assertEqual(new_headers, expected)
+
+    def test_existing_vary(self):
+        """``compressed_headers`` adds to an existing Vary header"""
+        headers = [('Vary', 'Origin')]
+
+        new_headers = compress.compressed_headers(headers, 'gzip')
+
+        self.assertTrue(('Vary', 'Origin, Accept-Encoding') in new_headers)
+
+    def test_etag(self):
+        """``compressed_headers`` makes a strong ETag weak"""
+        headers = [('ETag', '"abc"')]
+
+        new_headers = compress.compressed_headers(headers, 'gzip')
+
+        self.assertTrue(('ETag', 'W/"abc"') in new_headers)
+
+    def test_identity(self):
+        """``compressed_headers`` replaces a Content-Encoding of identity"""
+        headers = [('Content-Encoding', 'identity')]
+
+        new_headers = compress.compressed_headers(headers, 'gzip')
+
+        self.assertEqual(new_headers, [('Vary', 'Accept-Encoding'), ('Content-Encoding', 'gzip')])
+
+
+class TestCompressedResponse(unittest.TestCase):
+    """A suite of test cases for the ``CompressedResponse`` object"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.body = [b'{"content": {', b'"vm1": "poweredOn", ' * 500, b'}}']
+
+    def test_gzip(self):
+        """``CompressedResponse`` outputs a valid gzip stream"""
+        resp = compress.CompressedResponse(MagicMock(__iter__=lambda x: iter(self.body)), 'gzip', 6)
+
+        self.assertEqual(gzip.decompress(b''.join(resp)), b''.join(self.body))
+
+    def test_deflate(self):
+        """``CompressedResponse`` outputs a valid (zlib wrapped) deflate stream"""
+        resp = compress.CompressedResponse(MagicMock(__iter__=lambda x: iter(self.body)), 'deflate', 6)
+
+        self.assertEqual(zlib.decompress(b''.join(resp)), b''.join(self.body))
+
+    def test_flush_blocks(self):
+        """``CompressedResponse`` sends all of a block when the next one isn't ready"""
+        upstream = MagicMock(__iter__=lambda x: iter(self.body))
+        upstream.would_block.return_value = True
+        resp = compress.CompressedResponse(upstream, 'gzip', 6)
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+        first = decompressor.decompress(next(iter(resp)))
+
+        self.assertEqual(first, self.body[0])
+
+    def test_no_flush_ready(self):
+        """``CompressedResponse`` doesn't flush between blocks that are ready, so they compress well"""
+        upstream = MagicMock(__iter__=lambda x: iter(self.body))
+        upstream.would_block.return_value = False
+        resp = compress.CompressedResponse(upstream, 'gzip', 6)
+        whole = zlib.compressobj(6, zlib.DEFLATED, compress.ENCODINGS['gzip'])
+
+        expected = whole.compress(b''.join(self.body)) + whole.flush()
+
+        self.assertEqual(b''.join(resp), expected)
+
+    def test_bytes_saved(self):
+        """``CompressedResponse`` records the bytes saved once closed"""
+        before = compress.get_stats()['bytes_saved']
+        resp = compress.CompressedResponse(MagicMock(__iter__=lambda x: iter(self.body)), 'gzip', 6)
+        for _ in resp:
+            pass
+        resp.close()
+
+        self.assertTrue(compress.get_stats()['bytes_saved'] > before)
+
+    def test_close(self):
+        """``CompressedResponse`` closes the response from the back-end, once"""
+        upstream = MagicMock()
+        resp = compress.CompressedResponse(upstream, 'gzip', 6)
+        resp.close()
+        resp.close()
+
+        self.assertEqual(upstream.close.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
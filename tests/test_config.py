@@ -1,6 +1,7 @@
 # -*- coding: UTF-8 -*-
 """A suite of unit tests for the config.py module"""
 import unittest
+from unittest.mock import MagicMock, patch
 
 from vlab_api_gateway import config
 
@@ -27,12 +28,52 @@ class TestConfig(unittest.TestCase):
         expected = 'vlab-api-gateway'
         self.assertEqual(config.name, expected)
 
+    def test_graceful_timeout(self):
+        """``config`` gives workers the drain timeout to finish in-flight requests"""
+        expected = config.const.VLAB_DRAIN_TIMEOUT
+        self.assertEqual(config.graceful_timeout, expected)
+
+    @patch('vlab_api_gateway.capture.RECORDER')
+    @patch('vlab_api_gateway.pool.POOL')
+    @patch('vlab_api_gateway.drain.install_signal_handler')
+    @patch('vlab_api_gateway.profiler.install_signal_handler')
+    def test_post_worker_init(self, fake_install_signal_handler, fake_install_drain_handler, fake_POOL, fake_RECORDER):
+        """``config`` installs the signal handlers, and starts the pool reaper and capture flusher in every worker"""
+        config.post_worker_init(MagicMock())
+
+        self.assertTrue(fake_install_signal_handler.called)
+        self.assertTrue(fake_install_drain_handler.called)
+        self.assertTrue(fake_POOL.start_reaper.called)
+        self.assertTrue(fake_RECORDER.start_flusher.called)
+
+    @patch('vlab_api_gateway.drain.TRACKER')
+    def test_post_request(self, fake_TRACKER):
+        """``config`` drains a worker once gunicorn decides to recycle it"""
+        worker = MagicMock()
+        worker.alive = True
+        config.post_request(worker, MagicMock(), {}, MagicMock())
+
+        self.assertFalse(fake_TRACKER.start_drain.called)
+
+        worker.alive = False
+        config.post_request(worker, MagicMock(), {}, MagicMock())
+
+        fake_TRACKER.start_drain.assert_called_with(config.const.VLAB_DRAIN_TIMEOUT)
+
+    @patch('vlab_api_gateway.capture.RECORDER')
+    def test_worker_exit(self, fake_RECORDER):
+        """``config`` writes the buffered capture records when a worker exits"""
+        config.worker_exit(MagicMock(), MagicMock())
+
+        self.assertTrue(fake_RECORDER.close.called)
+
     def test_number_of_parameters(self):
         """``config`` contains the expected number of defined parameters"""
         std_python_attrs = ['__builtins__', '__cached__', '__doc__', '__file__', '__loader__', '__name__', '__package__', '__spec__']
 
         defined_params = [x for x in dir(config) if x not in std_python_attrs]
-        expected = ['bind', 'name', 'worker_class', 'workers']
+        expected = ['bind', 'name', 'worker_class', 'workers', 'graceful_timeout',
+                    'post_worker_init', 'post_request', 'worker_exit', 'const']
 
         # set() prevents false positives due to ordering
         self.assertEqual(set(defined_params), set(expected))
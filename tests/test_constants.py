@@ -30,13 +30,70 @@ class TestGetSSLContext(unittest.TestCase):
         self.assertEqual(context.verify_mode, ssl.CERT_REQUIRED)
 
 
+class TestEnvHelpers(unittest.TestCase):
+    """A suite of test cases for the ``_get_bool``, ``_get_int`` and ``_get_list`` functions"""
+
+    @classmethod
+    def tearDown(cls):
+        """Runs after every test case"""
+        os.environ.pop('VLAB_TESTING', None)
+
+    def test_get_bool(self):
+        """``_get_bool`` is case insensitive"""
+        os.environ['VLAB_TESTING'] = 'True'
+
+        self.assertTrue(constants._get_bool('VLAB_TESTING'))
+
+    def test_get_bool_default(self):
+        """``_get_bool`` uses the default when the variable is not set"""
+        self.assertFalse(constants._get_bool('VLAB_TESTING'))
+
+    def test_get_int(self):
+        """``_get_int`` converts the variable to an integer"""
+        os.environ['VLAB_TESTING'] = '42'
+
+        self.assertEqual(constants._get_int('VLAB_TESTING', 1), 42)
+
+    def test_get_int_invalid(self):
+        """``_get_int`` uses the default when the variable is not a number"""
+        os.environ['VLAB_TESTING'] = 'lots'
+
+        self.assertEqual(constants._get_int('VLAB_TESTING', 1), 1)
+
+    def test_get_list(self):
+        """``_get_list`` splits the variable on commas"""
+        os.environ['VLAB_TESTING'] = 'inventory, deployment,'
+
+        self.assertEqual(constants._get_list('VLAB_TESTING'), ('inventory', 'deployment'))
+
+    def test_get_list_default(self):
+        """``_get_list`` returns an empty tuple when the variable is not set"""
+        self.assertEqual(constants._get_list('VLAB_TESTING'), ())
+
+
 class TestConst(unittest.TestCase):
     """A suite of test cases for the ``const`` attribute"""
 
     def test_keys(self):
         """``const`` has the expected number of defined constants"""
         found = [x for x in dir(constants.const) if x.startswith('VLAB')]
-        expected = ['VLAB_FQDN', 'VLAB_SSL_CONTEXT']
+        expected = ['VLAB_FQDN', 'VLAB_SSL_CONTEXT', 'VLAB_RESPONSE_BUFFERING',
+                    'VLAB_RESPONSE_BUFFER_MEMORY', 'VLAB_RESPONSE_BUFFER_DISK',
+                    'VLAB_REQUEST_BLOCK_SIZE', 'VLAB_REQUEST_MAX_BODY',
+                    'VLAB_REQUEST_SPOOLING', 'VLAB_REQUEST_SPOOL_MEMORY',
+                    'VLAB_UPSTREAM_KEEPALIVE', 'VLAB_POOL_MAX_CONNECTIONS',
+                    'VLAB_POOL_MAX_PER_HOST', 'VLAB_POOL_IDLE_TIMEOUT',
+                    'VLAB_VERIFY_TOKENS', 'VLAB_AUTH_KEY_URI', 'VLAB_AUTH_KEY_TTL',
+                    'VLAB_AUTH_KEY_TIMEOUT',
+                    'VLAB_TOKEN_CACHE_SIZE', 'VLAB_TOKEN_CACHE_TTL',
+                    'VLAB_SHM_CACHE_PATH', 'VLAB_SHM_CACHE_SLOTS', 'VLAB_DNS_CACHE_TTL',
+                    'VLAB_ADMIN_TOKEN', 'VLAB_PROFILE_INTERVAL', 'VLAB_PROFILE_BLOCK_MS',
+                    'VLAB_PROFILE_SECONDS', 'VLAB_PROFILE_DIR', 'VLAB_CAPTURE_DIR',
+                    'VLAB_CAPTURE_BATCH', 'VLAB_CAPTURE_FLUSH_SECONDS',
+                    'VLAB_TUNNEL_MAX_PER_HOST', 'VLAB_TUNNEL_IDLE_TIMEOUT',
+                    'VLAB_TUNNEL_BUFFER_SIZE', 'VLAB_DRAIN_TIMEOUT', 'VLAB_COMPRESSION',
+                    'VLAB_COMPRESSION_LEVEL', 'VLAB_COMPRESSION_MIN_SIZE',
+                    'VLAB_COMPRESSION_SERVICES']
 
         # set() so ordering doesn't cause false faliures
         self.assertEqual(set(found), set(expected))
@@ -0,0 +1,153 @@
+# -*- coding: UTF-8 -*-
+"""A suite of unit tests for the ``drain.py`` module"""
+import signal
+import unittest
+from unittest.mock import MagicMock, patch
+
+import gevent
+
+from vlab_api_gateway import drain
+
+drain.logger = MagicMock() # prevent SPAM in output while running tests
+
+
+def fake_app(env, start_response):
+    """A WSGI application that always returns the same response"""
+    start_response('200 OK', [])
+    return MagicMock()
+
+
+def broken_app(env, start_response):
+    """A WSGI application that always fails"""
+    raise RuntimeError('doh')
+
+
+@patch.object(drain, 'pool')
+class TestTracker(unittest.TestCase):
+    """A suite of test cases for the ``Tracker`` object"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.tracker = drain.Tracker()
+
+    def test_in_flight(self, fake_pool):
+        """``Tracker`` counts a request as in flight until its response is closed"""
+        resp = self.tracker.track(fake_app, {}, MagicMock())
+
+        self.assertEqual(self.tracker.in_flight, 1)
+
+        resp.close()
+
+        self.assertEqual(self.tracker.in_flight, 0)
+
+    def test_close_twice(self, fake_pool):
+        """``TrackedResponse`` only counts a request as finished once"""
+        resp = self.tracker.track(fake_app, {}, MagicMock())
+        resp.close()
+        resp.close()
+
+        self.assertEqual(self.tracker.in_flight, 0)
+
+    def test_closes_response(self, fake_pool):
+        """``TrackedResponse`` closes the response of the application"""
+        resp = self.tracker.track(fake_app, {}, MagicMock())
+        inner = resp._resp
+        resp.close()
+
+        self.assertTrue(inner.close.called)
+
+    def test_app_error(self, fake_pool):
+        """``Tracker`` does not count a request that failed as in flight"""
+        with self.assertRaises(RuntimeError):
+            self.tracker.track(broken_app, {}, MagicMock())
+
+        self.assertEqual(self.tracker.in_flight, 0)
+
+    def test_drain_not_ready(self, fake_pool):
+        """``Tracker`` is not ready once it's draining"""
+        self.tracker.start_drain(deadline=1)
+
+        self.assertFalse(self.tracker.is_ready())
+
+    def test_drain_closes_pool(self, fake_pool):
+        """``Tracker`` closes idle back-end connections when draining"""
+        self.tracker.start_drain(deadline=1)
+        gevent.sleep(0)
+
+        self.assertTrue(fake_pool.POOL.close.called)
+
+    def test_drained(self, fake_pool):
+        """``Tracker`` counts the requests that finish while draining"""
+        resp = self.tracker.track(fake_app, {}, MagicMock())
+        self.tracker.start_drain(deadline=1)
+        resp.close()
+
+        self.assertEqual(self.tracker.get_stats()['drained'], 1)
+
+    @patch.object(drain, 'CHECK_INTERVAL', 0.01)
+    def test_deadline(self, fake_pool):
+        """``Tracker`` logs the requests that didn't finish before the deadline"""
+        self.tracker.track(fake_app, {}, MagicMock())
+        self.tracker.start_drain(deadline=0.05)
+        gevent.sleep(0.1)
+
+        self.assertTrue(drain.logger.error.called)
+
+
+class TestReady(unittest.TestCase):
+    """A suite of test cases for the ``ready`` function"""
+
+    @patch.object(drain, 'TRACKER')
+    def test_ready(self, fake_TRACKER):
+        """``ready`` returns HTTP 200 while the worker is accepting requests"""
+        fake_TRACKER.is_ready.return_value = True
+        fake_start_response = MagicMock()
+
+        drain.ready(fake_start_response)
+        call_args, _ = fake_start_response.call_args
+
+        self.assertEqual(call_args[0], '200 OK')
+
+    @patch.object(drain, 'TRACKER')
+    def test_not_ready(self, fake_TRACKER):
+        """``ready`` returns HTTP 503 while the worker is draining"""
+        fake_TRACKER.is_ready.return_value = False
+        fake_start_response = MagicMock()
+
+        drain.ready(fake_start_response)
+        call_args, _ = fake_start_response.call_args
+
+        self.assertEqual(call_args[0], '503 Service Unavailable')
+
+
+@patch.object(drain, 'TRACKER')
+@patch.object(drain, 'signal')
+class TestSignal(unittest.TestCase):
+    """A suite of test cases for draining on SIGTERM"""
+
+    def test_chains_handler(self, fake_signal, fake_TRACKER):
+        """``install_signal_handler`` still calls gunicorn's SIGTERM handler"""
+        previous = MagicMock()
+        fake_signal.getsignal.return_value = previous
+        drain.install_signal_handler()
+        args, _ = fake_signal.signal.call_args
+        handler = args[1]
+
+        handler(signal.SIGTERM, None)
+
+        self.assertTrue(fake_TRACKER.start_drain.called)
+        self.assertTrue(previous.called)
+
+    def test_default_handler(self, fake_signal, fake_TRACKER):
+        """``install_signal_handler`` works when there's no previous handler"""
+        fake_signal.getsignal.return_value = signal.SIG_DFL
+        drain.install_signal_handler()
+        args, _ = fake_signal.signal.call_args
+
+        args[1](signal.SIGTERM, None)
+
+        self.assertTrue(fake_TRACKER.start_drain.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+# -*- coding: UTF-8 -*-
+"""A suite of unit tests for the ``pool.py`` module"""
+import socket
+import unittest
+from unittest.mock import MagicMock, patch
+
+import gevent
+
+from vlab_api_gateway import pool
+
+
+@patch.object(pool, '_is_stale', lambda conn: False)
+class TestConnectionPool(unittest.TestCase):
+    """A suite of test cases for the ``ConnectionPool`` object"""
+
+    def test_reuse(self):
+        """``ConnectionPool`` returns idle connections for the same host"""
+        the_pool = pool.ConnectionPool(max_connections=10, max_per_host=2, idle_timeout=30)
+        conn = MagicMock()
+        the_pool.put(('sandy.vlab.local', 443, True), conn)
+
+        self.assertTrue(the_pool.get(('sandy.vlab.local', 443, True)) is conn)
+
+    def test_miss(self):
+        """``ConnectionPool`` returns None when there are no idle connections for a host"""
+        the_pool = pool.ConnectionPool(max_connections=10, max_per_host=2, idle_timeout=30)
+        the_pool.put(('sandy.vlab.local', 443, True), MagicMock())
+
+        self.assertTrue(the_pool.get(('bob.vlab.local', 443, True)) is None)
+        self.assertEqual(the_pool.get_stats()['misses'], 1)
+
+    def test_per_host_cap(self):
+        """``ConnectionPool`` closes connections beyond the per-host cap"""
+        the_pool = pool.ConnectionPool(max_connections=10, max_per_host=1, idle_timeout=30)
+        extra_conn = MagicMock()
+        the_pool.put(('sandy.vlab.local', 443, True), MagicMock())
+        the_pool.put(('sandy.vlab.local', 443, True), extra_conn)
+
+        self.assertEqual(len(the_pool), 1)
+        self.assertTrue(extra_conn.close.called)
+
+    def test_lru_eviction(self):
+        """``ConnectionPool`` evicts the least recently used host when over budget"""
+        the_pool = pool.ConnectionPool(max_connections=2, max_per_host=2, idle_timeout=30)
+        old_conn = MagicMock()
+        the_pool.put(('sandy.vlab.local', 443, True), old_conn)
+        the_pool.put(('bob.vlab.local', 443, True), MagicMock())
+        the_pool.put(('alice.vlab.local', 443, True), MagicMock())
+
+        self.assertEqual(len(the_pool), 2)
+        self.assertTrue(old_conn.close.called)
+        self.assertEqual(the_pool.get_stats()['evicted'], 1)
+
+    @patch.object(pool.time, 'monotonic')
+    def test_reap_idle_hosts(self, fake_monotonic):
+        """``ConnectionPool`` closes connections to hosts that have been idle too long"""
+        the_pool = pool.ConnectionPool(max_connections=10, max_per_host=2, idle_timeout=30)
+        idle_conn = MagicMock()
+        fake_monotonic.return_value = 100
+        the_pool.put(('sandy.vlab.local', 443, True), idle_conn)
+        fake_monotonic.return_value = 200
+        the_pool.put(('bob.vlab.local', 443, True), MagicMock())
+
+        self.assertTrue(idle_conn.close.called)
+        self.assertEqual(the_pool.get_stats()['hosts'], 1)
+
+    @patch.object(pool.time, 'monotonic')
+    def test_expired_conn(self, fake_monotonic):
+        """``ConnectionPool`` doesn't hand out connections older than the idle timeout"""
+        the_pool = pool.ConnectionPool(max_connections=10, max_per_host=2, idle_timeout=30)
+        fake_monotonic.return_value = 100
+        the_pool.put(('sandy.vlab.local', 443, True), MagicMock())
+        fake_monotonic.return_value = 200
+
+        self.assertTrue(the_pool.get(('sandy.vlab.local', 443, True)) is None)
+
+    @patch.object(pool.time, 'monotonic')
+    def test_reap_behind_active_host(self, fake_monotonic):
+        """``reap`` closes expired connections, even behind a host that's still active"""
+        the_pool = pool.ConnectionPool(max_connections=10, max_per_host=2, idle_timeout=30)
+        old_conn, new_conn = MagicMock(), MagicMock()
+        fake_monotonic.return_value = 100
+        the_pool.put(('sandy.vlab.local', 443, True), old_conn)
+        the_pool.put(('sandy.vlab.local', 443, True), MagicMock())
+        fake_monotonic.return_value = 120
+        the_pool.put(('bob.vlab.local', 443, True), new_conn)
+        # moves sandy behind bob, but its remaining connection is as old as ever
+        the_pool.get(('sandy.vlab.local', 443, True))
+        fake_monotonic.return_value = 140
+        the_pool.reap()
+
+        self.assertTrue(old_conn.close.called)
+        self.assertFalse(new_conn.close.called)
+        self.assertEqual(len(the_pool), 1)
+
+    def test_reaper(self):
+        """``ConnectionPool`` reaps idle connections without any requests arriving"""
+        the_pool = pool.ConnectionPool(max_connections=10, max_per_host=2, idle_timeout=0.01)
+        conn = MagicMock()
+        the_pool.put(('sandy.vlab.local', 443, True), conn)
+        the_pool.start_reaper(interval=0.01)
+        gevent.sleep(0.05)
+        the_pool.close()
+
+        self.assertTrue(conn.close.called)
+        self.assertEqual(the_pool.get_stats()['reaped'], 1)
+
+    def test_clear(self):
+        """``ConnectionPool`` can close every idle connection"""
+        the_pool = pool.ConnectionPool(max_connections=10, max_per_host=2, idle_timeout=30)
+        conn = MagicMock()
+        the_pool.put(('sandy.vlab.local', 443, True), conn)
+        the_pool.clear()
+
+        self.assertEqual(len(the_pool), 0)
+        self.assertTrue(conn.close.called)
+
+    def test_close(self):
+        """``ConnectionPool`` closes connections returned after the pool is closed"""
+        the_pool = pool.ConnectionPool(max_connections=10, max_per_host=2, idle_timeout=30)
+        the_pool.close()
+        conn = MagicMock()
+        the_pool.put(('sandy.vlab.local', 443, True), conn)
+
+        self.assertEqual(len(the_pool), 0)
+        self.assertTrue(conn.close.called)
+
+
+class TestIsStale(unittest.TestCase):
+    """A suite of test cases for the ``_is_stale`` function"""
+
+    def test_no_socket(self):
+        """``_is_stale`` returns True if the connection has no socket"""
+        conn = MagicMock()
+        conn.sock = None
+
+        self.assertTrue(pool._is_stale(conn))
+
+    def test_idle(self):
+        """``_is_stale`` returns False for an idle, open socket"""
+        conn = MagicMock()
+        conn.sock, peer = socket.socketpair()
+        try:
+            self.assertFalse(pool._is_stale(conn))
+        finally:
+            conn.sock.close()
+            peer.close()
+
+    def test_closed_by_peer(self):
+        """``_is_stale`` returns True when the back-end closed the socket"""
+        conn = MagicMock()
+        conn.sock, peer = socket.socketpair()
+        peer.close()
+        try:
+            self.assertTrue(pool._is_stale(conn))
+        finally:
+            conn.sock.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
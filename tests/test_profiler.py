@@ -0,0 +1,120 @@
+# -*- coding: UTF-8 -*-
+"""A suite of unit tests for the ``profiler.py`` module"""
+import os
+import time
+import signal
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+import gevent
+
+from vlab_api_gateway import profiler
+
+profiler.logger = MagicMock() # prevent SPAM in output while running tests
+
+
+def busy(seconds):
+    """Hog the CPU without yielding to other greenlets"""
+    profiler.tag('inventory')
+    stop_at = time.perf_counter() + seconds
+    while time.perf_counter() < stop_at:
+        pass
+
+
+class TestProfiler(unittest.TestCase):
+    """A suite of test cases for the ``Profiler`` object"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.profiler = profiler.Profiler(interval=1, block_threshold=20)
+        self.patcher = patch.object(profiler, 'PROFILER', self.profiler)
+        self.patcher.start()
+
+    def tearDown(self):
+        """Runs after every test case"""
+        self.patcher.stop()
+
+    def test_samples(self):
+        """``Profiler`` samples the running greenlet"""
+        gevent.spawn(busy, 0.05)
+        self.profiler.profile(0.1)
+
+        self.assertTrue(sum(self.profiler.samples.values()) > 0)
+
+    def test_collapsed_format(self):
+        """``Profiler`` outputs samples in the collapsed-stack format"""
+        gevent.spawn(busy, 0.05)
+        stacks = self.profiler.profile(0.1)
+        stack, count = stacks.splitlines()[0].rsplit(' ', 1)
+
+        self.assertTrue(int(count) > 0)
+        self.assertTrue(';' in stack)
+
+    def test_resource(self):
+        """``Profiler`` attributes samples to the resource the greenlet was handling"""
+        gevent.spawn(busy, 0.05)
+        stacks = self.profiler.profile(0.1)
+        resources = [x.split(';')[1] for x in stacks.splitlines()]
+
+        self.assertTrue('inventory' in resources)
+
+    def test_blocking(self):
+        """``Profiler`` reports greenlets that don't yield to the event loop"""
+        gevent.spawn(busy, 0.05)
+        self.profiler.profile(0.1)
+        blocking = self.profiler.report()['blocking']
+
+        self.assertEqual(len(blocking), 1)
+        self.assertEqual(blocking[0]['resource'], 'inventory')
+        self.assertTrue(blocking[0]['ms'] >= 50)
+
+    def test_stops_tracing(self):
+        """``Profiler`` stops the sampler thread when the profile ends"""
+        self.profiler.profile(0.01)
+
+        self.assertFalse(self.profiler.running)
+        self.assertTrue(self.profiler._sampler_done)
+
+    def test_tag_not_running(self):
+        """``tag`` does nothing when no profile is running"""
+        profiler.tag('inventory')
+
+        self.assertEqual(len(profiler.TAGS), 0)
+
+
+class TestSignal(unittest.TestCase):
+    """A suite of test cases for profiling via a signal"""
+
+    @patch.object(profiler, 'const')
+    def test_profile_to_file(self, fake_const):
+        """``_profile_to_file`` saves the collapsed stacks"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fake_const.VLAB_PROFILE_DIR = tmpdir
+            gevent.spawn(busy, 0.02)
+            with patch.object(profiler, 'PROFILER', profiler.Profiler(interval=1, block_threshold=10)):
+                profiler._profile_to_file(0.05)
+            saved = os.listdir(tmpdir)
+
+        self.assertEqual(len(saved), 1)
+        self.assertTrue(saved[0].endswith('.folded'))
+
+    @patch.object(profiler, 'gevent')
+    def test_handle_signal(self, fake_gevent):
+        """``handle_signal`` runs the profile in a new greenlet"""
+        profiler.handle_signal(signal.SIGUSR2, None)
+
+        self.assertTrue(fake_gevent.spawn.called)
+
+    @patch.object(profiler, 'signal')
+    def test_install_signal_handler(self, fake_signal):
+        """``install_signal_handler`` defaults to SIGUSR2"""
+        profiler.install_signal_handler()
+
+        args, _ = fake_signal.signal.call_args
+
+        self.assertEqual(args, (signal.SIGUSR2, profiler.handle_signal))
+
+
+if __name__ == '__main__':
+    unittest.main()
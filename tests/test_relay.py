@@ -2,10 +2,10 @@
 """A suite of unit tests for the ``relay.py`` module"""
 import unittest
 from unittest.mock import MagicMock, patch
-from io import StringIO
+from io import StringIO, BytesIO
 from socket import gaierror
 
-from vlab_api_gateway import relay
+from vlab_api_gateway import relay, upload, upstream
 
 relay.logger = MagicMock() # prevent SPAM in output while running tests
 
@@ -168,6 +168,368 @@ class TestRelay(unittest.TestCase):
 
         self.assertEqual(resp.status, expected_status)
 
+    @patch.object(relay, 'HTTPConnection')
+    def test_bad_response(self, fake_HTTPConnection):
+        """An invalid response from the upstream host returns HTTP 502 Bad Gateway"""
+        fake_conn = MagicMock()
+        fake_conn.getresponse.side_effect = [upstream.BadResponse('testing')]
+        fake_HTTPConnection.return_value = fake_conn
+
+        resp = relay.RelayQuery(host='fooHost',
+                                uri='/foo',
+                                method='GET',
+                                headers={},
+                                body=None,
+                                port=5000)
+        resp.close()
+
+        self.assertEqual(resp.status, '502 Bad Gateway')
+        self.assertTrue(fake_conn.close.called)
+
+    @patch.object(relay, 'HTTPConnection')
+    def test_buffering(self, fake_HTTPConnection):
+        """The Relay object releases the back-end socket once the response is buffered"""
+        fake_resp = MagicMock()
+        fake_resp.read.side_effect = [b'some data', b'']
+        fake_conn = MagicMock()
+        fake_conn.getresponse.return_value = fake_resp
+        fake_HTTPConnection.return_value = fake_conn
+
+        resp = relay.RelayQuery(host='fooHost',
+                                uri='/foo',
+                                method='GET',
+                                headers={},
+                                body=StringIO('{}'),
+                                port=5000,
+                                buffering=True)
+
+        self.assertTrue(fake_conn.close.called)
+
+    @patch.object(relay, 'HTTPConnection')
+    def test_buffering_stream(self, fake_HTTPConnection):
+        """The Relay object streams a response of unknown size, even when buffering"""
+        fake_resp = MagicMock()
+        fake_resp.length = None
+        fake_conn = MagicMock()
+        fake_conn.getresponse.return_value = fake_resp
+        fake_HTTPConnection.return_value = fake_conn
+
+        relay.RelayQuery(host='fooHost',
+                         uri='/foo',
+                         method='GET',
+                         headers={},
+                         body=None,
+                         port=5000,
+                         buffering=True)
+
+        self.assertFalse(fake_resp.read.called)
+        self.assertFalse(fake_conn.close.called)
+
+    @patch.object(relay, 'HTTPConnection')
+    def test_would_block(self, fake_HTTPConnection):
+        """The Relay object asks the back-end response if more of the body is ready"""
+        fake_resp = MagicMock()
+        fake_resp.would_block.return_value = True
+        fake_conn = MagicMock()
+        fake_conn.getresponse.return_value = fake_resp
+        fake_HTTPConnection.return_value = fake_conn
+
+        resp = relay.RelayQuery(host='fooHost',
+                                uri='/foo',
+                                method='GET',
+                                headers={},
+                                body=None,
+                                port=5000,
+                                buffering=False)
+
+        self.assertTrue(resp.would_block())
+
+    def test_would_block_error(self):
+        """The Relay object never blocks on a response the gateway made itself"""
+        resp = relay.RelayQuery(host=None, uri='/foo', method='GET', headers={}, body=None, port=5000)
+
+        self.assertFalse(resp.would_block())
+
+    @patch.object(relay, 'HTTPConnection')
+    def test_buffering_body(self, fake_HTTPConnection):
+        """The Relay object sends the buffered response body to the client"""
+        fake_resp = MagicMock()
+        fake_resp.read.side_effect = [b'some\ndata', b'']
+        fake_conn = MagicMock()
+        fake_conn.getresponse.return_value = fake_resp
+        fake_HTTPConnection.return_value = fake_conn
+
+        resp = relay.RelayQuery(host='fooHost',
+                                uri='/foo',
+                                method='GET',
+                                headers={},
+                                body=StringIO('{}'),
+                                port=5000,
+                                buffering=True)
+        body = b''.join(list(resp))
+        resp.close()
+
+        self.assertEqual(body, b'some\ndata')
+
+    @patch.object(relay, 'HTTPConnection')
+    def test_body_too_large(self, fake_HTTPConnection):
+        """The Relay object returns HTTP 413 when a streamed body exceeds the max size"""
+        fake_conn = MagicMock()
+        fake_conn.request.side_effect = [relay.BodyTooLarge(10)]
+        fake_HTTPConnection.return_value = fake_conn
+
+        resp = relay.RelayQuery(host='fooHost',
+                                uri='/foo',
+                                method='POST',
+                                headers={},
+                                body=StringIO('{}'),
+                                port=5000)
+
+        self.assertEqual(resp.status, '413 Payload Too Large')
+
+    @patch.object(relay, 'HTTPConnection')
+    def test_replay_body(self, fake_HTTPConnection):
+        """The Relay object resends spooled bodies if the back-end connection drops while sending"""
+        fake_resp = MagicMock()
+        fake_resp.status = 200
+        fake_resp.reason = 'OK'
+        fake_conn = MagicMock()
+        fake_conn.request.side_effect = [BrokenPipeError('testing'), None]
+        fake_conn.getresponse.return_value = fake_resp
+        fake_HTTPConnection.return_value = fake_conn
+        body = upload.SpooledRequestBody(BytesIO(b'{}'), length=2, max_size=10,
+                                               block_size=10, memory_limit=10)
+
+        resp = relay.RelayQuery(host='fooHost',
+                                uri='/foo',
+                                method='POST',
+                                headers={},
+                                body=body,
+                                port=5000)
+
+        self.assertEqual(resp.status, '200 OK')
+        self.assertEqual(fake_conn.request.call_count, 2)
+
+    @patch.object(relay, 'HTTPConnection')
+    def test_no_replay_streamed_body(self, fake_HTTPConnection):
+        """The Relay object does not resend bodies that were not spooled, and answers HTTP 502"""
+        fake_conn = MagicMock()
+        fake_conn.getresponse.side_effect = [ConnectionResetError('testing')]
+        fake_HTTPConnection.return_value = fake_conn
+        body = upload.RequestBody(BytesIO(b'{}'), length=2, max_size=10)
+
+        resp = relay.RelayQuery(host='fooHost',
+                                uri='/foo',
+                                method='POST',
+                                headers={},
+                                body=body,
+                                port=5000)
+
+        self.assertEqual(resp.status, '502 Bad Gateway')
+
+    @patch.object(relay, 'HTTPConnection')
+    def test_no_replay_sent_post(self, fake_HTTPConnection):
+        """The Relay object does not resend a POST the back-end received in full"""
+        fake_conn = MagicMock()
+        fake_conn.getresponse.side_effect = [ConnectionResetError('testing')]
+        fake_HTTPConnection.return_value = fake_conn
+        body = upload.SpooledRequestBody(BytesIO(b'{}'), length=2, max_size=10,
+                                         block_size=10, memory_limit=10)
+
+        resp = relay.RelayQuery(host='fooHost',
+                                uri='/foo',
+                                method='POST',
+                                headers={},
+                                body=body,
+                                port=5000)
+
+        self.assertEqual(resp.status, '502 Bad Gateway')
+        self.assertEqual(fake_conn.request.call_count, 1)
+
+    @patch.object(relay, 'HTTPConnection')
+    def test_replay_sent_put(self, fake_HTTPConnection):
+        """The Relay object resends an idempotent request the back-end received in full"""
+        fake_resp = MagicMock()
+        fake_resp.status = 200
+        fake_resp.reason = 'OK'
+        fake_conn = MagicMock()
+        fake_conn.getresponse.side_effect = [ConnectionResetError('testing'), fake_resp]
+        fake_HTTPConnection.return_value = fake_conn
+        body = upload.SpooledRequestBody(BytesIO(b'{}'), length=2, max_size=10,
+                                         block_size=10, memory_limit=10)
+
+        resp = relay.RelayQuery(host='fooHost',
+                                uri='/foo',
+                                method='PUT',
+                                headers={},
+                                body=body,
+                                port=5000)
+
+        self.assertEqual(resp.status, '200 OK')
+        self.assertEqual(fake_conn.request.call_count, 2)
+
+    @patch.object(relay, 'POOL')
+    @patch.object(relay, 'HTTPConnection')
+    def test_keepalive_release(self, fake_HTTPConnection, fake_POOL):
+        """The Relay object returns reusable back-end connections to the pool"""
+        fake_resp = MagicMock()
+        fake_resp.isclosed.return_value = True
+        fake_resp.will_close = False
+        fake_conn = MagicMock()
+        fake_conn.getresponse.return_value = fake_resp
+        fake_HTTPConnection.return_value = fake_conn
+        fake_POOL.get.return_value = None
+
+        resp = relay.RelayQuery(host='fooHost',
+                                uri='/foo',
+                                method='GET',
+                                headers={},
+                                body=None,
+                                port=5000,
+                                keepalive=True)
+        resp.close()
+
+        fake_POOL.put.assert_called_with(('fooHost', 5000, False), fake_conn)
+        self.assertFalse(fake_conn.close.called)
+
+    @patch.object(relay, 'POOL')
+    @patch.object(relay, 'HTTPConnection')
+    def test_keepalive_unread(self, fake_HTTPConnection, fake_POOL):
+        """The Relay object closes back-end connections when the body wasn't fully read"""
+        fake_resp = MagicMock()
+        fake_resp.isclosed.return_value = False
+        fake_resp.will_close = False
+        fake_conn = MagicMock()
+        fake_conn.getresponse.return_value = fake_resp
+        fake_HTTPConnection.return_value = fake_conn
+        fake_POOL.get.return_value = None
+
+        resp = relay.RelayQuery(host='fooHost',
+                                uri='/foo',
+                                method='GET',
+                                headers={},
+                                body=None,
+                                port=5000,
+                                keepalive=True)
+        resp.close()
+
+        self.assertFalse(fake_POOL.put.called)
+        self.assertTrue(fake_conn.close.called)
+
+    @patch.object(relay, 'POOL')
+    @patch.object(relay, 'HTTPConnection')
+    def test_keepalive_stale(self, fake_HTTPConnection, fake_POOL):
+        """The Relay object retries on a new connection when a pooled one was closed by the back-end"""
+        fake_resp = MagicMock()
+        fake_resp.status = 200
+        fake_resp.reason = 'OK'
+        stale_conn = MagicMock()
+        stale_conn.request.side_effect = [BrokenPipeError('testing')]
+        fake_conn = MagicMock()
+        fake_conn.getresponse.return_value = fake_resp
+        fake_HTTPConnection.return_value = fake_conn
+        fake_POOL.get.return_value = stale_conn
+
+        resp = relay.RelayQuery(host='fooHost',
+                                uri='/foo',
+                                method='GET',
+                                headers={},
+                                body=None,
+                                port=5000,
+                                keepalive=True)
+
+        self.assertEqual(resp.status, '200 OK')
+        self.assertTrue(stale_conn.close.called)
+
+    @patch.object(relay, 'POOL')
+    @patch.object(relay, 'HTTPConnection')
+    def test_keepalive_stale_unread_body(self, fake_HTTPConnection, fake_POOL):
+        """The Relay object retries a streamed body on a new connection if none of it was read yet"""
+        fake_resp = MagicMock()
+        fake_resp.status = 201
+        fake_resp.reason = 'Created'
+        stale_conn = MagicMock()
+        stale_conn.request.side_effect = [BrokenPipeError('testing')]
+        fake_conn = MagicMock()
+        fake_conn.getresponse.return_value = fake_resp
+        fake_HTTPConnection.return_value = fake_conn
+        fake_POOL.get.return_value = stale_conn
+        body = upload.RequestBody(BytesIO(b'{}'), length=2, max_size=10)
+
+        resp = relay.RelayQuery(host='fooHost',
+                                uri='/foo',
+                                method='POST',
+                                headers={},
+                                body=body,
+                                port=5000,
+                                keepalive=True)
+
+        self.assertEqual(resp.status, '201 Created')
+
+    @patch.object(relay, 'POOL')
+    @patch.object(relay, 'HTTPConnection')
+    def test_keepalive_stale_read_body(self, fake_HTTPConnection, fake_POOL):
+        """The Relay object answers HTTP 502 if a pooled connection drops after a streamed body was read"""
+        def send_some(method, url, body, headers):
+            next(iter(body))
+            raise BrokenPipeError('testing')
+        stale_conn = MagicMock()
+        stale_conn.request.side_effect = send_some
+        fake_POOL.get.return_value = stale_conn
+        body = upload.RequestBody(BytesIO(b'{}'), length=2, max_size=10)
+
+        resp = relay.RelayQuery(host='fooHost',
+                                uri='/foo',
+                                method='POST',
+                                headers={},
+                                body=body,
+                                port=5000,
+                                keepalive=True)
+
+        self.assertEqual(resp.status, '502 Bad Gateway')
+        self.assertFalse(fake_HTTPConnection.called)
+
+    @patch.object(relay, 'POOL')
+    @patch.object(relay, 'HTTPConnection')
+    def test_keepalive_no_replay_post(self, fake_HTTPConnection, fake_POOL):
+        """The Relay object does not resend a POST on a pooled connection once it was sent"""
+        stale_conn = MagicMock()
+        stale_conn.getresponse.side_effect = [ConnectionResetError('testing')]
+        fake_POOL.get.return_value = stale_conn
+
+        resp = relay.RelayQuery(host='fooHost',
+                                uri='/foo',
+                                method='POST',
+                                headers={},
+                                body=None,
+                                port=5000,
+                                keepalive=True)
+
+        self.assertEqual(resp.status, '502 Bad Gateway')
+        self.assertFalse(fake_HTTPConnection.called)
+
+    @patch.object(relay, 'getaddrinfo')
+    @patch.object(relay.shm_cache, 'CACHE')
+    def test_resolve_cached(self, fake_CACHE, fake_getaddrinfo):
+        """``_resolve`` uses the address in the shared cache"""
+        fake_CACHE.get.return_value = b'10.0.0.2'
+
+        self.assertEqual(relay._resolve('fooHost', 5000), '10.0.0.2')
+        self.assertFalse(fake_getaddrinfo.called)
+
+    @patch.object(relay, 'getaddrinfo')
+    @patch.object(relay.shm_cache, 'CACHE')
+    def test_resolve_miss(self, fake_CACHE, fake_getaddrinfo):
+        """``_resolve`` stores the looked up address in the shared cache"""
+        fake_CACHE.get.return_value = None
+        fake_getaddrinfo.return_value = [(2, 1, 6, '', ('10.0.0.2', 5000))]
+
+        self.assertEqual(relay._resolve('fooHost', 5000), '10.0.0.2')
+        self.assertTrue(fake_CACHE.set.called)
+
+    def test_resolve_disabled(self):
+        """``_resolve`` returns the hostname when the shared cache is disabled"""
+        self.assertEqual(relay._resolve('fooHost', 5000), 'fooHost')
 
 
 if __name__ == '__main__':
@@ -2,10 +2,12 @@
 """Unit test for the router.py module"""
 import unittest
 from unittest.mock import MagicMock, patch
+import os
 import base64
 import json
+import tempfile
 
-from vlab_api_gateway import router
+from vlab_api_gateway import router, shm_cache
 from vlab_api_gateway.constants import const
 
 router.logger = MagicMock() # prevent spam output while running unittest
@@ -46,6 +48,22 @@ class TestGetHost(unittest.TestCase):
         self.assertEqual(result, expected)
 
 
+class TestGetResource(unittest.TestCase):
+    """A suite of test cases for the ``get_resource`` function"""
+
+    def test_docs(self):
+        """``get_resource`` returns 'docs' if the request isn't for an API endpoint"""
+        self.assertEqual(router.get_resource('/asdfsdwe'), 'docs')
+
+    def test_inf(self):
+        """``get_resource`` returns the sub-service of 'inf' resources"""
+        self.assertEqual(router.get_resource('/api/2/inf/winserver/image'), 'winserver')
+
+    def test_not_inf(self):
+        """``get_resource`` returns the service of non-'inf' resources"""
+        self.assertEqual(router.get_resource('/api/2/auth/token'), 'auth')
+
+
 class TestIpam(unittest.TestCase):
     """A suite of test cases for the ``_user_ipam_server`` function"""
 
@@ -97,6 +115,42 @@ class TestIpam(unittest.TestCase):
 
         self.assertEqual(result, expected)
 
+
+class TestIpamSharedCache(unittest.TestCase):
+    """A suite of test cases for ``_user_ipam_server`` when the shared cache is enabled"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache = shm_cache.SharedCache(os.path.join(self.tmpdir.name, 'cache'), slots=16)
+        self.patcher = patch.object(router.shm_cache, 'CACHE', self.cache)
+        self.patcher.start()
+
+    def tearDown(self):
+        """Runs after every test case"""
+        self.patcher.stop()
+        self.cache.close()
+        self.tmpdir.cleanup()
+
+    def test_cached(self):
+        """``_user_ipam_server`` remembers the IPAM server of a token"""
+        token_payload = base64.urlsafe_b64encode(json.dumps({'username' : 'sandy'}).encode())
+        token = b'asdf.%s.asdf' % token_payload
+        router._user_ipam_server(token=token)
+
+        with patch.object(router.base64, 'urlsafe_b64decode') as fake_urlsafe_b64decode:
+            result = router._user_ipam_server(token=token)
+
+        self.assertEqual(result, 'sandy.{}'.format(const.VLAB_FQDN))
+        self.assertFalse(fake_urlsafe_b64decode.called)
+
+    def test_not_cached_invalid(self):
+        """``_user_ipam_server`` doesn't remember tokens it couldn't decode"""
+        router._user_ipam_server(token=b'asdf.asdf.asdf')
+
+        self.assertEqual(self.cache.occupancy(), 0)
+
+
 class TestConstants(unittest.TestCase):
     """a suite of test cases for the router module constants"""
 
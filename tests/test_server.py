@@ -159,6 +159,164 @@ class TestServer(unittest.TestCase):
 
         self.assertEqual(sent_uri, expected)
 
+    def test_pop_transfer_encoding(self, fake_RelayQuery):
+        """``application`` lets the proxying logic decide how to frame the request body"""
+        self.env['HTTP_TRANSFER_ENCODING'] = 'chunked'
+        fake_start_response = MagicMock()
+
+        vlab_api_gateway.server.application(self.env, fake_start_response)
+
+        _, called_kwargs = fake_RelayQuery.call_args
+        proxied_headers = called_kwargs['headers']
+        expected_headers = {}
+
+        self.assertEqual(proxied_headers, expected_headers)
+
+    def test_no_body(self, fake_RelayQuery):
+        """``application`` doesn't send a body when the client didn't supply one"""
+        fake_start_response = MagicMock()
+
+        vlab_api_gateway.server.application(self.env, fake_start_response)
+
+        _, called_kwargs = fake_RelayQuery.call_args
+
+        self.assertTrue(called_kwargs['body'] is None)
+
+    def test_invalid_content_length(self, fake_RelayQuery):
+        """``application`` returns HTTP 400 when the Content-Length isn't a size"""
+        self.env['CONTENT_LENGTH'] = 'asdf'
+        fake_start_response = MagicMock()
+
+        vlab_api_gateway.server.application(self.env, fake_start_response)
+
+        call_args, _ = fake_start_response.call_args
+
+        self.assertEqual(call_args[0], '400 Bad Request')
+        self.assertFalse(fake_RelayQuery.called)
+
+    @patch.object(vlab_api_gateway.server.upload, 'get_request_body')
+    def test_body_too_large(self, fake_get_request_body, fake_RelayQuery):
+        """``application`` returns HTTP 413 when the request body is too large"""
+        fake_get_request_body.side_effect = [vlab_api_gateway.server.upload.BodyTooLarge(10)]
+        fake_start_response = MagicMock()
+
+        vlab_api_gateway.server.application(self.env, fake_start_response)
+
+        call_args, _ = fake_start_response.call_args
+
+        self.assertEqual(call_args[0], '413 Payload Too Large')
+        self.assertFalse(fake_RelayQuery.called)
+
+    @patch.object(vlab_api_gateway.server.auth, 'VERIFIER')
+    def test_invalid_token(self, fake_VERIFIER, fake_RelayQuery):
+        """``application`` returns HTTP 401 without calling the back-end when the token is invalid"""
+        self.env['HTTP_X_AUTH'] = 'asdf.asdf.asdf'
+        self.env['PATH_INFO'] = '/api/2/inf/onefs'
+        fake_VERIFIER.verify.return_value = False
+        fake_start_response = MagicMock()
+
+        vlab_api_gateway.server.application(self.env, fake_start_response)
+
+        call_args, _ = fake_start_response.call_args
+
+        self.assertEqual(call_args[0], '401 Unauthorized')
+        self.assertFalse(fake_RelayQuery.called)
+
+    @patch.object(vlab_api_gateway.server.auth, 'VERIFIER')
+    def test_valid_token(self, fake_VERIFIER, fake_RelayQuery):
+        """``application`` calls the back-end when the token is valid"""
+        self.env['HTTP_X_AUTH'] = 'asdf.asdf.asdf'
+        self.env['PATH_INFO'] = '/api/2/inf/onefs'
+        fake_VERIFIER.verify.return_value = True
+        fake_start_response = MagicMock()
+
+        vlab_api_gateway.server.application(self.env, fake_start_response)
+
+        self.assertTrue(fake_RelayQuery.called)
+
+    @patch.object(vlab_api_gateway.server.auth, 'VERIFIER')
+    def test_auth_not_verified(self, fake_VERIFIER, fake_RelayQuery):
+        """``application`` lets the auth service handle its own tokens"""
+        self.env['HTTP_X_AUTH'] = 'asdf.asdf.asdf'
+        self.env['PATH_INFO'] = '/api/2/auth/token'
+        fake_start_response = MagicMock()
+
+        vlab_api_gateway.server.application(self.env, fake_start_response)
+
+        self.assertFalse(fake_VERIFIER.verify.called)
+
+    @patch.object(vlab_api_gateway.server, 'admin')
+    def test_admin(self, fake_admin, fake_RelayQuery):
+        """``application`` hands admin end points to the admin module, not a back-end"""
+        self.env['PATH_INFO'] = '/__admin/profile'
+        fake_admin.is_admin_request.return_value = True
+        fake_start_response = MagicMock()
+
+        vlab_api_gateway.server.application(self.env, fake_start_response)
+
+        self.assertTrue(fake_admin.application.called)
+        self.assertFalse(fake_RelayQuery.called)
+
+    @patch.object(vlab_api_gateway.server, 'capture')
+    def test_capture(self, fake_capture, fake_RelayQuery):
+        """``application`` records the request when capturing traffic is enabled"""
+        fake_start_response = MagicMock()
+
+        vlab_api_gateway.server.application(self.env, fake_start_response)
+
+        self.assertTrue(fake_capture.RECORDER.wrap.called)
+
+    @patch.object(vlab_api_gateway.server.tunnel, 'TunnelQuery')
+    def test_upgrade(self, fake_TunnelQuery, fake_RelayQuery):
+        """``application`` tunnels requests that upgrade the connection"""
+        self.env['HTTP_CONNECTION'] = 'Upgrade'
+        self.env['HTTP_UPGRADE'] = 'websocket'
+        self.env['gunicorn.socket'] = MagicMock()
+        fake_start_response = MagicMock()
+
+        vlab_api_gateway.server.application(self.env, fake_start_response)
+
+        _, called_kwargs = fake_TunnelQuery.call_args
+
+        self.assertFalse(fake_RelayQuery.called)
+        self.assertEqual(called_kwargs['client'], self.env['gunicorn.socket'])
+        self.assertEqual(called_kwargs['headers']['Connection'], 'Upgrade')
+
+    def test_ready(self, fake_RelayQuery):
+        """``application`` answers readiness probes itself"""
+        self.env['PATH_INFO'] = '/__ready'
+        fake_start_response = MagicMock()
+
+        vlab_api_gateway.server.application(self.env, fake_start_response)
+
+        self.assertFalse(fake_RelayQuery.called)
+        self.assertTrue(fake_start_response.called)
+
+    @patch.object(vlab_api_gateway.server.drain, 'TRACKER')
+    def test_tracked(self, fake_TRACKER, fake_RelayQuery):
+        """``application`` counts every request as in flight"""
+        fake_start_response = MagicMock()
+
+        vlab_api_gateway.server.application(self.env, fake_start_response)
+
+        self.assertTrue(fake_TRACKER.track.called)
+
+    @patch.object(vlab_api_gateway.server.compress, 'negotiate')
+    def test_compression(self, fake_negotiate, fake_RelayQuery):
+        """``application`` compresses the response when the client accepts it"""
+        fake_negotiate.return_value = 'gzip'
+        fake_resp = MagicMock()
+        fake_resp.status = '200 OK'
+        fake_resp.headers = [('Content-Type', 'application/json'), ('Content-Length', '9001')]
+        fake_RelayQuery.return_value = fake_resp
+        fake_start_response = MagicMock()
+
+        vlab_api_gateway.server.application(self.env, fake_start_response)
+
+        call_args, _ = fake_start_response.call_args
+
+        self.assertTrue(('Content-Encoding', 'gzip') in call_args[1])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,155 @@
+# -*- coding: UTF-8 -*-
+"""A suite of unit tests for the ``shm_cache.py`` module"""
+import os
+import time
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+from vlab_api_gateway import shm_cache
+
+shm_cache.logger = MagicMock() # prevent SPAM in output while running tests
+
+
+class TestSharedCache(unittest.TestCase):
+    """A suite of test cases for the ``SharedCache`` object"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'cache')
+        self.cache = shm_cache.SharedCache(self.path, slots=16)
+
+    def tearDown(self):
+        """Runs after every test case"""
+        self.cache.close()
+        self.tmpdir.cleanup()
+
+    def test_set_get(self):
+        """``SharedCache`` returns the value that was stored"""
+        self.cache.set(b'dns:auth-api:5000', b'10.0.0.2', ttl=30)
+
+        self.assertEqual(self.cache.get(b'dns:auth-api:5000'), b'10.0.0.2')
+
+    def test_miss(self):
+        """``SharedCache`` returns None for unknown keys"""
+        self.assertTrue(self.cache.get(b'dns:auth-api:5000') is None)
+        self.assertEqual(self.cache.get_stats()['misses'], 1)
+
+    def test_overwrite(self):
+        """``SharedCache`` replaces the value of an existing key"""
+        self.cache.set(b'dns:auth-api:5000', b'10.0.0.2', ttl=30)
+        self.cache.set(b'dns:auth-api:5000', b'10.0.0.3', ttl=30)
+
+        self.assertEqual(self.cache.get(b'dns:auth-api:5000'), b'10.0.0.3')
+        self.assertEqual(self.cache.occupancy(), 1)
+
+    def test_expired(self):
+        """``SharedCache`` doesn't return expired values"""
+        self.cache.set(b'dns:auth-api:5000', b'10.0.0.2', ttl=-1)
+
+        self.assertTrue(self.cache.get(b'dns:auth-api:5000') is None)
+
+    def test_too_large(self):
+        """``SharedCache`` refuses items that don't fit in a slot"""
+        result = self.cache.set(b'big', b'x' * shm_cache.SLOT_SIZE, ttl=30)
+
+        self.assertFalse(result)
+        self.assertEqual(self.cache.get_stats()['too_large'], 1)
+
+    def test_full(self):
+        """``SharedCache`` evicts entries once the table is full"""
+        for idx in range(64):
+            self.cache.set(b'key%d' % idx, b'value', ttl=30)
+
+        self.assertEqual(self.cache.occupancy(), 16)
+        self.assertTrue(self.cache.get_stats()['evictions'] > 0)
+        self.assertEqual(self.cache.get(b'key63'), b'value')
+
+    def test_shared(self):
+        """``SharedCache`` values are visible to other instances using the same file"""
+        other = shm_cache.SharedCache(self.path, slots=16)
+        try:
+            other.set(b'dns:auth-api:5000', b'10.0.0.2', ttl=30)
+
+            self.assertEqual(self.cache.get(b'dns:auth-api:5000'), b'10.0.0.2')
+        finally:
+            other.close()
+
+    def test_shared_process(self):
+        """``SharedCache`` values are visible to other processes"""
+        pid = os.fork()
+        if pid == 0:
+            child = shm_cache.SharedCache(self.path, slots=16)
+            child.set(b'dns:auth-api:5000', b'10.0.0.2', ttl=30)
+            os._exit(0)
+        os.waitpid(pid, 0)
+
+        self.assertEqual(self.cache.get(b'dns:auth-api:5000'), b'10.0.0.2')
+
+    def test_torn_write(self):
+        """``SharedCache`` ignores a slot left half-written by a dead worker, and can repair it"""
+        self.cache.set(b'dns:auth-api:5000', b'10.0.0.2', ttl=30)
+        offset = self.cache._offset(shm_cache.hash_key(b'dns:auth-api:5000'), 0)
+        shm_cache.SEQ.pack_into(self.cache._mm, offset, 3)
+
+        self.assertTrue(self.cache.get(b'dns:auth-api:5000') is None)
+
+        self.cache.set(b'dns:auth-api:5000', b'10.0.0.3', ttl=30)
+
+        self.assertEqual(self.cache.get(b'dns:auth-api:5000'), b'10.0.0.3')
+
+    def test_layout_change(self):
+        """``SharedCache`` wipes the table when the number of slots changes"""
+        self.cache.set(b'dns:auth-api:5000', b'10.0.0.2', ttl=30)
+        other = shm_cache.SharedCache(self.path, slots=32)
+        try:
+            self.assertTrue(other.get(b'dns:auth-api:5000') is None)
+        finally:
+            other.close()
+
+    def test_layout_shrink(self):
+        """``SharedCache`` keeps the table after a change to fewer slots"""
+        smaller = shm_cache.SharedCache(self.path, slots=8)
+        smaller.set(b'dns:auth-api:5000', b'10.0.0.2', ttl=30)
+        smaller.close()
+        other = shm_cache.SharedCache(self.path, slots=8)
+        try:
+            self.assertEqual(other.get(b'dns:auth-api:5000'), b'10.0.0.2')
+        finally:
+            other.close()
+
+    @patch.object(shm_cache, 'hash_key')
+    def test_no_duplicates(self, fake_hash_key):
+        """``SharedCache`` updates a key in place, even when an earlier probe has expired"""
+        fake_hash_key.return_value = 0
+        self.cache.set(b'other', b'a', ttl=0.05)
+        self.cache.set(b'dns:auth-api:5000', b'10.0.0.2', ttl=30)
+        time.sleep(0.1)
+        self.cache.set(b'dns:auth-api:5000', b'10.0.0.3', ttl=30)
+
+        self.assertEqual(self.cache.occupancy(), 1)
+        self.assertEqual(self.cache.get(b'dns:auth-api:5000'), b'10.0.0.3')
+
+
+class TestGetCache(unittest.TestCase):
+    """A suite of test cases for the ``_get_cache`` function"""
+
+    @patch.object(shm_cache, 'const')
+    def test_disabled(self, fake_const):
+        """``_get_cache`` returns None when no path is configured"""
+        fake_const.VLAB_SHM_CACHE_PATH = ''
+
+        self.assertTrue(shm_cache._get_cache() is None)
+
+    @patch.object(shm_cache, 'const')
+    def test_bad_path(self, fake_const):
+        """``_get_cache`` returns None when the file cannot be opened"""
+        fake_const.VLAB_SHM_CACHE_PATH = '/no/such/dir/cache'
+        fake_const.VLAB_SHM_CACHE_SLOTS = 16
+
+        self.assertTrue(shm_cache._get_cache() is None)
+
+
+if __name__ == '__main__':
+    unittest.main()
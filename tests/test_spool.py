@@ -0,0 +1,98 @@
+# -*- coding: UTF-8 -*-
+"""A suite of unit tests for the ``spool.py`` module"""
+import unittest
+from unittest.mock import MagicMock
+from io import BytesIO
+
+from vlab_api_gateway import spool
+
+spool.logger = MagicMock() # prevent SPAM in output while running tests
+
+
+class FakeResponse(BytesIO):
+    """Enough of the upstream.HTTPResponse API to test with"""
+    def isclosed(self):
+        return self.tell() == len(self.getvalue())
+
+    def read1(self, amt=-1):
+        return self.read(min(amt, 4))
+
+
+class TestShouldBuffer(unittest.TestCase):
+    """A suite of test cases for the ``should_buffer`` function"""
+
+    def _resp(self, content_type, length):
+        resp = MagicMock()
+        resp.getheader.return_value = content_type
+        resp.length = length
+        return resp
+
+    def test_sized(self):
+        """``should_buffer`` is True for a response of known size"""
+        self.assertTrue(spool.should_buffer(self._resp('application/json', 9001)))
+
+    def test_no_length(self):
+        """``should_buffer`` is False when the size of the response isn't known"""
+        self.assertFalse(spool.should_buffer(self._resp('application/json', None)))
+
+    def test_event_stream(self):
+        """``should_buffer`` is False for server-sent events"""
+        self.assertFalse(spool.should_buffer(self._resp('text/event-stream; charset=utf-8', 9001)))
+
+
+class TestSpooledResponse(unittest.TestCase):
+    """A suite of test cases for the ``SpooledResponse`` object"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        for key in spool.STATS:
+            spool.STATS[key] = 0
+
+    def test_in_memory(self):
+        """``SpooledResponse`` buffers small bodies completely"""
+        resp = spool.SpooledResponse(FakeResponse(b'some\ndata'), memory_limit=100, disk_limit=1000)
+
+        self.assertTrue(resp.complete)
+        self.assertEqual(resp.size, 9)
+
+    def test_read1(self):
+        """``SpooledResponse`` serves the body in blocks"""
+        resp = spool.SpooledResponse(FakeResponse(b'some\ndata'), memory_limit=100, disk_limit=1000)
+
+        self.assertEqual(resp.read1(5), b'some\n')
+        self.assertEqual(resp.read1(), b'data')
+        self.assertEqual(resp.read1(), b'')
+
+    def test_spilled_stats(self):
+        """``SpooledResponse`` tracks bodies that spill to disk"""
+        spool.SpooledResponse(FakeResponse(b'x' * 200), memory_limit=100, disk_limit=1000)
+
+        self.assertEqual(spool.get_stats()['responses_spilled'], 1)
+        self.assertEqual(spool.get_stats()['bytes_spilled'], 200)
+
+    def test_overflow(self):
+        """``SpooledResponse`` streams the remainder of bodies larger than the disk cap"""
+        resp = spool.SpooledResponse(FakeResponse(b'a' * 10 + b'\nbbb'), memory_limit=5, disk_limit=10)
+
+        self.assertFalse(resp.complete)
+        self.assertEqual(resp.read1(), b'a' * 10)
+        self.assertEqual(resp.read1(), b'\nbbb')
+        self.assertEqual(resp.read1(), b'')
+        self.assertEqual(spool.get_stats()['responses_overflowed'], 1)
+
+    def test_exact_cap(self):
+        """``SpooledResponse`` is complete when the body is exactly the size of the disk cap"""
+        resp = spool.SpooledResponse(FakeResponse(b'a' * 10), memory_limit=5, disk_limit=10)
+
+        self.assertTrue(resp.complete)
+
+    def test_get_stats_copy(self):
+        """``get_stats`` returns a copy of the counters"""
+        stats = spool.get_stats()
+        stats['responses_buffered'] = 9001
+
+        self.assertEqual(spool.STATS['responses_buffered'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
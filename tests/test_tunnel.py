@@ -0,0 +1,179 @@
+# -*- coding: UTF-8 -*-
+"""A suite of unit tests for the ``tunnel.py`` module"""
+import unittest
+from unittest.mock import MagicMock, patch
+
+import gevent
+from gevent import socket
+
+from vlab_api_gateway import tunnel
+
+tunnel.logger = MagicMock() # prevent SPAM in output while running tests
+
+
+class TestIsUpgrade(unittest.TestCase):
+    """A suite of test cases for the ``is_upgrade`` function"""
+
+    def test_upgrade(self):
+        """``is_upgrade`` returns True when the client asks to switch protocols"""
+        env = {'HTTP_CONNECTION' : 'keep-alive, Upgrade', 'HTTP_UPGRADE' : 'websocket'}
+
+        self.assertTrue(tunnel.is_upgrade(env))
+
+    def test_no_upgrade_header(self):
+        """``is_upgrade`` returns False without an Upgrade header"""
+        env = {'HTTP_CONNECTION' : 'Upgrade'}
+
+        self.assertFalse(tunnel.is_upgrade(env))
+
+    def test_normal_request(self):
+        """``is_upgrade`` returns False for a normal request"""
+        env = {'HTTP_CONNECTION' : 'keep-alive'}
+
+        self.assertFalse(tunnel.is_upgrade(env))
+
+
+@patch.object(tunnel.RelayQuery, '_call_upstream')
+class TestTunnelQuery(unittest.TestCase):
+    """A suite of test cases for setting up a ``TunnelQuery``"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        tunnel.ACTIVE.clear()
+        self.kwargs = {'host' : 'onefs-api', 'uri' : '/api/2/inf/onefs/console', 'method' : 'GET',
+                       'headers' : {}, 'body' : None, 'port' : 5000}
+
+    def tearDown(self):
+        """Runs after every test case"""
+        tunnel.ACTIVE.clear()
+
+    def test_no_client_socket(self, fake_call_upstream):
+        """``TunnelQuery`` returns HTTP 501 when the WSGI server doesn't supply the client socket"""
+        resp = tunnel.TunnelQuery(client=None, **self.kwargs)
+
+        self.assertEqual(resp.status, '501 Not Implemented')
+        self.assertFalse(fake_call_upstream.called)
+
+    @patch.object(tunnel, 'const')
+    def test_max_per_host(self, fake_const, fake_call_upstream):
+        """``TunnelQuery`` returns HTTP 503 when a back-end has too many tunnels"""
+        fake_const.VLAB_TUNNEL_MAX_PER_HOST = 1
+        tunnel.ACTIVE[('onefs-api', 5000)] = 1
+
+        resp = tunnel.TunnelQuery(client=MagicMock(), **self.kwargs)
+
+        self.assertEqual(resp.status, '503 Service Unavailable')
+        self.assertFalse(fake_call_upstream.called)
+
+    def test_not_upgraded(self, fake_call_upstream):
+        """``TunnelQuery`` frees its slot when the back-end doesn't switch protocols"""
+        resp = tunnel.TunnelQuery(client=MagicMock(), **self.kwargs)
+
+        self.assertFalse(resp._tunneled)
+        self.assertEqual(tunnel.ACTIVE, {})
+
+    def test_upgraded(self, fake_call_upstream):
+        """``TunnelQuery`` holds a slot while the tunnel is open"""
+        def switch_protocols(*args, **kwargs):
+            resp._conn = MagicMock()
+            resp._upstream = MagicMock()
+            resp._upstream.status = 101
+        resp = tunnel.TunnelQuery.__new__(tunnel.TunnelQuery)
+        fake_call_upstream.side_effect = switch_protocols
+
+        resp.__init__(client=MagicMock(), **self.kwargs)
+
+        self.assertTrue(resp._tunneled)
+        self.assertEqual(tunnel.ACTIVE, {('onefs-api', 5000) : 1})
+
+        resp.close()
+
+        self.assertEqual(tunnel.ACTIVE, {})
+
+
+class TestSplice(unittest.TestCase):
+    """A suite of test cases for copying bytes through a tunnel"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.client, self.gateway_client = socket.socketpair()
+        self.backend, self.gateway_backend = socket.socketpair()
+        self.resp = tunnel.TunnelQuery.__new__(tunnel.TunnelQuery)
+        self.resp._client = self.gateway_client
+        self.resp._conn = MagicMock()
+        self.resp._conn.sock = self.gateway_backend
+        self.resp._upstream = MagicMock()
+        self.resp._conn.pop_buffered.return_value = b'early'
+        self.resp._tunneled = True
+        self.resp._last_active = 0
+
+    def tearDown(self):
+        """Runs after every test case"""
+        for sock in (self.client, self.gateway_client, self.backend, self.gateway_backend):
+            sock.close()
+
+    def _recv(self, sock, size):
+        data = b''
+        while len(data) < size:
+            chunk = sock.recv(size - len(data))
+            if not chunk:
+                break
+            data += chunk
+        return data
+
+    def _run(self):
+        splice = iter(self.resp)
+        self.assertEqual(next(splice), b'')
+        return gevent.spawn(list, splice)
+
+    def test_splice(self):
+        """``TunnelQuery`` copies bytes in both directions"""
+        pumps = self._run()
+        self.client.sendall(b'ping')
+        self.assertEqual(self.backend.recv(10), b'ping')
+        self.backend.sendall(b'pong')
+        self.assertEqual(self._recv(self.client, 9), b'earlypong')
+
+        self.client.shutdown(socket.SHUT_WR)
+        self.backend.shutdown(socket.SHUT_WR)
+        pumps.join(timeout=1)
+
+        self.assertTrue(pumps.ready())
+
+    def test_half_close(self):
+        """``TunnelQuery`` passes along a half-close, so the back-end sees the EOF"""
+        pumps = self._run()
+        self.client.shutdown(socket.SHUT_WR)
+
+        self.assertEqual(self.backend.recv(10), b'')
+        self.backend.sendall(b'bye')
+        self.assertEqual(self._recv(self.client, 8), b'earlybye')
+        pumps.kill()
+
+    @patch.object(tunnel, 'IDLE_CHECK', 0.01)
+    @patch.object(tunnel, 'const')
+    def test_idle_timeout(self, fake_const):
+        """``TunnelQuery`` closes a tunnel nothing has been sent over"""
+        fake_const.VLAB_TUNNEL_IDLE_TIMEOUT = 0.05
+        fake_const.VLAB_TUNNEL_BUFFER_SIZE = 1024
+        idle_closed = tunnel.STATS['idle_closed']
+        pumps = self._run()
+        pumps.join(timeout=1)
+
+        self.assertTrue(pumps.ready())
+        self.assertTrue(tunnel.STATS['idle_closed'] > idle_closed)
+
+    def test_reuses_buffers(self):
+        """``TunnelQuery`` returns its buffers for later tunnels to use"""
+        tunnel.SPARE_BUFFERS.clear()
+        pumps = self._run()
+        gevent.sleep(0.01) # let both pumps start
+        self.client.shutdown(socket.SHUT_WR)
+        self.backend.shutdown(socket.SHUT_WR)
+        pumps.join(timeout=1)
+
+        self.assertEqual(len(tunnel.SPARE_BUFFERS), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
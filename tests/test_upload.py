@@ -0,0 +1,124 @@
+# -*- coding: UTF-8 -*-
+"""A suite of unit tests for the ``upload.py`` module"""
+import unittest
+from io import BytesIO
+from unittest.mock import patch
+
+from vlab_api_gateway import upload
+
+
+class TestGetRequestBody(unittest.TestCase):
+    """A suite of test cases for the ``get_request_body`` function"""
+
+    def test_no_body(self):
+        """``get_request_body`` returns None when the client didn't send a body"""
+        env = {'wsgi.input' : BytesIO(b'')}
+
+        self.assertTrue(upload.get_request_body(env) is None)
+
+    def test_content_length(self):
+        """``get_request_body`` uses the Content-Length sent by the client"""
+        env = {'wsgi.input' : BytesIO(b'{}'), 'CONTENT_LENGTH' : '2'}
+        body = upload.get_request_body(env)
+
+        self.assertEqual(body.length, 2)
+
+    def test_chunked(self):
+        """``get_request_body`` supports chunked Transfer-Encoding"""
+        env = {'wsgi.input' : BytesIO(b'{}'), 'HTTP_TRANSFER_ENCODING' : 'chunked'}
+        body = upload.get_request_body(env)
+
+        self.assertTrue(body.length is None)
+        self.assertEqual(b''.join(body), b'{}')
+
+    def test_invalid_length(self):
+        """``get_request_body`` raises InvalidBody when the Content-Length isn't a size"""
+        for length in ('2x', '-1', '1e3'):
+            env = {'wsgi.input' : BytesIO(b'{}'), 'CONTENT_LENGTH' : length}
+
+            with self.assertRaises(upload.InvalidBody):
+                upload.get_request_body(env)
+
+    @patch.object(upload, 'const')
+    def test_spooling(self, fake_const):
+        """``get_request_body`` returns a SpooledRequestBody when spooling is enabled"""
+        fake_const.VLAB_REQUEST_SPOOLING = True
+        fake_const.VLAB_REQUEST_MAX_BODY = 100
+        fake_const.VLAB_REQUEST_BLOCK_SIZE = 10
+        fake_const.VLAB_REQUEST_SPOOL_MEMORY = 10
+        env = {'wsgi.input' : BytesIO(b'{}'), 'HTTP_TRANSFER_ENCODING' : 'chunked'}
+        body = upload.get_request_body(env)
+
+        self.assertTrue(isinstance(body, upload.SpooledRequestBody))
+
+
+class TestRequestBody(unittest.TestCase):
+    """A suite of test cases for the ``RequestBody`` object"""
+
+    def test_blocks(self):
+        """``RequestBody`` reads the body in fixed size blocks"""
+        body = upload.RequestBody(BytesIO(b'a' * 25), length=25, max_size=100, block_size=10)
+
+        self.assertEqual([len(x) for x in body], [10, 10, 5])
+
+    def test_content_length_limit(self):
+        """``RequestBody`` only reads up to the Content-Length"""
+        body = upload.RequestBody(BytesIO(b'a' * 25), length=5, max_size=100, block_size=10)
+
+        self.assertEqual(b''.join(body), b'aaaaa')
+
+    def test_declared_too_large(self):
+        """``RequestBody`` raises BodyTooLarge when the Content-Length exceeds the max size"""
+        with self.assertRaises(upload.BodyTooLarge):
+            upload.RequestBody(BytesIO(b''), length=101, max_size=100)
+
+    def test_chunked_too_large(self):
+        """``RequestBody`` raises BodyTooLarge when a chunked body exceeds the max size"""
+        body = upload.RequestBody(BytesIO(b'a' * 25), length=None, max_size=20, block_size=10)
+
+        with self.assertRaises(upload.BodyTooLarge):
+            list(body)
+
+    def test_not_replayable(self):
+        """``RequestBody`` cannot be replayed"""
+        body = upload.RequestBody(BytesIO(b''), length=None, max_size=20, block_size=10)
+
+        self.assertFalse(body.replayable)
+
+    def test_started(self):
+        """``RequestBody`` records once any of the body has been read"""
+        body = upload.RequestBody(BytesIO(b'{}'), length=2, max_size=20, block_size=10)
+        started_before = body.started
+        next(iter(body))
+
+        self.assertFalse(started_before)
+        self.assertTrue(body.started)
+
+
+class TestSpooledRequestBody(unittest.TestCase):
+    """A suite of test cases for the ``SpooledRequestBody`` object"""
+
+    def test_length(self):
+        """``SpooledRequestBody`` knows the size of chunked bodies"""
+        body = upload.SpooledRequestBody(BytesIO(b'a' * 25), length=None, max_size=100,
+                                         block_size=10, memory_limit=10)
+
+        self.assertEqual(body.length, 25)
+
+    def test_replay(self):
+        """``SpooledRequestBody`` can be iterated more than once"""
+        body = upload.SpooledRequestBody(BytesIO(b'a' * 25), length=None, max_size=100,
+                                         block_size=10, memory_limit=10)
+
+        self.assertEqual(b''.join(body), b''.join(body))
+        self.assertTrue(body.replayable)
+
+    def test_too_large(self):
+        """``SpooledRequestBody`` raises BodyTooLarge while spooling an oversized body"""
+        with self.assertRaises(upload.BodyTooLarge):
+            upload.SpooledRequestBody(BytesIO(b'a' * 25), length=None, max_size=20,
+                                      block_size=10, memory_limit=10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,321 @@
+# -*- coding: UTF-8 -*-
+"""A suite of unit tests for the ``upstream.py`` module"""
+import socket
+import unittest
+from http.client import RemoteDisconnected, ResponseNotReady, IncompleteRead
+
+from vlab_api_gateway import upstream
+
+
+class FakeSocket:
+    """Serves canned bytes, ``step`` bytes per read, and records what's sent"""
+    def __init__(self, data, step=65536):
+        self.data = data
+        self.step = step
+        self.sent = []
+        self.closed = False
+
+    def recv_into(self, buf):
+        size = min(len(buf), self.step, len(self.data))
+        buf[:size] = self.data[:size]
+        self.data = self.data[size:]
+        return size
+
+    def recv(self, size):
+        data = self.data[:min(size, self.step)]
+        self.data = self.data[len(data):]
+        return data
+
+    def sendall(self, data):
+        self.sent.append(bytes(data))
+
+    def close(self):
+        self.closed = True
+
+
+class SegmentedSocket(FakeSocket):
+    """Serves each of the canned segments in a separate read, like a back-end
+    that sends them over time"""
+    def __init__(self, segments):
+        super().__init__(b'')
+        self.segments = list(segments)
+
+    def recv_into(self, buf):
+        if not self.data and self.segments:
+            self.data = self.segments.pop(0)
+        return super().recv_into(buf)
+
+    def recv(self, size):
+        if not self.data and self.segments:
+            self.data = self.segments.pop(0)
+        return super().recv(size)
+
+
+def make_conn(data, step=65536):
+    conn = upstream.HTTPConnection('fooHost', 5000)
+    conn.sock = FakeSocket(data, step)
+    return conn
+
+
+def get(conn, method='GET'):
+    conn.request(method, '/foo', headers={})
+    return conn.getresponse()
+
+
+class TestRequest(unittest.TestCase):
+    """A suite of test cases for sending requests to the back-end"""
+
+    def test_head(self):
+        """``HTTPConnection`` adds a Host header when the client didn't send one"""
+        conn = make_conn(b'')
+        conn.request('GET', '/foo', headers={'X-Foo' : 'bar'})
+
+        expected = b'GET /foo HTTP/1.1\r\nX-Foo: bar\r\nHost: fooHost:5000\r\nAccept-Encoding: identity\r\n\r\n'
+
+        self.assertEqual(conn.sock.sent, [expected])
+
+    def test_client_host(self):
+        """``HTTPConnection`` forwards the Host header of the client"""
+        conn = make_conn(b'')
+        conn.request('GET', '/foo', headers={'HOST' : 'vlab.local'})
+
+        self.assertNotIn(b'fooHost', conn.sock.sent[0])
+
+    def test_bytes_body(self):
+        """``HTTPConnection`` sends the head and a bytes body in one write"""
+        conn = make_conn(b'')
+        conn.request('POST', '/foo', body=b'{}', headers={})
+
+        self.assertEqual(len(conn.sock.sent), 1)
+        self.assertIn(b'Content-Length: 2\r\n', conn.sock.sent[0])
+        self.assertTrue(conn.sock.sent[0].endswith(b'\r\n\r\n{}'))
+
+    def test_no_body(self):
+        """``HTTPConnection`` sends a zero Content-Length for a POST without a body"""
+        conn = make_conn(b'')
+        conn.request('POST', '/foo', headers={})
+
+        self.assertIn(b'Content-Length: 0\r\n', conn.sock.sent[0])
+
+    def test_iterable_body(self):
+        """``HTTPConnection`` chunks a body of unknown length"""
+        conn = make_conn(b'')
+        conn.request('POST', '/foo', body=iter([b'abc', b'', b'defg']), headers={})
+
+        self.assertIn(b'Transfer-Encoding: chunked\r\n', conn.sock.sent[0])
+        self.assertEqual(conn.sock.sent[1:], [b'3\r\nabc\r\n', b'4\r\ndefg\r\n', b'0\r\n\r\n'])
+
+    def test_iterable_body_length(self):
+        """``HTTPConnection`` streams a body as-is when the client sent its length"""
+        conn = make_conn(b'')
+        conn.request('POST', '/foo', body=iter([b'abc', b'defg']), headers={'CONTENT-LENGTH' : '7'})
+
+        self.assertNotIn(b'chunked', conn.sock.sent[0])
+        self.assertEqual(conn.sock.sent[1:], [b'abc', b'defg'])
+
+    def test_header_injection(self):
+        """``HTTPConnection`` refuses to send a header containing a line break"""
+        conn = make_conn(b'')
+
+        with self.assertRaises(ValueError):
+            conn.request('GET', '/foo', headers={'X-Foo' : 'bar\r\nX-Evil: true'})
+
+
+class TestResponse(unittest.TestCase):
+    """A suite of test cases for reading responses from the back-end"""
+
+    def test_content_length(self):
+        """``HTTPConnection`` reads a body framed by Content-Length"""
+        resp = get(make_conn(b'HTTP/1.1 200 OK\r\nContent-Length: 4\r\nContent-Type: text/plain\r\n\r\ndata'))
+
+        self.assertEqual(resp.status, 200)
+        self.assertEqual(resp.reason, 'OK')
+        self.assertEqual(resp.getheaders(), [('Content-Length', '4'), ('Content-Type', 'text/plain')])
+        self.assertEqual(resp.read(), b'data')
+        self.assertTrue(resp.isclosed())
+        self.assertFalse(resp.will_close)
+
+    def test_incremental(self):
+        """``HTTPConnection`` parses a response that arrives a byte at a time"""
+        resp = get(make_conn(b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n'
+                             b'4;ext=1\r\ndata\r\n3\r\n!!!\r\n0\r\nX-Trailer: yes\r\n\r\n', step=1))
+
+        self.assertEqual(resp.read(), b'data!!!')
+        self.assertTrue(resp.isclosed())
+
+    def test_chunked(self):
+        """``HTTPConnection`` de-chunks a body, and drops the headers that framed it"""
+        resp = get(make_conn(b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\nContent-Length: 99\r\n'
+                             b'X-Foo: bar\r\n\r\n4\r\ndata\r\n0\r\n\r\n'))
+
+        self.assertEqual(resp.getheaders(), [('X-Foo', 'bar')])
+        self.assertIsNone(resp.length)
+        self.assertEqual(resp.read(), b'data')
+
+    def test_hop_by_hop(self):
+        """``HTTPConnection`` drops hop-by-hop headers, including the ones named in Connection"""
+        resp = get(make_conn(b'HTTP/1.1 200 OK\r\nConnection: close, X-Trace\r\nKeep-Alive: timeout=5\r\n'
+                             b'X-Trace: abc\r\nX-Foo: bar\r\nContent-Length: 0\r\n\r\n'))
+
+        self.assertEqual(resp.getheaders(), [('X-Foo', 'bar'), ('Content-Length', '0')])
+        self.assertTrue(resp.will_close)
+
+    def test_until_close(self):
+        """``HTTPConnection`` reads a body without framing until the back-end closes the connection"""
+        resp = get(make_conn(b'HTTP/1.0 200 OK\r\n\r\nsome data'))
+
+        self.assertTrue(resp.will_close)
+        self.assertEqual(resp.read(), b'some data')
+        self.assertTrue(resp.isclosed())
+
+    def test_http10_keepalive(self):
+        """``HTTPConnection`` keeps an HTTP/1.0 connection open when the back-end asks to"""
+        resp = get(make_conn(b'HTTP/1.0 200 OK\r\nConnection: keep-alive\r\nContent-Length: 0\r\n\r\n'))
+
+        self.assertFalse(resp.will_close)
+
+    def test_no_body(self):
+        """``HTTPConnection`` doesn't read a body for a HEAD request, or a 304"""
+        conn = make_conn(b'HTTP/1.1 200 OK\r\nContent-Length: 4\r\n\r\n'
+                         b'HTTP/1.1 304 Not Modified\r\nContent-Length: 4\r\n\r\n'
+                         b'HTTP/1.1 200 OK\r\nContent-Length: 4\r\n\r\ndata')
+
+        self.assertEqual(get(conn, method='HEAD').read(), b'')
+        self.assertEqual(get(conn).read(), b'')
+        self.assertEqual(get(conn).read(), b'data')
+
+    def test_interim(self):
+        """``HTTPConnection`` skips over 100 Continue"""
+        resp = get(make_conn(b'HTTP/1.1 100 Continue\r\n\r\nHTTP/1.1 201 Created\r\nContent-Length: 0\r\n\r\n'))
+
+        self.assertEqual(resp.status, 201)
+
+    def test_switching_protocols(self):
+        """``HTTPConnection`` keeps the Upgrade headers of a 101, and the bytes sent after it"""
+        conn = make_conn(b'HTTP/1.1 101 Switching Protocols\r\nConnection: Upgrade\r\nUpgrade: websocket\r\n\r\nearly')
+        resp = get(conn)
+
+        self.assertEqual(resp.status, 101)
+        self.assertEqual(resp.getheaders(), [('Connection', 'Upgrade'), ('Upgrade', 'websocket')])
+        self.assertEqual(conn.pop_buffered(), b'early')
+
+    def test_pipelining(self):
+        """``HTTPConnection`` reads the responses to pipelined requests in order"""
+        conn = make_conn(b'HTTP/1.1 200 OK\r\nContent-Length: 3\r\n\r\none'
+                         b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n3\r\ntwo\r\n0\r\n\r\n')
+        conn.request('GET', '/one', headers={})
+        conn.request('GET', '/two', headers={})
+
+        self.assertEqual(conn.getresponse().read(), b'one')
+        self.assertEqual(conn.getresponse().read(), b'two')
+
+    def test_pipelining_reset(self):
+        """``HTTPConnection`` finds the next head after the buffer was emptied by a body"""
+        head = b'HTTP/1.1 200 OK\r\nContent-Length: 3\r\n\r\n'
+        conn = make_conn(head + b'one' + head + b'two', step=len(head))
+        conn.request('GET', '/one', headers={})
+        conn.request('GET', '/two', headers={})
+
+        self.assertEqual(conn.getresponse().read(), b'one')
+        self.assertEqual(conn.getresponse().read(), b'two')
+
+    def test_previous_unread(self):
+        """``HTTPConnection`` won't read a response before the body of the previous one"""
+        conn = make_conn(b'HTTP/1.1 200 OK\r\nContent-Length: 3\r\n\r\none')
+        conn.request('GET', '/one', headers={})
+        conn.request('GET', '/two', headers={})
+        conn.getresponse()
+
+        with self.assertRaises(ResponseNotReady):
+            conn.getresponse()
+
+    def test_large_head(self):
+        """``HTTPConnection`` grows its buffer for a head larger than it"""
+        cookie = b'x' * upstream.BUFFER_SIZE
+        resp = get(make_conn(b'HTTP/1.1 200 OK\r\nSet-Cookie: ' + cookie + b'\r\nContent-Length: 0\r\n\r\n', step=4096))
+
+        self.assertEqual(resp.getheader('set-cookie'), cookie.decode())
+
+    def test_head_too_large(self):
+        """``HTTPConnection`` gives up on a head larger than ``MAX_HEAD_SIZE``"""
+        conn = make_conn(b'HTTP/1.1 200 OK\r\nX-Foo: ' + b'x' * upstream.MAX_HEAD_SIZE * 2)
+
+        with self.assertRaises(upstream.BadResponse):
+            get(conn)
+
+    def test_remote_disconnected(self):
+        """``HTTPConnection`` raises ConnectionResetError if the back-end closed without responding"""
+        with self.assertRaises(RemoteDisconnected):
+            get(make_conn(b''))
+
+    def test_bad_status_line(self):
+        """``HTTPConnection`` raises BadResponse for something that isn't HTTP"""
+        with self.assertRaises(upstream.BadResponse):
+            get(make_conn(b'SSH-2.0-OpenSSH_8.0\r\n\r\n'))
+
+    def test_bad_chunk_size(self):
+        """``HTTPConnection`` raises BadResponse for an invalid chunk size"""
+        resp = get(make_conn(b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\nzz\r\n'))
+
+        with self.assertRaises(upstream.BadResponse):
+            resp.read()
+
+    def test_truncated(self):
+        """``HTTPConnection`` raises IncompleteRead when the body is cut short"""
+        conn = make_conn(b'HTTP/1.1 200 OK\r\nContent-Length: 10\r\n\r\ndata')
+        resp = get(conn)
+
+        with self.assertRaises(IncompleteRead):
+            resp.read()
+        self.assertTrue(resp.will_close)
+        self.assertIsNone(conn.sock)
+
+    def test_close_unread(self):
+        """Closing a response before reading its body closes the connection"""
+        conn = make_conn(b'HTTP/1.1 200 OK\r\nContent-Length: 4\r\n\r\ndata')
+        sock = conn.sock
+        resp = get(conn)
+        resp.close()
+
+        self.assertTrue(sock.closed)
+        self.assertIsNone(conn.sock)
+
+    def test_read1(self):
+        """``read1`` returns what's buffered without waiting for the rest of the body"""
+        resp = get(make_conn(b'HTTP/1.1 200 OK\r\nContent-Length: 8\r\n\r\ndata', step=100))
+
+        self.assertEqual(resp.read1(), b'data')
+
+    def test_would_block(self):
+        """``would_block`` is True only once the back-end hasn't sent more of the body"""
+        conn = make_conn(b'')
+        conn.sock, other = socket.socketpair()
+        self.addCleanup(other.close)
+        self.addCleanup(conn.sock.close)
+        conn.request('GET', '/foo', headers={})
+        other.sendall(b'HTTP/1.1 200 OK\r\nContent-Length: 8\r\n\r\ndata')
+        resp = conn.getresponse()
+
+        self.assertFalse(resp.would_block())
+        resp.read1()
+        self.assertTrue(resp.would_block())
+        other.sendall(b'more')
+        self.assertFalse(resp.would_block())
+        resp.read1()
+        self.assertFalse(resp.would_block())
+
+    def test_read1_chunk_stream(self):
+        """``read1`` returns a chunk without waiting for the back-end to send the next one"""
+        conn = make_conn(b'')
+        conn.sock = SegmentedSocket([b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n5\r\nhello\r\n',
+                                     b'5\r\nworld\r\n', b'0\r\n\r\n'])
+        resp = get(conn)
+
+        self.assertEqual(resp.read1(), b'hello')
+        self.assertEqual(len(conn.sock.segments), 2)
+        self.assertEqual(resp.read1(), b'world')
+        self.assertEqual(resp.read1(), b'')
+
+
+if __name__ == '__main__':
+    unittest.main()
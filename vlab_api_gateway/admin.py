@@ -0,0 +1,91 @@
+# -*- coding: UTF-8 -*-
+"""
+Operational end points of the API gateway itself, under ``/__admin/``.
+
+These end points are only enabled when ``VLAB_ADMIN_TOKEN`` is set, and every
+request must supply that value in the ``X-Admin-Token`` header. Each answers for
+the worker that handled the request.
+"""
+import os
+import hmac
+from urllib.parse import parse_qs
+
+import ujson
+
+from vlab_api_gateway import auth, capture, compress, drain, pool, profiler, shm_cache, spool, tunnel
+from vlab_api_gateway.std_logger import get_logger
+from vlab_api_gateway.constants import const
+
+logger = get_logger(__name__)
+
+PREFIX = '/__admin/'
+MAX_PROFILE_SECONDS = 120
+
+
+def is_admin_request(uri):
+    """Check if the request is for one of the admin end points
+
+    :Returns: Boolean
+
+    :param uri: The API end point being called
+    :type uri: String
+    """
+    return bool(const.VLAB_ADMIN_TOKEN) and uri.startswith(PREFIX)
+
+
+def application(env, start_response, uri):
+    """Handle a request for an admin end point; same API as ``server.application``"""
+    supplied = env.get('HTTP_X_ADMIN_TOKEN', '')
+    if not hmac.compare_digest(supplied.encode(), const.VLAB_ADMIN_TOKEN.encode()):
+        logger.error('Invalid admin token supplied for {}'.format(uri))
+        return _respond(start_response, '403 Forbidden', {'error' : 'invalid admin token'})
+    params = parse_qs(env.get('QUERY_STRING', ''))
+    if uri == PREFIX + 'profile':
+        return _profile(start_response, params)
+    if uri == PREFIX + 'stats':
+        return _respond(start_response, '200 OK', get_stats())
+    return _respond(start_response, '404 Not Found', {'error' : 'no such admin end point {}'.format(uri)})
+
+
+def get_stats():
+    """Collect the counters of every subsystem in this worker
+
+    :Returns: Dictionary
+    """
+    # optional subsystems are None when they're disabled
+    optional = (('auth', auth.VERIFIER), ('shm_cache', shm_cache.CACHE), ('capture', capture.RECORDER))
+    stats = {
+        'pid' : os.getpid(),
+        'requests' : drain.TRACKER.get_stats(),
+        'pool' : pool.POOL.get_stats(),
+        'spool' : spool.get_stats(),
+        'compression' : compress.get_stats(),
+        'tunnels' : tunnel.get_stats(),
+    }
+    for name, subsystem in optional:
+        stats[name] = subsystem.get_stats() if subsystem is not None else None
+    return stats
+
+
+def _profile(start_response, params):
+    """Sample the worker, and return the collapsed stacks (or a JSON report)"""
+    try:
+        seconds = float(params.get('seconds', ['10'])[0])
+    except ValueError:
+        return _respond(start_response, '400 Bad Request', {'error' : 'seconds must be a number'})
+    if not 0 < seconds <= MAX_PROFILE_SECONDS:
+        return _respond(start_response, '400 Bad Request',
+                        {'error' : 'seconds must be between 0 and {}'.format(MAX_PROFILE_SECONDS)})
+    if profiler.PROFILER.running:
+        return _respond(start_response, '409 Conflict', {'error' : 'a profile is already running'})
+    logger.info('Profiling worker for {} seconds'.format(seconds))
+    stacks = profiler.PROFILER.profile(seconds)
+    if params.get('format', [''])[0] == 'json':
+        return _respond(start_response, '200 OK', profiler.PROFILER.report())
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [stacks.encode()]
+
+
+def _respond(start_response, status, content):
+    start_response(status, [('Content-Type', 'application/json')])
+    return [ujson.dumps(content).encode()]
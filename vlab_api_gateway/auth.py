@@ -0,0 +1,192 @@
+# -*- coding: UTF-8 -*-
+"""
+This module verifies the auth token (a JWT) of a request at the API gateway, so
+forged or expired tokens are rejected without a round-trip to a back-end service.
+
+The public key used to sign tokens is obtained from the auth service, and cached.
+Verdicts are cached per token; valid tokens until they expire, invalid tokens for
+``const.VLAB_TOKEN_CACHE_TTL`` seconds. When the shared cache is enabled, verdicts
+are also shared with the other workers on the host. If the auth service cannot be reached,
+requests are passed along as before, and the back-end services have the final say.
+"""
+import time
+from hashlib import blake2b
+from collections import OrderedDict
+from http.client import HTTPConnection, HTTPSConnection, HTTPException
+
+import ujson
+try:
+    import jwt
+except ImportError:
+    jwt = None
+
+from vlab_api_gateway import router, shm_cache
+from vlab_api_gateway.std_logger import get_logger
+from vlab_api_gateway.constants import const
+
+logger = get_logger(__name__)
+
+# Don't hammer the auth service if someone sends a lot of bad signatures
+MIN_KEY_REFRESH = 60
+
+
+class TokenVerifier:
+    """Checks the signature and expiration of auth tokens
+
+    :param key_ttl: Seconds to use the public key before fetching it again.
+    :type key_ttl: Integer
+
+    :param cache_size: The max number of verdicts to remember.
+    :type cache_size: Integer
+
+    :param cache_ttl: The max seconds to remember a verdict.
+    :type cache_ttl: Integer
+    """
+    def __init__(self, key_ttl, cache_size, cache_ttl):
+        self.key_ttl = key_ttl
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self._key = None
+        self._algorithm = None
+        self._key_fetched_at = 0
+        # token -> (is_valid, expires_at); least recently used first
+        self._verdicts = OrderedDict()
+        self.stats = {
+            'hits' : 0,
+            'misses' : 0,
+            'rejected' : 0,
+            'key_fetches' : 0,
+        }
+
+    def verify(self, token):
+        """Check if an auth token is valid
+
+        :Returns: Boolean
+
+        :param token: The JWT supplied in the request
+        :type token: Bytes
+        """
+        now = time.time()
+        verdict = self._verdicts.get(token)
+        if verdict is not None:
+            valid, expires_at = verdict
+            if now < expires_at:
+                self._verdicts.move_to_end(token)
+                self.stats['hits'] += 1
+                if not valid:
+                    self.stats['rejected'] += 1
+                return valid
+            del self._verdicts[token]
+        self.stats['misses'] += 1
+        shared_key = b'jwt:' + blake2b(token, digest_size=16).digest()
+        valid, expires_at = self._shared_verdict(shared_key, now)
+        if expires_at is None:
+            valid, expires_at = self._check(token, now)
+            if expires_at and shm_cache.CACHE is not None:
+                shm_cache.CACHE.set(shared_key, b'%d %f' % (valid, expires_at), expires_at - now)
+        if expires_at:
+            self._remember(token, valid, expires_at)
+        if not valid:
+            self.stats['rejected'] += 1
+        return valid
+
+    def _shared_verdict(self, shared_key, now):
+        """Look up a verdict made by another worker
+
+        :Returns: Tuple (is_valid, verdict_expires_at). The expiration is None if
+                  there's no shared verdict.
+        """
+        if shm_cache.CACHE is None:
+            return False, None
+        verdict = shm_cache.CACHE.get(shared_key)
+        if verdict is None:
+            return False, None
+        valid, expires_at = verdict.split(b' ')
+        return valid == b'1', float(expires_at)
+
+    def _remember(self, token, valid, expires_at):
+        self._verdicts[token] = (valid, expires_at)
+        while len(self._verdicts) > self.cache_size:
+            self._verdicts.popitem(last=False)
+
+    def _check(self, token, now):
+        """Verify the token against the public key of the auth service
+
+        :Returns: Tuple (is_valid, verdict_expires_at). An expiration of zero means
+                  the verdict must not be cached.
+        """
+        if now - self._key_fetched_at > self.key_ttl:
+            self._refresh_key(now)
+        if self._key is None:
+            # fail open; the back-end services still verify the token
+            return True, 0
+        try:
+            claims = self._decode(token)
+        except jwt.InvalidSignatureError:
+            if now - self._key_fetched_at < MIN_KEY_REFRESH:
+                return False, now + self.cache_ttl
+            # the auth service might have rotated its key
+            logger.info('Token signature mismatch; refreshing auth public key')
+            self._refresh_key(now)
+            try:
+                claims = self._decode(token)
+            except jwt.InvalidTokenError:
+                return False, now + self.cache_ttl
+        except jwt.InvalidTokenError:
+            return False, now + self.cache_ttl
+        return True, min(claims['exp'], now + self.cache_ttl)
+
+    def _decode(self, token):
+        return jwt.decode(token, self._key, algorithms=[self._algorithm],
+                          options={'require' : ['exp']})
+
+    def _refresh_key(self, now):
+        """Obtain the public key used to sign auth tokens from the auth service"""
+        self.stats['key_fetches'] += 1
+        self._key_fetched_at = now
+        host, tls, port = router.SERVICE_MAP['auth']
+        # a hung auth service must not hang the request that needed the key
+        if tls:
+            conn = HTTPSConnection(host=host, port=port, timeout=const.VLAB_AUTH_KEY_TIMEOUT,
+                                   context=const.VLAB_SSL_CONTEXT)
+        else:
+            conn = HTTPConnection(host=host, port=port, timeout=const.VLAB_AUTH_KEY_TIMEOUT)
+        try:
+            conn.request('GET', const.VLAB_AUTH_KEY_URI)
+            resp = conn.getresponse()
+            content = ujson.loads(resp.read())['content']
+            self._key = content['key']
+            self._algorithm = content['algorithm']
+        except (OSError, HTTPException, ValueError, KeyError, TypeError) as doh:
+            logger.error('Unable to obtain auth public key: {}'.format(doh))
+            # try again soon, instead of waiting for the key TTL to expire
+            self._key_fetched_at = now - self.key_ttl + MIN_KEY_REFRESH
+        finally:
+            conn.close()
+
+    def get_stats(self):
+        """Obtain a snapshot of the verification counters
+
+        :Returns: Dictionary
+        """
+        stats = dict(self.stats)
+        stats['cached'] = len(self._verdicts)
+        return stats
+
+
+def _get_verifier():
+    """Create the ``TokenVerifier`` if edge verification is enabled
+
+    :Returns: TokenVerifier or None
+    """
+    if not const.VLAB_VERIFY_TOKENS:
+        return None
+    elif jwt is None:
+        logger.error('VLAB_VERIFY_TOKENS is set, but PyJWT is not installed; tokens will not be verified')
+        return None
+    return TokenVerifier(key_ttl=const.VLAB_AUTH_KEY_TTL,
+                         cache_size=const.VLAB_TOKEN_CACHE_SIZE,
+                         cache_ttl=const.VLAB_TOKEN_CACHE_TTL)
+
+
+VERIFIER = _get_verifier()
@@ -0,0 +1,289 @@
+# -*- coding: UTF-8 -*-
+"""
+Records the shape of the traffic going through the API gateway, so it can be
+replayed for load testing (see ``benchmarks/replay.py``).
+
+Only sanitized metadata is recorded; the URI with IDs replaced by placeholders,
+the names (not values) of query parameters, sizes, timings, the status, and a
+short hash of the auth token instead of the token itself. Records are buffered
+in memory, and appended in batches to a gzip file per worker; every batch is a
+complete gzip member, so a file is readable even while it's still being written.
+In a gunicorn worker, batches are compressed and written by a background greenlet,
+not by the greenlet handling a request.
+"""
+import os
+import re
+import gzip
+import time
+import atexit
+from hashlib import blake2b
+from urllib.parse import parse_qs
+
+import ujson
+import gevent
+from gevent.event import Event
+
+from vlab_api_gateway import router
+from vlab_api_gateway.std_logger import get_logger
+from vlab_api_gateway.constants import const
+
+logger = get_logger(__name__)
+
+PLACEHOLDER = '{id}'
+DYNAMIC_SEGMENT = re.compile(r'^(\d+|[0-9a-fA-F]{8,}|[0-9a-fA-F]{8}(-[0-9a-fA-F]{4}){3}-[0-9a-fA-F]{12}|[\d.:]{7,})$')
+
+
+def uri_template(uri):
+    """Replace the parts of a URI that identify a specific object (numbers, UUIDs,
+    hashes and IPs) with a placeholder
+
+    :Returns: String
+
+    :param uri: The API end point being called
+    :type uri: String
+    """
+    layers = uri.split('/')
+    # the API version (i.e. /api/2) is part of the route, not an ID
+    return '/'.join(layers[:router.SERVICE] +
+                    [PLACEHOLDER if DYNAMIC_SEGMENT.match(x) else x for x in layers[router.SERVICE:]])
+
+
+def token_hash(token):
+    """Obtain a short, non-reversible, ID for an auth token
+
+    :Returns: String
+
+    :param token: The JWT supplied in the request
+    :type token: Bytes
+    """
+    if not token:
+        return ''
+    return blake2b(token, digest_size=8).hexdigest()
+
+
+def _request_bytes(env):
+    """The Content-Length of a request; a malformed one is answered by ``server`` with HTTP 400"""
+    try:
+        return int(env.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        return 0
+
+
+class Recorder:
+    """Buffers capture records, and appends them in batches to a file
+
+    :param path: The file to append records to.
+    :type path: String
+
+    :param batch_size: Write to the file once this many records are buffered.
+    :type batch_size: Integer
+
+    :param flush_interval: Write to the file if the oldest buffered record is older
+                           than this many seconds.
+    :type flush_interval: Integer or Float
+    """
+    def __init__(self, path, batch_size, flush_interval):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffer = []
+        self._last_flush = time.monotonic()
+        self._flusher = None
+        self._wake = Event()
+        self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        self.stats = {
+            'recorded' : 0,
+            'flushes' : 0,
+            'bytes_written' : 0,
+            'errors' : 0,
+        }
+
+    def wrap(self, app, env, start_response):
+        """Call a WSGI application, and record the request once its response is sent
+
+        :Returns: CapturedResponse
+
+        :param app: The WSGI application to call
+        :type app: Function
+
+        :param env: The WSGI environment of the request
+        :type env: Dictionary
+
+        :param start_response: The WSGI start_response callable
+        :type start_response: Function
+        """
+        started = time.perf_counter()
+        uri = env.get('PATH_INFO', '') or env.get('RAW_URI', '')
+        record = {
+            'ts' : round(time.time(), 6),
+            'method' : env.get('REQUEST_METHOD', ''),
+            'uri' : uri_template(uri),
+            'query' : sorted(parse_qs(env.get('QUERY_STRING', ''), keep_blank_values=True)),
+            'resource' : router.get_resource(uri),
+            'token' : token_hash(env.get('HTTP_X_AUTH', '').encode()),
+            'request_bytes' : _request_bytes(env),
+            'chunked' : env.get('HTTP_TRANSFER_ENCODING', '').lower() == 'chunked',
+        }
+
+        def capture_start_response(status, headers, exc_info=None):
+            record['status'] = int(status[:3])
+            record['head_ms'] = round((time.perf_counter() - started) * 1000, 3)
+            if exc_info:
+                return start_response(status, headers, exc_info)
+            return start_response(status, headers)
+
+        resp = app(env, capture_start_response)
+        return CapturedResponse(resp, record, started, self)
+
+    def add(self, record):
+        """Buffer a record, writing the buffer to the file when it's full or old
+
+        :Returns: None
+
+        :param record: The details of a request
+        :type record: Dictionary
+        """
+        self._buffer.append(record)
+        self.stats['recorded'] += 1
+        if self._flusher is not None:
+            if len(self._buffer) >= self.batch_size:
+                self._wake.set()
+        elif len(self._buffer) >= self.batch_size or time.monotonic() - self._last_flush > self.flush_interval:
+            self.flush()
+
+    def start_flusher(self):
+        """Write the buffer from a background greenlet; when a batch fills, and
+        every ``flush_interval`` seconds even if no requests arrive. Must be called
+        from the process that records (i.e. in a gunicorn worker).
+
+        :Returns: None
+        """
+        if self._flusher is None:
+            self._flusher = gevent.spawn(self._flush_forever)
+
+    def _flush_forever(self):
+        while True:
+            self._wake.wait(timeout=self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self):
+        """Append the buffered records to the file, as one gzip member
+
+        :Returns: None
+        """
+        self._last_flush = time.monotonic()
+        if not self._buffer or self._fd is None:
+            return
+        lines = ''.join(ujson.dumps(x) + '\n' for x in self._buffer)
+        self._buffer = []
+        data = gzip.compress(lines.encode(), compresslevel=6)
+        try:
+            os.write(self._fd, data)
+        except OSError as doh:
+            # losing a batch of metadata isn't worth failing requests over
+            self.stats['errors'] += 1
+            logger.error('Unable to write capture to {}: {}'.format(self.path, doh))
+        else:
+            self.stats['flushes'] += 1
+            self.stats['bytes_written'] += len(data)
+
+    def get_stats(self):
+        """Obtain a snapshot of the capture counters
+
+        :Returns: Dictionary
+        """
+        stats = dict(self.stats)
+        stats['buffered'] = len(self._buffer)
+        return stats
+
+    def close(self):
+        """Write any buffered records, and close the file"""
+        if self._fd is None:
+            return
+        if self._flusher is not None:
+            self._flusher.kill(block=False)
+            self._flusher = None
+        self.flush()
+        os.close(self._fd)
+        self._fd = None
+
+
+class CapturedResponse:
+    """Passes along the response of a WSGI application, counting the bytes sent
+
+    :param resp: The response of the WSGI application
+    :type resp: Iterable
+
+    :param record: The details of the request, so far
+    :type record: Dictionary
+
+    :param started: When the request was received, per ``time.perf_counter``
+    :type started: Float
+
+    :param recorder: Where to save the record once the response is sent
+    :type recorder: Recorder
+    """
+    def __init__(self, resp, record, started, recorder):
+        self._resp = resp
+        self._record = record
+        self._started = started
+        self._recorder = recorder
+        self._sent = 0
+
+    def __iter__(self):
+        for data in self._resp:
+            self._sent += len(data)
+            yield data
+
+    def close(self):
+        if hasattr(self._resp, 'close'):
+            self._resp.close()
+        if self._record is None:
+            return
+        self._record['response_bytes'] = self._sent
+        self._record['total_ms'] = round((time.perf_counter() - self._started) * 1000, 3)
+        self._recorder.add(self._record)
+        self._record = None
+
+
+def read_capture(paths):
+    """Load the records of one or more capture files, ordered by when they were received
+
+    :Returns: List
+
+    :param paths: The capture files to read
+    :type paths: List
+    """
+    records = []
+    for path in paths:
+        with gzip.open(path, 'rt') as the_file:
+            try:
+                for line in the_file:
+                    records.append(ujson.loads(line))
+            except EOFError:
+                # the worker was still writing the last batch
+                logger.info('Ignoring truncated batch at end of {}'.format(path))
+    records.sort(key=lambda x: x['ts'])
+    return records
+
+
+def _get_recorder():
+    """Create the ``Recorder`` if capturing traffic is enabled
+
+    :Returns: Recorder or None
+    """
+    if not const.VLAB_CAPTURE_DIR:
+        return None
+    path = os.path.join(const.VLAB_CAPTURE_DIR, 'vlab-capture-{}.jsonl.gz'.format(os.getpid()))
+    try:
+        recorder = Recorder(path, const.VLAB_CAPTURE_BATCH, const.VLAB_CAPTURE_FLUSH_SECONDS)
+    except OSError as doh:
+        logger.error('Unable to capture traffic to {}: {}'.format(path, doh))
+        return None
+    atexit.register(recorder.close)
+    logger.info('Capturing traffic to {}'.format(path))
+    return recorder
+
+
+RECORDER = _get_recorder()
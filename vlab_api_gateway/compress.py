@@ -0,0 +1,200 @@
+# -*- coding: UTF-8 -*-
+"""
+This module compresses responses from the back-end services on the fly, for
+clients that accept it.
+
+A response is compressed when the client sent ``Accept-Encoding`` with gzip or
+deflate, the back-end didn't already encode it, and the content type is one
+that compresses well (i.e. JSON). The body is compressed as it's streamed to
+the client, so memory use doesn't depend on the size of the response. When the
+back-end hasn't sent the next block yet, what's been compressed so far is flushed
+to the client, so a slow stream (i.e. a long poll) isn't held up waiting to fill
+the compressor.
+"""
+import zlib
+
+from vlab_api_gateway.std_logger import get_logger
+from vlab_api_gateway.constants import const
+
+logger = get_logger(__name__)
+
+# the wbits for zlib.compressobj; gzip has its own header, deflate is zlib wrapped per RFC 9110
+ENCODINGS = {'gzip' : 16 + zlib.MAX_WBITS, 'deflate' : zlib.MAX_WBITS}
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript',
+                      'application/xml', 'image/svg+xml')
+COMPRESSIBLE_SUFFIXES = ('+json', '+xml')
+# streams (i.e. text/event-stream) must not wait on the compressor to fill a block
+NEVER_COMPRESS = ('text/event-stream',)
+STATS = {
+    'responses' : 0,
+    'bytes_in' : 0,
+    'bytes_out' : 0,
+}
+
+
+def get_stats():
+    """Obtain a snapshot of the compression counters
+
+    :Returns: Dictionary
+    """
+    stats = dict(STATS)
+    stats['bytes_saved'] = stats['bytes_in'] - stats['bytes_out']
+    return stats
+
+
+def choose_encoding(accept_encoding):
+    """Pick the encoding to use, based on the Accept-Encoding header of the client
+
+    :Returns: String or None
+
+    :param accept_encoding: The value of the Accept-Encoding header
+    :type accept_encoding: String
+    """
+    accepted = {}
+    for item in accept_encoding.lower().split(','):
+        coding, _, params = item.partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip()] = quality
+    for encoding in ENCODINGS:
+        if accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return None
+
+
+def _compressible(content_type):
+    content_type = content_type.split(';')[0].strip().lower()
+    if content_type in NEVER_COMPRESS:
+        return False
+    return content_type.startswith(COMPRESSIBLE_TYPES) or content_type.endswith(COMPRESSIBLE_SUFFIXES)
+
+
+def negotiate(env, resource, status, headers):
+    """Decide if a response should be compressed
+
+    :Returns: String (the encoding) or None
+
+    :param env: The WSGI environment of the request
+    :type env: Dictionary
+
+    :param resource: The ``SERVICE_MAP`` resource that handled the request
+    :type resource: String
+
+    :param status: The HTTP status of the response, i.e. '200 OK'
+    :type status: String
+
+    :param headers: The HTTP headers of the response
+    :type headers: List
+    """
+    if not const.VLAB_COMPRESSION:
+        return None
+    if const.VLAB_COMPRESSION_SERVICES and resource not in const.VLAB_COMPRESSION_SERVICES:
+        return None
+    if env.get('REQUEST_METHOD') == 'HEAD' or status[:3] in ('204', '206', '304') or status[0] == '1':
+        return None
+    encoding = choose_encoding(env.get('HTTP_ACCEPT_ENCODING', ''))
+    if encoding is None:
+        return None
+    content_type = ''
+    for name, value in headers:
+        name = name.lower()
+        if name == 'content-encoding' and value.strip().lower() != 'identity':
+            return None
+        elif name == 'content-type':
+            content_type = value
+        elif name == 'cache-control' and 'no-transform' in value.lower():
+            # RFC 9111, section 5.2.2.6
+            return None
+        elif name == 'content-length' and value.isdigit() and int(value) < const.VLAB_COMPRESSION_MIN_SIZE:
+            return None
+    if not _compressible(content_type):
+        return None
+    return encoding
+
+
+def compressed_headers(headers, encoding):
+    """Rewrite the headers of a response for the compressed body
+
+    :Returns: List
+
+    :param headers: The HTTP headers of the response from the back-end
+    :type headers: List
+
+    :param encoding: The encoding used to compress the body
+    :type encoding: String
+    """
+    new_headers = []
+    vary = None
+    for name, value in headers:
+        lower = name.lower()
+        if lower == 'content-length':
+            # the compressed size isn't known until it's all been sent
+            continue
+        elif lower == 'content-encoding':
+            # i.e. "identity"; replaced with the encoding actually used
+            continue
+        elif lower == 'vary':
+            vary = value
+            continue
+        elif lower == 'etag' and not value.startswith('W/'):
+            # the bytes are different, so a strong validator would be a lie
+            value = 'W/' + value
+        new_headers.append((name, value))
+    if vary is None:
+        vary = 'Accept-Encoding'
+    elif vary.strip() != '*' and 'accept-encoding' not in vary.lower():
+        vary += ', Accept-Encoding'
+    new_headers.append(('Vary', vary))
+    new_headers.append(('Content-Encoding', encoding))
+    return new_headers
+
+
+class CompressedResponse:
+    """Compresses a response while it's sent to the client
+
+    :param resp: The response from the back-end. If it has a ``would_block`` method,
+                 the compressor is flushed whenever the next block isn't ready yet.
+    :type resp: vlab_api_gateway.relay.RelayQuery
+
+    :param encoding: The encoding to use; gzip or deflate
+    :type encoding: String
+
+    :param level: The compression level, from 1 (fastest) to 9 (smallest)
+    :type level: Integer
+    """
+    def __init__(self, resp, encoding, level):
+        self._resp = resp
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, ENCODINGS[encoding])
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def __iter__(self):
+        compress = self._compressor.compress
+        flush = self._compressor.flush
+        would_block = getattr(self._resp, 'would_block', None)
+        for data in self._resp:
+            self.bytes_in += len(data)
+            data = compress(data)
+            if would_block is not None and would_block():
+                # don't make the client wait on the back-end for what's already been read
+                data += flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                self.bytes_out += len(data)
+                yield data
+        data = self._compressor.flush()
+        self.bytes_out += len(data)
+        yield data
+
+    def close(self):
+        if self._resp is None:
+            return
+        self._resp.close()
+        self._resp = None
+        STATS['responses'] += 1
+        STATS['bytes_in'] += self.bytes_in
+        STATS['bytes_out'] += self.bytes_out
@@ -1,7 +1,36 @@
 # -*- coding: UTF-8 -*-
 """Configuration file for running gunicorn webserver"""
+from vlab_api_gateway.constants import const
 
 bind='0.0.0.0'
 worker_class='gevent'
 workers=1
 name='vlab-api-gateway'
+graceful_timeout=const.VLAB_DRAIN_TIMEOUT
+
+
+def post_worker_init(worker):
+    """Lets a sampling profile of a worker be captured by sending it SIGUSR2,
+    drains in-flight requests when the worker is sent SIGTERM, reaps idle
+    back-end connections, and writes captured traffic in the background"""
+    from vlab_api_gateway import capture, drain, pool, profiler
+    profiler.install_signal_handler()
+    drain.install_signal_handler()
+    pool.POOL.start_reaper()
+    if capture.RECORDER is not None:
+        capture.RECORDER.start_flusher()
+
+
+def post_request(worker, req, environ, resp):
+    """Drains a worker that gunicorn is recycling (i.e. after ``max_requests``),
+    which doesn't get a SIGTERM"""
+    if not worker.alive:
+        from vlab_api_gateway import drain
+        drain.TRACKER.start_drain(const.VLAB_DRAIN_TIMEOUT)
+
+
+def worker_exit(server, worker):
+    """Writes any captured traffic that's still buffered before the worker exits"""
+    from vlab_api_gateway import capture
+    if capture.RECORDER is not None:
+        capture.RECORDER.close()
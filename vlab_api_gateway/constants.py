@@ -16,9 +16,88 @@ def _get_ssl_context():
     return context
 
 
+def _get_bool(name, default='false'):
+    """Read a true/false style environment variable
+
+    :Returns: Boolean
+
+    :param name: The name of the environment variable
+    :type name: String
+
+    :param default: The value to use when the variable is not set.
+    :type default: String
+    """
+    return environ.get(name, default).lower() == 'true'
+
+
+def _get_int(name, default):
+    """Read an integer environment variable, falling back to the default if
+    the supplied value is not a number.
+
+    :Returns: Integer
+
+    :param name: The name of the environment variable
+    :type name: String
+
+    :param default: The value to use when the variable is not set, or invalid.
+    :type default: Integer
+    """
+    try:
+        return int(environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def _get_list(name):
+    """Read a comma separated environment variable
+
+    :Returns: Tuple
+
+    :param name: The name of the environment variable
+    :type name: String
+    """
+    return tuple(x.strip() for x in environ.get(name, '').split(',') if x.strip())
+
+
 DEFINED = OrderedDict([
             ('VLAB_FQDN', environ.get('VLAB_FQDN', 'vlab.local')),
             ('VLAB_SSL_CONTEXT', _get_ssl_context()),
+            ('VLAB_RESPONSE_BUFFERING', _get_bool('VLAB_RESPONSE_BUFFERING')),
+            ('VLAB_RESPONSE_BUFFER_MEMORY', _get_int('VLAB_RESPONSE_BUFFER_MEMORY', 1048576)),
+            ('VLAB_RESPONSE_BUFFER_DISK', _get_int('VLAB_RESPONSE_BUFFER_DISK', 536870912)),
+            ('VLAB_REQUEST_BLOCK_SIZE', _get_int('VLAB_REQUEST_BLOCK_SIZE', 65536)),
+            ('VLAB_REQUEST_MAX_BODY', _get_int('VLAB_REQUEST_MAX_BODY', 17179869184)),
+            ('VLAB_REQUEST_SPOOLING', _get_bool('VLAB_REQUEST_SPOOLING')),
+            ('VLAB_REQUEST_SPOOL_MEMORY', _get_int('VLAB_REQUEST_SPOOL_MEMORY', 1048576)),
+            ('VLAB_UPSTREAM_KEEPALIVE', _get_bool('VLAB_UPSTREAM_KEEPALIVE', 'true')),
+            ('VLAB_POOL_MAX_CONNECTIONS', _get_int('VLAB_POOL_MAX_CONNECTIONS', 512)),
+            ('VLAB_POOL_MAX_PER_HOST', _get_int('VLAB_POOL_MAX_PER_HOST', 4)),
+            ('VLAB_POOL_IDLE_TIMEOUT', _get_int('VLAB_POOL_IDLE_TIMEOUT', 30)),
+            ('VLAB_VERIFY_TOKENS', _get_bool('VLAB_VERIFY_TOKENS')),
+            ('VLAB_AUTH_KEY_URI', environ.get('VLAB_AUTH_KEY_URI', '/api/1/auth/key')),
+            ('VLAB_AUTH_KEY_TTL', _get_int('VLAB_AUTH_KEY_TTL', 3600)),
+            ('VLAB_AUTH_KEY_TIMEOUT', _get_int('VLAB_AUTH_KEY_TIMEOUT', 2)),
+            ('VLAB_TOKEN_CACHE_SIZE', _get_int('VLAB_TOKEN_CACHE_SIZE', 10000)),
+            ('VLAB_TOKEN_CACHE_TTL', _get_int('VLAB_TOKEN_CACHE_TTL', 60)),
+            ('VLAB_SHM_CACHE_PATH', environ.get('VLAB_SHM_CACHE_PATH', '')),
+            ('VLAB_SHM_CACHE_SLOTS', _get_int('VLAB_SHM_CACHE_SLOTS', 65536)),
+            ('VLAB_DNS_CACHE_TTL', _get_int('VLAB_DNS_CACHE_TTL', 30)),
+            ('VLAB_ADMIN_TOKEN', environ.get('VLAB_ADMIN_TOKEN', '')),
+            ('VLAB_PROFILE_INTERVAL', _get_int('VLAB_PROFILE_INTERVAL', 5)),
+            ('VLAB_PROFILE_BLOCK_MS', _get_int('VLAB_PROFILE_BLOCK_MS', 100)),
+            ('VLAB_PROFILE_SECONDS', _get_int('VLAB_PROFILE_SECONDS', 30)),
+            ('VLAB_PROFILE_DIR', environ.get('VLAB_PROFILE_DIR', '/tmp')),
+            ('VLAB_CAPTURE_DIR', environ.get('VLAB_CAPTURE_DIR', '')),
+            ('VLAB_CAPTURE_BATCH', _get_int('VLAB_CAPTURE_BATCH', 500)),
+            ('VLAB_CAPTURE_FLUSH_SECONDS', _get_int('VLAB_CAPTURE_FLUSH_SECONDS', 10)),
+            ('VLAB_TUNNEL_MAX_PER_HOST', _get_int('VLAB_TUNNEL_MAX_PER_HOST', 100)),
+            ('VLAB_TUNNEL_IDLE_TIMEOUT', _get_int('VLAB_TUNNEL_IDLE_TIMEOUT', 300)),
+            ('VLAB_TUNNEL_BUFFER_SIZE', _get_int('VLAB_TUNNEL_BUFFER_SIZE', 16384)),
+            ('VLAB_DRAIN_TIMEOUT', _get_int('VLAB_DRAIN_TIMEOUT', 30)),
+            ('VLAB_COMPRESSION', _get_bool('VLAB_COMPRESSION')),
+            ('VLAB_COMPRESSION_LEVEL', _get_int('VLAB_COMPRESSION_LEVEL', 6)),
+            ('VLAB_COMPRESSION_MIN_SIZE', _get_int('VLAB_COMPRESSION_MIN_SIZE', 1024)),
+            ('VLAB_COMPRESSION_SERVICES', _get_list('VLAB_COMPRESSION_SERVICES')),
           ])
 
 Constants = namedtuple('Constants', list(DEFINED.keys()))
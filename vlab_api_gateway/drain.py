@@ -0,0 +1,175 @@
+# -*- coding: UTF-8 -*-
+"""
+Lets a worker finish the requests it's handling before it exits, so restarting
+(or recycling) workers doesn't cut off clients mid-response.
+
+On SIGTERM, gunicorn stops accepting connections, and waits up to
+``graceful_timeout`` seconds for the active ones to finish. On top of that, the
+gateway reports itself as not ready via ``READY_URI``, closes the idle
+connections to the back-end services, and logs how the drain went. gunicorn
+itself closes each client connection once its current response is sent.
+"""
+import time
+import signal
+
+import gevent
+
+from vlab_api_gateway.std_logger import get_logger
+from vlab_api_gateway.constants import const
+from vlab_api_gateway import pool
+
+logger = get_logger(__name__)
+
+READY_URI = '/__ready'
+CHECK_INTERVAL = 0.5
+
+
+class Tracker:
+    """Counts the requests that are in flight, and drains them on shutdown"""
+    def __init__(self):
+        self.in_flight = 0
+        self.draining = False
+        self.drain_started_at = None
+        self.stats = {
+            'requests' : 0,
+            'drained' : 0,
+        }
+
+    def track(self, app, env, start_response):
+        """Call a WSGI application, counting the request as in flight until its
+        response is closed
+
+        :Returns: TrackedResponse
+
+        :param app: The WSGI application to call
+        :type app: Function
+
+        :param env: The WSGI environment of the request
+        :type env: Dictionary
+
+        :param start_response: The WSGI start_response callable
+        :type start_response: Function
+        """
+        self.in_flight += 1
+        self.stats['requests'] += 1
+        try:
+            resp = app(env, start_response)
+        except BaseException:
+            self._finished()
+            raise
+        return TrackedResponse(resp, self)
+
+    def _finished(self):
+        self.in_flight -= 1
+        if self.draining:
+            self.stats['drained'] += 1
+
+    def is_ready(self):
+        """Check if the worker should be sent new requests
+
+        :Returns: Boolean
+        """
+        return not self.draining
+
+    def start_drain(self, deadline):
+        """Stop being ready, close idle back-end connections, and watch the
+        in-flight requests finish
+
+        :Returns: None
+
+        :param deadline: Seconds to wait for in-flight requests to finish
+        :type deadline: Integer or Float
+        """
+        if self.draining:
+            return
+        self.draining = True
+        self.drain_started_at = time.monotonic()
+        # closing sockets isn't safe from within a signal handler
+        gevent.spawn(self._watch, deadline)
+
+    def _watch(self, deadline):
+        """Close the idle back-end connections, and log the outcome of the drain"""
+        idle = len(pool.POOL)
+        pool.POOL.close()
+        logger.info('Draining {} in-flight requests; closed {} idle back-end connections'.format(self.in_flight, idle))
+        while self.in_flight and time.monotonic() - self.drain_started_at < deadline:
+            gevent.sleep(CHECK_INTERVAL)
+        elapsed = round(time.monotonic() - self.drain_started_at, 2)
+        if self.in_flight:
+            logger.error('Drain deadline of {}s passed; {} requests finished, {} will be cut off'.format(deadline,
+                                                                                                    self.stats['drained'],
+                                                                                                    self.in_flight))
+        else:
+            logger.info('Drained {} requests in {}s'.format(self.stats['drained'], elapsed))
+
+    def get_stats(self):
+        """Obtain a snapshot of the request counters
+
+        :Returns: Dictionary
+        """
+        stats = dict(self.stats)
+        stats['in_flight'] = self.in_flight
+        stats['draining'] = self.draining
+        return stats
+
+
+class TrackedResponse:
+    """Passes along the response of a WSGI application, and tells the ``Tracker``
+    when it's been closed
+
+    :param resp: The response of the WSGI application
+    :type resp: Iterable
+
+    :param tracker: The tracker counting the request
+    :type tracker: Tracker
+    """
+    def __init__(self, resp, tracker):
+        self._resp = resp
+        self._tracker = tracker
+
+    def __iter__(self):
+        # hand out the response's own iterator; tracking adds nothing per chunk
+        return iter(self._resp)
+
+    def close(self):
+        if self._tracker is None:
+            return
+        try:
+            if hasattr(self._resp, 'close'):
+                self._resp.close()
+        finally:
+            self._tracker._finished()
+            self._tracker = None
+
+
+def ready(start_response):
+    """Answer a readiness probe; HTTP 503 once the worker is draining
+
+    :Returns: List
+    """
+    if TRACKER.is_ready():
+        start_response('200 OK', [('Content-Type', 'application/json')])
+        return [b'{"ready": true}']
+    start_response('503 Service Unavailable', [('Content-Type', 'application/json')])
+    return [b'{"ready": false}']
+
+
+def install_signal_handler():
+    """Drain in-flight requests when a gunicorn worker is told to exit gracefully
+
+    :Returns: None
+    """
+    previous = signal.getsignal(signal.SIGTERM)
+
+    def handle_term(sig, frame):
+        TRACKER.start_drain(const.VLAB_DRAIN_TIMEOUT)
+        if callable(previous):
+            # gunicorn's handler stops accepting new connections
+            previous(sig, frame)
+
+    signal.signal(signal.SIGTERM, handle_term)
+    # like gunicorn, don't let SIGTERM interrupt system calls of active requests
+    signal.siginterrupt(signal.SIGTERM, False)
+
+
+TRACKER = Tracker()
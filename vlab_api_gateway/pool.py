@@ -0,0 +1,230 @@
+# -*- coding: UTF-8 -*-
+"""
+This module keeps idle keep-alive connections to the back-end services.
+
+Every vLab user has their own NATing firewall, so the API gateway talks to
+thousands of distinct hosts with very skewed traffic. To keep the number of open
+file descriptors predictable, the pool has a global budget of idle connections,
+a cap per host, and evicts the least recently used host when the budget is
+exceeded. Connections to hosts that have gone quiet are reclaimed after an idle
+timeout, by a greenlet that runs even when no requests are arriving.
+"""
+import time
+import select
+from collections import OrderedDict
+
+import gevent
+
+from vlab_api_gateway.constants import const
+
+
+class ConnectionPool:
+    """A bounded, LRU pool of idle back-end connections
+
+    :param max_connections: The max number of idle connections held, across all hosts.
+    :type max_connections: Integer
+
+    :param max_per_host: The max number of idle connections held for a single host.
+    :type max_per_host: Integer
+
+    :param idle_timeout: Seconds an idle connection is kept before being closed.
+    :type idle_timeout: Integer
+    """
+    def __init__(self, max_connections, max_per_host, idle_timeout):
+        self.max_connections = max_connections
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        # host key -> list of (connection, released_at); least recently used host first
+        self._idle = OrderedDict()
+        self._count = 0
+        self._reaper = None
+        self.closed = False
+        self.stats = {
+            'hits' : 0,
+            'misses' : 0,
+            'evicted' : 0,
+            'reaped' : 0,
+            'discarded' : 0,
+        }
+
+    def __len__(self):
+        return self._count
+
+    def get(self, key):
+        """Obtain an idle connection to a host
+
+        :Returns: vlab_api_gateway.upstream.HTTPConnection or None
+
+        :param key: Identifies the host; (host, port, tls)
+        :type key: Tuple
+        """
+        now = time.monotonic()
+        self._reap_lru(now)
+        while True:
+            conns = self._idle.get(key)
+            if not conns:
+                break
+            conn, released_at = conns.pop()
+            self._count -= 1
+            if conns:
+                self._idle.move_to_end(key)
+            else:
+                del self._idle[key]
+            # the staleness check can yield to other greenlets, so the pool
+            # bookkeeping must be done before it
+            if now - released_at < self.idle_timeout and not _is_stale(conn):
+                self.stats['hits'] += 1
+                return conn
+            self.stats['reaped'] += 1
+            conn.close()
+        self.stats['misses'] += 1
+        return None
+
+    def put(self, key, conn):
+        """Return a connection to the pool so it can be reused
+
+        :Returns: None
+
+        :param key: Identifies the host; (host, port, tls)
+        :type key: Tuple
+
+        :param conn: The connection to keep
+        :type conn: vlab_api_gateway.upstream.HTTPConnection
+        """
+        if self.closed:
+            conn.close()
+            return
+        now = time.monotonic()
+        conns = self._idle.setdefault(key, [])
+        self._idle.move_to_end(key)
+        if len(conns) >= self.max_per_host:
+            self.stats['discarded'] += 1
+            conn.close()
+        else:
+            conns.append((conn, now))
+            self._count += 1
+        while self._count > self.max_connections:
+            self._evict_lru()
+        self._reap_lru(now)
+
+    def _evict_lru(self):
+        key, conns = next(iter(self._idle.items()))
+        conn, _ = conns.pop(0)
+        conn.close()
+        self._count -= 1
+        self.stats['evicted'] += 1
+        if not conns:
+            del self._idle[key]
+
+    def reap(self, now=None):
+        """Close every connection that's been idle longer than the idle timeout
+
+        :Returns: None
+
+        :param now: The current value of ``time.monotonic()``
+        :type now: Float
+        """
+        if now is None:
+            now = time.monotonic()
+        for key in list(self._idle):
+            conns = self._idle[key]
+            # connections are appended as they're released, so the expired ones come first
+            expired = 0
+            while expired < len(conns) and now - conns[expired][1] >= self.idle_timeout:
+                conns[expired][0].close()
+                expired += 1
+            if expired:
+                del conns[:expired]
+                self._count -= expired
+                self.stats['reaped'] += expired
+            if not conns:
+                del self._idle[key]
+
+    def _reap_lru(self, now):
+        """A cheap version of ``reap`` for the request path. Hosts are checked in
+        least recently used order, and this stops at the first host that's still
+        active; ``reap`` catches whatever this misses."""
+        while self._idle:
+            key, conns = next(iter(self._idle.items()))
+            if conns and now - conns[-1][1] < self.idle_timeout:
+                break
+            for conn, _ in conns:
+                conn.close()
+                self._count -= 1
+                self.stats['reaped'] += 1
+            del self._idle[key]
+
+    def start_reaper(self, interval=None):
+        """Reap idle connections periodically, so they're reclaimed even when no
+        requests arrive. Must be called from the process that uses the pool (i.e.
+        in a gunicorn worker).
+
+        :Returns: None
+
+        :param interval: Seconds between reaps. Default is half the idle timeout
+        :type interval: Integer or Float
+        """
+        if self._reaper is None:
+            self._reaper = gevent.spawn(self._reap_forever, interval or max(1, self.idle_timeout / 2))
+
+    def _reap_forever(self, interval):
+        while not self.closed:
+            gevent.sleep(interval)
+            self.reap()
+
+    def clear(self):
+        """Close every idle connection
+
+        :Returns: None
+        """
+        for conns in self._idle.values():
+            for conn, _ in conns:
+                conn.close()
+        self._idle.clear()
+        self._count = 0
+
+    def close(self):
+        """Close every idle connection, and stop keeping connections returned afterwards
+
+        :Returns: None
+        """
+        self.closed = True
+        self.clear()
+        if self._reaper is not None:
+            self._reaper.kill(block=False)
+            self._reaper = None
+
+    def get_stats(self):
+        """Obtain a snapshot of the pool counters
+
+        :Returns: Dictionary
+        """
+        stats = dict(self.stats)
+        stats['idle'] = self._count
+        stats['hosts'] = len(self._idle)
+        return stats
+
+
+def _is_stale(conn):
+    """Check if the back-end has closed an idle connection
+
+    An idle keep-alive socket should never be readable; if it is, the back-end
+    either closed it or sent data we didn't ask for.
+
+    :Returns: Boolean
+
+    :param conn: The idle connection
+    :type conn: vlab_api_gateway.upstream.HTTPConnection
+    """
+    if conn.sock is None:
+        return True
+    try:
+        readable, _, _ = select.select([conn.sock], [], [], 0)
+    except (OSError, ValueError):
+        return True
+    return bool(readable)
+
+
+POOL = ConnectionPool(max_connections=const.VLAB_POOL_MAX_CONNECTIONS,
+                      max_per_host=const.VLAB_POOL_MAX_PER_HOST,
+                      idle_timeout=const.VLAB_POOL_IDLE_TIMEOUT)
@@ -0,0 +1,215 @@
+# -*- coding: UTF-8 -*-
+"""
+A low overhead, greenlet aware, sampling profiler for a running worker.
+
+While a profile is running, a real OS thread wakes up every few milliseconds and
+records the stack of whatever greenlet is running in the worker. Greenlet
+switches are traced, so every sample is attributed to the greenlet and the
+``SERVICE_MAP`` resource it was handling. The same trace also reports greenlets
+that ran longer than a threshold without yielding; i.e. blocked the event loop.
+
+Samples are output in the collapsed-stack format used by flamegraph.pl and
+speedscope::
+
+    <greenlet>;<resource>;<frame>;<frame>... <count>
+"""
+import os
+import sys
+import time
+import signal
+import weakref
+
+import gevent
+from gevent import monkey
+from greenlet import getcurrent, settrace
+
+from vlab_api_gateway.std_logger import get_logger
+from vlab_api_gateway.constants import const
+
+logger = get_logger(__name__)
+
+# gevent might have patched these to be cooperative; the sampler needs the real deal
+_start_new_thread, _get_ident = monkey.get_original('_thread', ['start_new_thread', 'get_ident'])
+_sleep = monkey.get_original('time', 'sleep')
+
+MAX_DEPTH = 64
+MAX_BLOCKING_EVENTS = 1000
+TAGS = weakref.WeakKeyDictionary()
+
+
+def tag(resource):
+    """Attribute the work done by the current greenlet to a ``SERVICE_MAP`` resource
+
+    :Returns: None
+
+    :param resource: The API resource being handled (i.e. 'inventory')
+    :type resource: String
+    """
+    if PROFILER.running:
+        TAGS[getcurrent()] = resource
+
+
+class Profiler:
+    """Samples the stack of the running greenlet
+
+    :param interval: Milliseconds between samples.
+    :type interval: Integer
+
+    :param block_threshold: Milliseconds a greenlet can run without yielding
+                            before it's reported as blocking the event loop.
+    :type block_threshold: Integer
+    """
+    def __init__(self, interval, block_threshold):
+        self.interval = interval / 1000.0
+        self.block_threshold = block_threshold / 1000.0
+        self.running = False
+        self.samples = {}
+        self.blocking = []
+        self._labels = {}
+        self._hub = None
+        self._thread_id = None
+        self._current = None
+        self._switched_at = 0
+        self._sampler_done = True
+
+    def start(self):
+        """Begin sampling. Must be called from the thread running the gevent hub.
+
+        :Returns: None
+        """
+        self.samples = {}
+        self.blocking = []
+        self._hub = gevent.get_hub()
+        self._thread_id = _get_ident()
+        self._current = getcurrent()
+        self._switched_at = time.perf_counter()
+        self.running = True
+        self._sampler_done = False
+        settrace(self._trace)
+        _start_new_thread(self._sample_loop, ())
+
+    def stop(self):
+        """Stop sampling. Must be called from the thread running the gevent hub.
+
+        :Returns: None
+        """
+        settrace(None)
+        self.running = False
+        # wait (at most one interval) for the sampler to stop touching the samples
+        while not self._sampler_done:
+            _sleep(0.001)
+
+    def profile(self, seconds):
+        """Sample the worker for a while, yielding to other greenlets in the meantime
+
+        :Returns: String (collapsed stacks)
+
+        :param seconds: How long to sample for
+        :type seconds: Integer or Float
+        """
+        self.start()
+        try:
+            gevent.sleep(seconds)
+        finally:
+            self.stop()
+        return self.collapsed()
+
+    def _trace(self, event, args):
+        """Called by greenlet on every switch; runs in the context of the origin greenlet"""
+        if event not in ('switch', 'throw'):
+            return
+        origin, target = args
+        now = time.perf_counter()
+        ran = now - self._switched_at
+        if ran > self.block_threshold and origin is not self._hub and len(self.blocking) < MAX_BLOCKING_EVENTS:
+            self.blocking.append({'greenlet' : self._greenlet_label(origin),
+                                  'resource' : TAGS.get(origin, '-'),
+                                  'ms' : round(ran * 1000, 1),
+                                  'stack' : ';'.join(self._stack(sys._getframe(1)))})
+        self._current = target
+        self._switched_at = now
+
+    def _sample_loop(self):
+        """The body of the sampler thread"""
+        while self.running:
+            _sleep(self.interval)
+            frame = sys._current_frames().get(self._thread_id)
+            current = self._current
+            if frame is None or current is None:
+                continue
+            stack = [self._greenlet_label(current), TAGS.get(current, '-')]
+            stack.extend(self._stack(frame))
+            key = ';'.join(stack)
+            self.samples[key] = self.samples.get(key, 0) + 1
+        self._sampler_done = True
+
+    def _stack(self, frame):
+        """Convert a frame into a list of labels, ordered from the root to the leaf"""
+        stack = []
+        while frame is not None and len(stack) < MAX_DEPTH:
+            code = frame.f_code
+            label = self._labels.get(code)
+            if label is None:
+                label = '{}:{}'.format(os.path.basename(code.co_filename), code.co_name)
+                self._labels[code] = label
+            stack.append(label)
+            frame = frame.f_back
+        stack.reverse()
+        return stack
+
+    def _greenlet_label(self, the_greenlet):
+        if the_greenlet is self._hub:
+            return 'hub'
+        return getattr(the_greenlet, 'name', None) or type(the_greenlet).__name__
+
+    def collapsed(self):
+        """Format the samples in the collapsed-stack (flamegraph) format
+
+        :Returns: String
+        """
+        lines = ['{} {}'.format(stack, count) for stack, count in sorted(self.samples.items())]
+        return '\n'.join(lines) + '\n'
+
+    def report(self):
+        """Summarize the last profile
+
+        :Returns: Dictionary
+        """
+        return {'samples' : sum(self.samples.values()),
+                'stacks' : self.collapsed(),
+                'blocking' : sorted(self.blocking, key=lambda x: x['ms'], reverse=True)}
+
+
+def _profile_to_file(seconds):
+    """Run a profile, and save the collapsed stacks to ``const.VLAB_PROFILE_DIR``"""
+    if PROFILER.running:
+        logger.error('Profile already running; ignoring request')
+        return
+    stacks = PROFILER.profile(seconds)
+    path = os.path.join(const.VLAB_PROFILE_DIR, 'vlab-profile-{}-{}.folded'.format(os.getpid(), int(time.time())))
+    with open(path, 'w') as the_file:
+        the_file.write(stacks)
+    logger.info('Wrote {} samples to {}'.format(sum(PROFILER.samples.values()), path))
+    for event in PROFILER.report()['blocking'][:10]:
+        logger.info('Event loop blocked for {}ms by {} handling {}: {}'.format(event['ms'], event['greenlet'],
+                                                                            event['resource'], event['stack']))
+
+
+def handle_signal(sig, frame):
+    """Signal handler that profiles the worker for ``const.VLAB_PROFILE_SECONDS``"""
+    # Profiling yields to the hub, which isn't allowed from within a signal handler
+    gevent.spawn(_profile_to_file, const.VLAB_PROFILE_SECONDS)
+
+
+def install_signal_handler(signum=signal.SIGUSR2):
+    """Profile the worker whenever it receives a signal
+
+    :Returns: None
+
+    :param signum: The signal to handle. Default SIGUSR2
+    :type signum: Integer
+    """
+    signal.signal(signum, handle_signal)
+
+
+PROFILER = Profiler(interval=const.VLAB_PROFILE_INTERVAL, block_threshold=const.VLAB_PROFILE_BLOCK_MS)
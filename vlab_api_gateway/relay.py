@@ -3,21 +3,29 @@
 This module contains logic for calling the back-end service, and supplying
 a response to the calling WSGI application.
 """
-from socket import gaierror
-from http.client import HTTPConnection, HTTPSConnection
+from socket import gaierror, getaddrinfo, SOCK_STREAM
+from http.client import HTTPException
 
 from vlab_api_gateway.std_logger import get_logger
+from vlab_api_gateway import shm_cache
 from vlab_api_gateway.constants import const
+from vlab_api_gateway.pool import POOL
+from vlab_api_gateway.spool import SpooledResponse, should_buffer
+from vlab_api_gateway.upload import RequestBody, BodyTooLarge
+from vlab_api_gateway.upstream import HTTPConnection, HTTPSConnection, BLOCK_SIZE
 
 logger = get_logger(__name__)
 
+IDEMPOTENT_METHODS = frozenset(['DELETE', 'GET', 'HEAD', 'OPTIONS', 'PUT', 'TRACE'])
+
 
 class RelayQuery:
     """Call the back-end service and send the response downstream to the client
 
-    This object is a small wrapper around the stdlib http.client API. The major
+    This object is a small wrapper around the ``upstream`` client API. The major
     reason for wrapping that API is so we can ensure the TCP socket to the back-end
-    service gets closed after responding to the down-stream client.
+    service gets closed (or returned to the keep-alive pool) after responding to
+    the down-stream client.
 
     :param host: The IP/FQDN/DNS shortname of the back-end service to call.
     :type host: String
@@ -32,45 +40,118 @@ class RelayQuery:
     :type headers: Dictionary
 
     :param body: The HTTP body to send to the back-end service
-    :type body: Bytes
+    :type body: Bytes, or vlab_api_gateway.upload.RequestBody
 
     :param tls: Set to True to use HTTPS, False for HTTP. Default False.
     :type tls: Boolean
+
+    :param buffering: Set to True to drain the back-end response into a local
+                      buffer, and release the back-end socket before the client
+                      has consumed the body. Default is ``const.VLAB_RESPONSE_BUFFERING``
+    :type buffering: Boolean
+
+    :param keepalive: Set to True to reuse back-end connections via ``pool.POOL``.
+                      Default is ``const.VLAB_UPSTREAM_KEEPALIVE``
+    :type keepalive: Boolean
     """
-    def __init__(self, host, uri, method, headers, body, port, tls=False):
+    def __init__(self, host, uri, method, headers, body, port, tls=False, buffering=None, keepalive=None):
         self._conn = None
         self._resp = None
+        self._upstream = None
+        self._body = body
         self._headers = None
         self._status = None
+        self._pool_key = None
+        if buffering is None:
+            buffering = const.VLAB_RESPONSE_BUFFERING
+        if keepalive is None:
+            keepalive = const.VLAB_UPSTREAM_KEEPALIVE
+        if keepalive:
+            self._pool_key = (host, port, tls)
         if host is None:
             logger.error('No host found for {} on {}'.format(method, uri))
             self._handle_no_host(host, uri)
         else:
-            self._call_upstream(host, uri, method, headers, body, port, tls)
+            self._call_upstream(host, uri, method, headers, body, port, tls, buffering)
 
-    def _call_upstream(self, host, uri, method, headers, body, port, tls):
-        if tls:
-            self._conn = HTTPSConnection(host=host, port=port, context=const.VLAB_SSL_CONTEXT)
-        else:
-            self._conn = HTTPConnection(host=host, port=port)
+    def _call_upstream(self, host, uri, method, headers, body, port, tls, buffering):
         try:
-            self._conn.request(method=method, url=uri, body=body, headers=headers)
+            self._send(host, uri, method, headers, body, port, tls)
         except gaierror:
             logger.error('failed to resolve DNS host {} for URI {}'.format(host, uri))
             self._handle_no_host(host, uri)
         except ConnectionRefusedError:
             logger.error('Connection refused by host - URL {}:{}{}, TLS={}'.format(host, port, uri, tls))
             self._handle_no_host(host, uri, status='502 Bad Gateway')
+        except (ConnectionResetError, ConnectionAbortedError, BrokenPipeError) as doh:
+            logger.error('Connection to {} dropped for {} on {}: {}'.format(host, method, uri, doh))
+            self._handle_error('{"error": "connection to %s dropped"}' % host, status='502 Bad Gateway')
+        except BodyTooLarge as doh:
+            logger.error('Request body too large for {} on {}'.format(method, uri))
+            self._handle_error(doh.message, status='413 Payload Too Large')
+        except HTTPException as doh:
+            logger.error('Invalid response from {} for {}: {}'.format(host, uri, doh))
+            self._handle_error('{"error": "invalid response from %s"}' % host, status='502 Bad Gateway')
         else:
-            self._resp = self._conn.getresponse()
             self._headers = self._resp.getheaders()
             self._status =  '{} {}'.format(self._resp.status, self._resp.reason)
+            if buffering and should_buffer(self._resp):
+                self._buffer_response()
+
+    def _connect(self, host, port, tls, reuse=True):
+        if reuse and self._pool_key:
+            conn = POOL.get(self._pool_key)
+            if conn is not None:
+                return conn, True
+        if tls:
+            return HTTPSConnection(host=host, port=port, context=const.VLAB_SSL_CONTEXT), False
+        else:
+            # TLS needs the hostname to verify the cert, so only plain HTTP uses the DNS cache
+            return HTTPConnection(host=_resolve(host, port), port=port), False
+
+    def _send(self, host, uri, method, headers, body, port, tls):
+        self._conn, reused = self._connect(host, port, tls)
+        sent = False
+        try:
+            self._conn.request(method=method, url=uri, body=body, headers=headers)
+            sent = True
+            self._resp = self._conn.getresponse()
+        except (ConnectionResetError, BrokenPipeError):
+            if not _can_replay(method, body, reused, sent):
+                raise
+            logger.info('Connection to {} dropped; replaying request for {}'.format(host, uri))
+            self._conn.close()
+            self._conn, _ = self._connect(host, port, tls, reuse=False)
+            self._conn.request(method=method, url=uri, body=body, headers=headers)
+            self._resp = self._conn.getresponse()
+        self._upstream = self._resp
+
+    def _buffer_response(self):
+        self._resp = SpooledResponse(self._resp,
+                                     memory_limit=const.VLAB_RESPONSE_BUFFER_MEMORY,
+                                     disk_limit=const.VLAB_RESPONSE_BUFFER_DISK)
+        if self._resp.complete:
+            # The whole body is local; no reason to make the back-end wait on the client
+            self._release()
+
+    def _release(self):
+        """Return the back-end connection to the pool if it can be reused, otherwise close it"""
+        if self._pool_key and _fully_read(self._upstream) and not self._upstream.will_close:
+            POOL.put(self._pool_key, self._conn)
+        else:
+            self._conn.close()
+        self._conn = None
 
     def _handle_no_host(self, host, uri, status='404 Not Found'):
         self._headers = [('Content-Type', 'application/json')]
         self._status = status
         self._resp = NoHostResponse(host, uri)
 
+    def _handle_error(self, message, status):
+        self._headers = [('Content-Type', 'application/json')]
+        self._status = status
+        self._resp = ErrorResponse(message)
+
     @property
     def headers(self):
         return self._headers
@@ -89,43 +170,134 @@ class RelayQuery:
         """
         if self._conn:
             # NoHostResponse leaves this as None
-            self._conn.close()
+            if self._upstream is None:
+                self._conn.close()
+                self._conn = None
+            else:
+                self._release()
+        if isinstance(self._resp, SpooledResponse):
+            self._resp.close()
+        if isinstance(self._body, RequestBody):
+            self._body.close()
+
+    def would_block(self):
+        """Check if reading the next block of the body would wait on the back-end
+
+        :Returns: Boolean
+        """
+        if self._resp is not self._upstream:
+            # answered by the gateway, or buffered locally
+            return False
+        return self._upstream.would_block()
 
     def __iter__(self):
         return self
 
     def __next__(self):
-        data = self._resp.readline()
+        data = self._resp.read1(BLOCK_SIZE)
         if data:
             return data
         else:
             raise StopIteration
 
 
-class NoHostResponse:
-    """Mimics the http.client.HTTPResponse objects API so the ``RelayQuery`` object
-    can simply call methods.
+def _resolve(host, port):
+    """Look up the IP of a back-end service via the shared cache, so every worker
+    on the host doesn't have to make the same DNS query.
 
+    :Returns: String
 
-    :param host: The back-end service to query. Used to give error message context
+    :Raises: socket.gaierror
+
+    :param host: The FQDN/DNS shortname of the back-end service
     :type host: String
 
-    :param uri: The API endpoint used in query. Used to give error message context.
-    :type uri: String
+    :param port: The port of the back-end service
+    :type port: Integer
     """
+    if shm_cache.CACHE is None:
+        return host
+    cache_key = b'dns:%s:%d' % (host.encode(), port)
+    address = shm_cache.CACHE.get(cache_key)
+    if address is None:
+        address = getaddrinfo(host, port, type=SOCK_STREAM)[0][4][0].encode()
+        shm_cache.CACHE.set(cache_key, address, const.VLAB_DNS_CACHE_TTL)
+    return address.decode()
 
-    def __init__(self, host, uri):
-        message = '{"error": "unable to find host %s for %s"}' % (host, uri)
+
+def _can_replay(method, body, reused, sent):
+    """Check if a request can be sent again after the back-end connection dropped
+
+    :Returns: Boolean
+
+    :param method: The HTTP method of the request
+    :type method: String
+
+    :param body: The HTTP body of the request
+    :type body: Bytes, or vlab_api_gateway.upload.RequestBody
+
+    :param reused: True if the connection came from the keep-alive pool
+    :type reused: Boolean
+
+    :param sent: True if the whole request was sent before the connection dropped
+    :type sent: Boolean
+    """
+    # Either the body was spooled locally, or the back-end closed an idle keep-alive
+    # connection before any of a streamed body was read from the client
+    unread = body is None or not getattr(body, 'started', True)
+    if not (getattr(body, 'replayable', False) or (reused and unread)):
+        return False
+    # once the whole request was sent, the back-end might have acted on it
+    return not sent or method in IDEMPOTENT_METHODS
+
+
+def _fully_read(resp):
+    """Check if the whole response body has been read from the socket. Only then
+    can the connection be used for another request.
+
+    :Returns: Boolean
+
+    :param resp: The response from the back-end service.
+    :type resp: vlab_api_gateway.upstream.HTTPResponse
+    """
+    return resp.isclosed() or resp.length == 0
+
+
+class ErrorResponse:
+    """Mimics the upstream.HTTPResponse objects API so the ``RelayQuery`` object
+    can simply call methods when the API gateway answers the client itself.
+
+    :param message: The JSON error message to send to the client
+    :type message: String
+    """
+
+    def __init__(self, message):
         self.message = message.encode()
         self.sent_msg = False
 
-    def readline(self):
+    def read1(self, amt=None):
         """Returns the HTTP body content
 
-        :Returns: String or None
+        :Returns: Bytes
         """
         if self.sent_msg is False:
             self.sent_msg = True
             return self.message
         else:
-            return None
+            return b''
+
+
+class NoHostResponse(ErrorResponse):
+    """The response sent when the back-end service cannot be reached.
+
+
+    :param host: The back-end service to query. Used to give error message context
+    :type host: String
+
+    :param uri: The API endpoint used in query. Used to give error message context.
+    :type uri: String
+    """
+
+    def __init__(self, host, uri):
+        message = '{"error": "unable to find host %s for %s"}' % (host, uri)
+        super().__init__(message)
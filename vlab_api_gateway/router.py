@@ -1,9 +1,11 @@
 # -*- coding: UTF-8 -*-
 """Contains business logic for proxying requests to correct back-end host"""
 import base64
+from hashlib import blake2b
 
 import ujson
 
+from vlab_api_gateway import shm_cache
 from vlab_api_gateway.std_logger import get_logger
 from vlab_api_gateway.constants import const
 
@@ -47,6 +49,23 @@ SERVICE_SUBGROUP = 4
 NO_RECORD = (None, False, 0)
 
 
+def get_resource(uri):
+    """Obtain the name of the ``SERVICE_MAP`` resource an API end point belongs to
+
+    :Returns: String
+
+    :param uri: The API end point being called
+    :type uri: String
+    """
+    if not uri.startswith('/api'):
+        return 'docs'
+    uri_layers = uri.split('/')
+    if uri_layers[SERVICE] == 'inf':
+        return uri_layers[SERVICE_SUBGROUP]
+    # services like "auth" and "link" are their own group; only 'inf' has subgroups
+    return uri_layers[SERVICE]
+
+
 def get_host(uri, token):
     """Obtain the correct backend service to route the incoming request to
 
@@ -58,17 +77,9 @@ def get_host(uri, token):
     :param token: The auth token sent with the request
     :type token:
     """
-    if not uri.startswith('/api'):
-        host, tls, port = SERVICE_MAP.get('docs')
-    else:
-        uri_layers = uri.split('/')
-        if uri_layers[SERVICE] == 'inf':
-            host, tls, port = SERVICE_MAP.get(uri_layers[SERVICE_SUBGROUP], NO_RECORD)
-        else:
-            # services like "auth" and "link" are their own group; only 'inf' has subgroups
-            host, tls, port = SERVICE_MAP.get(uri_layers[SERVICE], NO_RECORD)
-            if host == 'UNKNOWN':
-                host = _user_ipam_server(token)
+    host, tls, port = SERVICE_MAP.get(get_resource(uri), NO_RECORD)
+    if host == 'UNKNOWN':
+        host = _user_ipam_server(token)
     return host, tls, port
 
 
@@ -81,6 +92,12 @@ def _user_ipam_server(token):
     :type token: Bytes
     """
     logger.info('Looking up IPAM server')
+    cache_key = None
+    if shm_cache.CACHE is not None and isinstance(token, bytes):
+        cache_key = b'ipam:' + blake2b(token, digest_size=16).digest()
+        user = shm_cache.CACHE.get(cache_key)
+        if user is not None:
+            return user.decode()
     try:
         header, payload, signature = token.split(b'.')
     except (ValueError, AttributeError, TypeError) as doh:
@@ -99,4 +116,6 @@ def _user_ipam_server(token):
             # bad json
             logger.error('invalid JSON for token payload')
             user = None
+    if cache_key and user:
+        shm_cache.CACHE.set(cache_key, user.encode(), const.VLAB_TOKEN_CACHE_TTL)
     return user
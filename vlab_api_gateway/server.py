@@ -4,35 +4,86 @@ upstream back-end service"""
 from gevent.pywsgi import WSGIServer
 from http.client import HTTPConnection
 
-from vlab_api_gateway import router
+from vlab_api_gateway import admin, auth, capture, compress, drain, profiler, router, tunnel, upload
 from vlab_api_gateway.relay import RelayQuery
+from vlab_api_gateway.constants import const
 
 
 def application(env, start_response):
     """The callable function per the WSGI spec; PEP 333"""
+    return drain.TRACKER.track(_capture, env, start_response)
+
+
+def _capture(env, start_response):
+    """Record the shape of the request, if capturing traffic is enabled; same API as ``application``"""
+    if capture.RECORDER is not None:
+        return capture.RECORDER.wrap(_relay, env, start_response)
+    return _relay(env, start_response)
+
+
+def _relay(env, start_response):
+    """Send the request to the correct back-end service; same API as ``application``"""
     headers = {x[5:].replace('_', '-'):y for x, y in env.items() if x.startswith('HTTP_')}
     if env.get('CONTENT_TYPE', None):
         headers['Content-Type'] = env['CONTENT_TYPE']
     if env.get('CONTENT_LENGTH', None):
         headers['Content-Length'] = env['CONTENT_LENGTH']
+    upgrade = tunnel.is_upgrade(env)
     headers.pop('CONNECTION', None) # let RelayQuery choose to use keepalives or not
-    body = env['wsgi.input']
+    headers.pop('TRANSFER-ENCODING', None) # the WSGI server has already de-chunked the body
     uri = env.get('PATH_INFO', '')
     if not uri:
         # Some WSGI servers use RAW_URI instead of PATH_INFO.
         # Gunicorn uses PATH_INFO, gevent.pywsgi.WSGIServer uses RAW_URI
         uri = env.get('RAW_URI', '')
+    if uri == drain.READY_URI:
+        return drain.ready(start_response)
+    if admin.is_admin_request(uri):
+        return admin.application(env, start_response, uri)
+    resource = router.get_resource(uri)
+    profiler.tag(resource)
     token = env.get('HTTP_X_AUTH', '').encode()
+    if token and auth.VERIFIER and resource != 'auth':
+        # the auth service handles its own tokens; i.e. refreshing an expired one
+        if not auth.VERIFIER.verify(token):
+            start_response('401 Unauthorized', [('Content-Type', 'application/json')])
+            return [b'{"error": "invalid auth token"}']
+    try:
+        body = upload.get_request_body(env)
+    except upload.BodyTooLarge as doh:
+        start_response('413 Payload Too Large', [('Content-Type', 'application/json')])
+        return [doh.message.encode()]
+    except upload.InvalidBody as doh:
+        start_response('400 Bad Request', [('Content-Type', 'application/json')])
+        return [doh.message.encode()]
+    if body is not None and body.length is not None and 'Content-Length' not in headers:
+        # spooled bodies know their size, even if the client didn't send it
+        headers['Content-Length'] = str(body.length)
     host, tls, port = router.get_host(uri=uri, token=token)
     if env.get('QUERY_STRING', None):
         uri += '?{}'.format(env['QUERY_STRING'])
-    resp = RelayQuery(host=host,
-                      method=env['REQUEST_METHOD'],
-                      uri=uri,
-                      headers=headers,
-                      body=body,
-                      port=port,
-                      tls=tls)
+    if upgrade:
+        headers['Connection'] = 'Upgrade'
+        resp = tunnel.TunnelQuery(client=env.get('gunicorn.socket'),
+                                  host=host,
+                                  method=env['REQUEST_METHOD'],
+                                  uri=uri,
+                                  headers=headers,
+                                  body=body,
+                                  port=port,
+                                  tls=tls)
+    else:
+        resp = RelayQuery(host=host,
+                          method=env['REQUEST_METHOD'],
+                          uri=uri,
+                          headers=headers,
+                          body=body,
+                          port=port,
+                          tls=tls)
+    encoding = compress.negotiate(env, resource, resp.status, resp.headers)
+    if encoding:
+        start_response(resp.status, compress.compressed_headers(resp.headers, encoding))
+        return compress.CompressedResponse(resp, encoding, const.VLAB_COMPRESSION_LEVEL)
     start_response(resp.status, resp.headers)
     return resp
 
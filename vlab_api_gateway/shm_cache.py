@@ -0,0 +1,255 @@
+# -*- coding: UTF-8 -*-
+"""
+A fixed size hash table in shared memory, so every gunicorn worker on a host
+can reuse the lookups made by the others.
+
+The table is an mmap of a file (ideally on a tmpfs like /dev/shm), divided into
+fixed size slots. Reads are lock free; every slot has a sequence number that a
+writer makes odd while it's changing the slot, and even once it's done. A reader
+that sees an odd number, or a number that changed while it was copying the slot,
+simply tries again. Writers are serialized with ``flock``, which the kernel
+releases if a worker dies; a slot left half-written by a dead worker still has an
+odd sequence number, so readers ignore it until the next writer repairs it.
+"""
+import os
+import time
+import mmap
+import fcntl
+import zlib
+import struct
+
+from vlab_api_gateway.std_logger import get_logger
+from vlab_api_gateway.constants import const
+
+logger = get_logger(__name__)
+
+MAGIC = b'VLABSHM1'
+HEADER = struct.Struct('<8sII')        # magic, slots, slot_size
+HEADER_SIZE = 64
+SLOT_HEADER = struct.Struct('<IQdHH')  # seq, key_hash, expires, key_len, value_len
+SEQ = struct.Struct('<I')
+SLOT_SIZE = 256
+MAX_PROBES = 8
+READ_RETRIES = 16
+
+
+def hash_key(key):
+    """Hash a key the same way in every process; Python's ``hash()`` is salted per process.
+
+    The full key is compared on lookup, so this only needs to spread keys out;
+    two cheap checksums are plenty (and much faster than a cryptographic hash).
+
+    :Returns: Integer
+
+    :param key: The key to hash
+    :type key: Bytes
+    """
+    return (zlib.crc32(key) << 32) | zlib.adler32(key)
+
+
+class SharedCache:
+    """A small key/value store with TTLs, shared by every process that opens the same file
+
+    :param path: The file that backs the shared memory.
+    :type path: String
+
+    :param slots: The number of entries the table can hold.
+    :type slots: Integer
+
+    :param slot_size: The bytes per entry; the key and value must fit within it.
+    :type slot_size: Integer
+    """
+    def __init__(self, path, slots, slot_size=SLOT_SIZE):
+        self.path = path
+        self.slots = slots
+        self.slot_size = slot_size
+        self.max_item_size = slot_size - SLOT_HEADER.size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        size = HEADER_SIZE + (slots * slot_size)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            self._init_file(size)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._mm = mmap.mmap(self._fd, size)
+        self.stats = {
+            'hits' : 0,
+            'misses' : 0,
+            'sets' : 0,
+            'evictions' : 0,
+            'too_large' : 0,
+            'read_retries' : 0,
+        }
+
+    def _init_file(self, size):
+        """Create (or wipe) the table if it doesn't exist, or has a different layout"""
+        expected = HEADER.pack(MAGIC, self.slots, self.slot_size)
+        current_size = os.fstat(self._fd).st_size
+        # the file is never shrunk (see below), so after a change to a smaller
+        # layout it's larger than the table; the header says what it holds
+        if current_size >= size and os.pread(self._fd, HEADER.size, 0) == expected:
+            return
+        logger.info('Initializing shared cache {} with {} slots'.format(self.path, self.slots))
+        # Never shrink the file; an old worker might still have it mapped, and
+        # touching a page past the end of the file would kill it with SIGBUS
+        os.ftruncate(self._fd, max(current_size, size))
+        zeros = bytes(mmap.PAGESIZE * 16)
+        for offset in range(0, size, len(zeros)):
+            os.pwrite(self._fd, zeros[:size - offset], offset)
+        os.pwrite(self._fd, expected, 0)
+
+    def _offset(self, key_hash, probe):
+        return HEADER_SIZE + (((key_hash + probe) % self.slots) * self.slot_size)
+
+    def _read_slot(self, offset, key_hash):
+        """Copy the entry in a slot without tearing
+
+        :Returns: Tuple (expires, key, value) or None if the slot couldn't be read.
+                  The key and value are None if the slot holds a different key.
+        """
+        mm = self._mm
+        for _ in range(READ_RETRIES):
+            seq, slot_hash, expires, key_len, value_len = SLOT_HEADER.unpack_from(mm, offset)
+            if not seq & 1:
+                if slot_hash == key_hash:
+                    start = offset + SLOT_HEADER.size
+                    key = mm[start:start + key_len]
+                    value = mm[start + key_len:start + key_len + value_len]
+                else:
+                    key = value = None
+                if SEQ.unpack_from(mm, offset)[0] == seq:
+                    return expires, key, value
+            self.stats['read_retries'] += 1
+        # a writer is busy, or died mid-write; either way, treat it as a miss
+        return None
+
+    def get(self, key):
+        """Look up a key
+
+        :Returns: Bytes or None
+
+        :param key: The key to look up
+        :type key: Bytes
+        """
+        key_hash = hash_key(key)
+        for probe in range(MAX_PROBES):
+            slot = self._read_slot(self._offset(key_hash, probe), key_hash)
+            if slot is None:
+                continue
+            expires, slot_key, value = slot
+            if not expires:
+                # Slots are never emptied, only expired, so a slot that's never
+                # been used means the key can't be further along
+                break
+            if slot_key == key:
+                if expires > time.time():
+                    self.stats['hits'] += 1
+                    return value
+                break
+        self.stats['misses'] += 1
+        return None
+
+    def set(self, key, value, ttl):
+        """Store a value
+
+        :Returns: Boolean (False if the key and value don't fit in a slot)
+
+        :param key: The key to store the value under
+        :type key: Bytes
+
+        :param value: The value to store
+        :type value: Bytes
+
+        :param ttl: The number of seconds the value is valid
+        :type ttl: Integer or Float
+        """
+        if len(key) + len(value) > self.max_item_size:
+            self.stats['too_large'] += 1
+            return False
+        key_hash = hash_key(key)
+        now = time.time()
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            offset = self._pick_slot(key, key_hash, now)
+            self._write_slot(offset, key, value, key_hash, now + ttl)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self.stats['sets'] += 1
+        return True
+
+    def _pick_slot(self, key, key_hash, now):
+        """Find the slot to write to; the key's existing slot, an empty or expired slot,
+        or the slot that expires the soonest. Must be called while holding the lock."""
+        free, victim, victim_expires = None, None, None
+        # check every probe for the key first; writing it to an earlier free slot
+        # would leave a stale copy further along
+        for probe in range(MAX_PROBES):
+            offset = self._offset(key_hash, probe)
+            _, slot_hash, expires, key_len, _ = SLOT_HEADER.unpack_from(self._mm, offset)
+            start = offset + SLOT_HEADER.size
+            if slot_hash == key_hash and expires and self._mm[start:start + key_len] == key:
+                return offset
+            if expires <= now:
+                if free is None:
+                    free = offset
+            elif victim is None or expires < victim_expires:
+                victim, victim_expires = offset, expires
+        if free is not None:
+            return free
+        self.stats['evictions'] += 1
+        return victim
+
+    def _write_slot(self, offset, key, value, key_hash, expires):
+        """Update a slot, following the seqlock protocol. Must be called while holding the lock."""
+        seq = SEQ.unpack_from(self._mm, offset)[0]
+        # an odd number here means a writer died mid-write; reuse it
+        seq = (seq | 1) & 0xFFFFFFFF
+        SEQ.pack_into(self._mm, offset, seq)
+        start = offset + SLOT_HEADER.size
+        self._mm[start:start + len(key) + len(value)] = key + value
+        SLOT_HEADER.pack_into(self._mm, offset, seq, key_hash, expires, len(key), len(value))
+        SEQ.pack_into(self._mm, offset, (seq + 1) & 0xFFFFFFFF)
+
+    def occupancy(self):
+        """Count the number of unexpired entries in the table
+
+        :Returns: Integer
+        """
+        now = time.time()
+        used = 0
+        for slot in range(self.slots):
+            offset = HEADER_SIZE + (slot * self.slot_size)
+            if SLOT_HEADER.unpack_from(self._mm, offset)[2] > now:
+                used += 1
+        return used
+
+    def get_stats(self):
+        """Obtain a snapshot of this process's cache counters
+
+        :Returns: Dictionary
+        """
+        stats = dict(self.stats)
+        stats['slots'] = self.slots
+        return stats
+
+    def close(self):
+        """Unmap the table; the data stays around for the other processes"""
+        self._mm.close()
+        os.close(self._fd)
+
+
+def _get_cache():
+    """Open the shared cache if one is configured
+
+    :Returns: SharedCache or None
+    """
+    if not const.VLAB_SHM_CACHE_PATH:
+        return None
+    try:
+        return SharedCache(const.VLAB_SHM_CACHE_PATH, const.VLAB_SHM_CACHE_SLOTS)
+    except OSError as doh:
+        logger.error('Unable to open shared cache {}: {}'.format(const.VLAB_SHM_CACHE_PATH, doh))
+        return None
+
+
+CACHE = _get_cache()
@@ -0,0 +1,112 @@
+# -*- coding: UTF-8 -*-
+"""
+This module decouples slow down-stream clients from the back-end services.
+
+Instead of holding the upstream socket open while a client on a slow link
+consumes the body, the upstream response is drained into a bounded buffer.
+Small bodies stay in memory, larger ones spill to an anonymous temp file, and
+anything past the disk cap is streamed directly from the back-end like normal.
+Streams (i.e. server-sent events), and responses that don't say how large they
+are, are never buffered; the client would get nothing until the stream ended.
+"""
+from tempfile import SpooledTemporaryFile
+
+from vlab_api_gateway.std_logger import get_logger
+
+logger = get_logger(__name__)
+
+CHUNK_SIZE = 65536
+STREAMING_TYPES = ('text/event-stream', 'application/x-ndjson', 'multipart/x-mixed-replace')
+STATS = {
+    'responses_buffered' : 0,
+    'bytes_buffered' : 0,
+    'responses_spilled' : 0,
+    'bytes_spilled' : 0,
+    'responses_overflowed' : 0,
+    'responses_streamed' : 0,
+}
+
+
+def get_stats():
+    """Obtain a snapshot of the response buffering counters
+
+    :Returns: Dictionary
+    """
+    return dict(STATS)
+
+
+def should_buffer(resp):
+    """Check if a response can be buffered without holding back a stream
+
+    :Returns: Boolean
+
+    :param resp: The response from the back-end service.
+    :type resp: vlab_api_gateway.upstream.HTTPResponse
+    """
+    content_type = (resp.getheader('Content-Type') or '').split(';')[0].strip().lower()
+    if resp.length is None or content_type in STREAMING_TYPES:
+        STATS['responses_streamed'] += 1
+        return False
+    return True
+
+
+class SpooledResponse:
+    """Mimics the upstream.HTTPResponse objects API, but serves the body from
+    a local buffer instead of the back-end service.
+
+    :param resp: The response from the back-end service.
+    :type resp: vlab_api_gateway.upstream.HTTPResponse
+
+    :param memory_limit: The number of bytes to hold in RAM before spilling to disk.
+    :type memory_limit: Integer
+
+    :param disk_limit: The total number of bytes to buffer. The remainder of a body
+                       larger than this is read from the back-end as the client
+                       consumes it.
+    :type disk_limit: Integer
+    """
+    def __init__(self, resp, memory_limit, disk_limit):
+        self._upstream = resp
+        self._buffer = SpooledTemporaryFile(max_size=memory_limit)
+        self.size = 0
+        self.complete = False
+        self._drain(disk_limit)
+        self._buffer.seek(0)
+        self._record(memory_limit)
+
+    def _drain(self, disk_limit):
+        while self.size < disk_limit:
+            data = self._upstream.read(min(CHUNK_SIZE, disk_limit - self.size))
+            if not data:
+                self.complete = True
+                break
+            self._buffer.write(data)
+            self.size += len(data)
+        else:
+            # the body is exactly as large as the cap; peek to find out if we're done
+            self.complete = self._upstream.isclosed()
+
+    def _record(self, memory_limit):
+        STATS['responses_buffered'] += 1
+        STATS['bytes_buffered'] += self.size
+        if self.size > memory_limit:
+            STATS['responses_spilled'] += 1
+            STATS['bytes_spilled'] += self.size
+            logger.info('Spilled {} byte response to disk'.format(self.size))
+        if not self.complete:
+            STATS['responses_overflowed'] += 1
+            logger.info('Response exceeded buffer cap of {} bytes; streaming remainder'.format(self.size))
+
+    def read1(self, amt=CHUNK_SIZE):
+        """Returns the next block of the HTTP body
+
+        :Returns: Bytes
+        """
+        data = self._buffer.read(amt)
+        if not data and not self.complete:
+            data = self._upstream.read1(amt)
+        return data
+
+    def close(self):
+        """Discard the buffered body"""
+        self._buffer.close()
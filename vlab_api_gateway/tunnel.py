@@ -0,0 +1,206 @@
+# -*- coding: UTF-8 -*-
+"""
+This module passes through requests that upgrade the connection to another
+protocol (i.e. WebSockets for consoles and event streams).
+
+The handshake is relayed like any other request. If the back-end service agrees
+to switch protocols (HTTP 101), the socket to the client and the socket to the
+back-end are spliced together; one greenlet copies bytes from the client to the
+back-end while another copies them back, each through a buffer that's reused by
+later tunnels. A tunnel is closed once both sides have closed their end, or
+nothing was sent either way for ``const.VLAB_TUNNEL_IDLE_TIMEOUT`` seconds.
+
+Splicing needs the raw client socket, which gunicorn's gevent worker supplies
+as ``gunicorn.socket`` in the WSGI environment.
+"""
+import time
+import socket
+
+import gevent
+
+from vlab_api_gateway.std_logger import get_logger
+from vlab_api_gateway.constants import const
+from vlab_api_gateway.relay import RelayQuery
+
+logger = get_logger(__name__)
+
+# how often a blocked pump wakes up to check if the tunnel has gone idle
+IDLE_CHECK = 5
+MAX_SPARE_BUFFERS = 64
+ACTIVE = {}
+SPARE_BUFFERS = []
+STATS = {
+    'opened' : 0,
+    'rejected' : 0,
+    'idle_closed' : 0,
+    'bytes_up' : 0,
+    'bytes_down' : 0,
+}
+
+
+def get_stats():
+    """Obtain a snapshot of the tunnel counters
+
+    :Returns: Dictionary
+    """
+    stats = dict(STATS)
+    stats['active'] = sum(ACTIVE.values())
+    return stats
+
+
+def is_upgrade(env):
+    """Check if the client asked to switch protocols
+
+    :Returns: Boolean
+
+    :param env: The WSGI environment of the request
+    :type env: Dictionary
+    """
+    if not env.get('HTTP_UPGRADE'):
+        return False
+    return 'upgrade' in [x.strip().lower() for x in env.get('HTTP_CONNECTION', '').split(',')]
+
+
+def _get_buffer():
+    if SPARE_BUFFERS:
+        return SPARE_BUFFERS.pop()
+    return bytearray(const.VLAB_TUNNEL_BUFFER_SIZE)
+
+
+def _put_buffer(buf):
+    if len(SPARE_BUFFERS) < MAX_SPARE_BUFFERS:
+        SPARE_BUFFERS.append(buf)
+
+
+class TunnelQuery(RelayQuery):
+    """Relay an Upgrade request, and splice the connections if the back-end accepts it
+
+    :param client: The socket to the down-stream client
+    :type client: socket.socket
+
+    :param host: The IP/FQDN/DNS shortname of the back-end service to call.
+    :type host: String
+
+    :param uri: The API end point to envoke on the back-end service.
+    :type uri: String
+
+    :param method: The HTTP method to envoke (i.e. GET)
+    :type method: String
+
+    :param headers: The HTTP headers to send to the back-end service.
+    :type headers: Dictionary
+
+    :param body: The HTTP body to send to the back-end service
+    :type body: Bytes, or vlab_api_gateway.upload.RequestBody
+
+    :param tls: Set to True to use HTTPS, False for HTTP. Default False.
+    :type tls: Boolean
+    """
+    def __init__(self, client, host, uri, method, headers, body, port, tls=False):
+        self._client = client
+        self._tunnel_key = None
+        self._tunneled = False
+        self._last_active = 0
+        if client is None:
+            logger.error('Unable to upgrade {}; the WSGI server does not supply the client socket'.format(uri))
+            self._init_error('{"error": "connection upgrades are not supported"}', '501 Not Implemented')
+            return
+        key = (host, port)
+        if ACTIVE.get(key, 0) >= const.VLAB_TUNNEL_MAX_PER_HOST:
+            logger.error('Too many tunnels to {}:{}; rejecting {}'.format(host, port, uri))
+            STATS['rejected'] += 1
+            self._init_error('{"error": "too many open connections to %s"}' % host, '503 Service Unavailable')
+            return
+        # reserve a slot now; connecting yields, and other greenlets could take it
+        ACTIVE[key] = ACTIVE.get(key, 0) + 1
+        self._tunnel_key = key
+        super().__init__(host=host, uri=uri, method=method, headers=headers, body=body,
+                         port=port, tls=tls, buffering=False, keepalive=False)
+        if self._upstream is not None and self._upstream.status == 101:
+            self._tunneled = True
+            STATS['opened'] += 1
+        else:
+            self._unreserve()
+
+    def _init_error(self, message, status):
+        self._conn = None
+        self._upstream = None
+        self._body = None
+        self._pool_key = None
+        self._handle_error(message, status)
+
+    def _unreserve(self):
+        if self._tunnel_key is None:
+            return
+        ACTIVE[self._tunnel_key] -= 1
+        if not ACTIVE[self._tunnel_key]:
+            del ACTIVE[self._tunnel_key]
+        self._tunnel_key = None
+
+    def __iter__(self):
+        if self._tunneled:
+            return self._splice()
+        return super().__iter__()
+
+    def _splice(self):
+        # Sending an empty chunk makes the WSGI server write the 101 response head
+        yield b''
+        upstream = self._conn.sock
+        # whatever the back-end sent right after the 101 is already in the connection's buffer
+        leftover = self._conn.pop_buffered()
+        try:
+            if leftover:
+                self._client.sendall(leftover)
+                STATS['bytes_down'] += len(leftover)
+            self._last_active = time.monotonic()
+            down = gevent.spawn(self._pump, upstream, self._client, 'bytes_down')
+            self._pump(self._client, upstream, 'bytes_up')
+            down.join()
+        except OSError as doh:
+            logger.info('Tunnel closed with error: {}'.format(doh))
+        finally:
+            # the client connection can't go back to handling HTTP requests
+            _shutdown(self._client)
+            self._tunneled = False
+
+    def _pump(self, source, destination, stat):
+        """Copy bytes from one socket to the other until the source is closed, or the tunnel is idle"""
+        buf = _get_buffer()
+        view = memoryview(buf)
+        source.settimeout(min(IDLE_CHECK, const.VLAB_TUNNEL_IDLE_TIMEOUT))
+        try:
+            while True:
+                try:
+                    size = source.recv_into(buf)
+                except socket.timeout:
+                    if time.monotonic() - self._last_active > const.VLAB_TUNNEL_IDLE_TIMEOUT:
+                        STATS['idle_closed'] += 1
+                        break
+                    continue
+                if not size:
+                    # pass the half-close along, so the other side sees the EOF
+                    _shutdown(destination, socket.SHUT_WR)
+                    return
+                destination.sendall(view[:size])
+                self._last_active = time.monotonic()
+                STATS[stat] += size
+        except OSError as doh:
+            logger.info('Tunnel closed with error: {}'.format(doh))
+        finally:
+            view.release()
+            _put_buffer(buf)
+        # idle, or broken; either way, unblock the other pump
+        _shutdown(source)
+        _shutdown(destination)
+
+    def close(self):
+        super().close()
+        self._unreserve()
+
+
+def _shutdown(sock, how=socket.SHUT_RDWR):
+    try:
+        sock.shutdown(how)
+    except OSError:
+        # already closed by the other side
+        pass
@@ -0,0 +1,139 @@
+# -*- coding: UTF-8 -*-
+"""
+This module streams the client's request body to the back-end service.
+
+Bodies are read from the WSGI input in fixed size blocks, and a block is only
+read after the previous one has been sent upstream; a slow back-end therefore
+slows down the client instead of the API gateway buffering the whole upload.
+Clients that use chunked Transfer-Encoding (and omit Content-Length) are relayed
+with chunked encoding to the back-end.
+"""
+from tempfile import SpooledTemporaryFile
+
+from vlab_api_gateway.constants import const
+
+
+class BodyTooLarge(Exception):
+    """Raised when a request body exceeds ``const.VLAB_REQUEST_MAX_BODY``"""
+    def __init__(self, max_size):
+        super().__init__('Request body exceeds max size of {} bytes'.format(max_size))
+        self.message = '{"error": "request body exceeds max size of %s bytes"}' % max_size
+
+
+class InvalidBody(Exception):
+    """Raised when the client sent a Content-Length that isn't a size"""
+    def __init__(self, length):
+        super().__init__('Invalid Content-Length: {!r}'.format(length))
+        self.message = '{"error": "invalid Content-Length"}'
+
+
+def get_request_body(env):
+    """Construct the request body to send to the back-end service
+
+    :Returns: None, RequestBody, or SpooledRequestBody
+
+    :Raises: BodyTooLarge, InvalidBody
+
+    :param env: The WSGI environment of the request
+    :type env: Dictionary
+    """
+    length = env.get('CONTENT_LENGTH', None)
+    chunked = 'chunked' in env.get('HTTP_TRANSFER_ENCODING', '').lower()
+    if length:
+        try:
+            length = int(length)
+        except ValueError:
+            raise InvalidBody(length)
+        if length < 0:
+            raise InvalidBody(length)
+    elif chunked:
+        length = None
+    else:
+        # no body supplied
+        return None
+    if const.VLAB_REQUEST_SPOOLING:
+        return SpooledRequestBody(env['wsgi.input'], length)
+    return RequestBody(env['wsgi.input'], length)
+
+
+class RequestBody:
+    """An iterable that reads the request body in fixed size blocks
+
+    :param stream: The file-like object to read the body from (i.e. wsgi.input)
+    :type stream: File-like
+
+    :param length: The size of the body, or None if the client used chunked encoding.
+    :type length: Integer
+
+    :param max_size: The largest body allowed. Default is ``const.VLAB_REQUEST_MAX_BODY``
+    :type max_size: Integer
+
+    :param block_size: The number of bytes to read at a time. Default is ``const.VLAB_REQUEST_BLOCK_SIZE``
+    :type block_size: Integer
+    """
+    replayable = False
+
+    def __init__(self, stream, length, max_size=None, block_size=None):
+        self._stream = stream
+        self.length = length
+        # once any of the body is read from the client, it can't be sent again
+        self.started = False
+        self.max_size = max_size or const.VLAB_REQUEST_MAX_BODY
+        self.block_size = block_size or const.VLAB_REQUEST_BLOCK_SIZE
+        if length is not None and length > self.max_size:
+            raise BodyTooLarge(self.max_size)
+
+    def _read_blocks(self):
+        self.started = True
+        consumed = 0
+        while True:
+            if self.length is None:
+                want = self.block_size
+            else:
+                want = min(self.block_size, self.length - consumed)
+                if want <= 0:
+                    break
+            data = self._stream.read(want)
+            if not data:
+                break
+            consumed += len(data)
+            if consumed > self.max_size:
+                raise BodyTooLarge(self.max_size)
+            yield data
+
+    def __iter__(self):
+        return self._read_blocks()
+
+    def close(self):
+        """Nothing to clean up; here so all bodies have the same API"""
+        pass
+
+
+class SpooledRequestBody(RequestBody):
+    """Reads the whole request body into a local buffer before it's sent upstream.
+    Small bodies are held in memory, and large ones spill to disk.
+
+    Because the body is local, the back-end always receives a Content-Length,
+    and the body can be sent again if the back-end connection fails.
+
+    :param memory_limit: Bytes to hold in RAM before spilling to disk. Default is ``const.VLAB_REQUEST_SPOOL_MEMORY``
+    :type memory_limit: Integer
+    """
+    replayable = True
+
+    def __init__(self, stream, length, max_size=None, block_size=None, memory_limit=None):
+        super().__init__(stream, length, max_size, block_size)
+        self._buffer = SpooledTemporaryFile(max_size=memory_limit or const.VLAB_REQUEST_SPOOL_MEMORY)
+        size = 0
+        for data in self._read_blocks():
+            self._buffer.write(data)
+            size += len(data)
+        self.length = size
+
+    def __iter__(self):
+        self._buffer.seek(0)
+        return iter(lambda: self._buffer.read(self.block_size), b'')
+
+    def close(self):
+        """Discard the buffered body"""
+        self._buffer.close()
@@ -0,0 +1,547 @@
+# -*- coding: UTF-8 -*-
+"""
+A lean HTTP/1.1 client for talking to the back-end services.
+
+It supports the parts of the ``http.client`` API that ``RelayQuery`` uses, but
+is built for relaying instead of general use:
+
+- The response head is parsed incrementally out of a buffer that belongs to the
+  connection, and is reused for every request sent over it.
+- ``getheaders()`` only returns the end-to-end headers. Hop-by-hop headers
+  (i.e. Transfer-Encoding, Keep-Alive, and anything named in Connection) only
+  describe the connection to the gateway, so forwarding them to the client would
+  make the framing of the relayed body wrong.
+- Bodies are read in blocks, and copied out of the buffer at most once.
+- Requests can be pipelined; send several, then read the responses in order.
+"""
+import select
+import socket
+from collections import deque
+from http.client import HTTPException, RemoteDisconnected, ResponseNotReady, IncompleteRead
+
+BUFFER_SIZE = 16384
+MAX_HEAD_SIZE = 65536
+BLOCK_SIZE = 65536
+HOP_BY_HOP = frozenset(['connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+                        'proxy-connection', 'te', 'trailer', 'transfer-encoding', 'upgrade'])
+METHODS_EXPECTING_BODY = frozenset(['PATCH', 'POST', 'PUT'])
+# the modes of reading a response body
+NO_BODY, LENGTH, CHUNKED, UNTIL_CLOSE = range(4)
+
+
+class BadResponse(HTTPException):
+    """The back-end sent something that isn't a valid HTTP/1.x response"""
+    pass
+
+
+class HTTPConnection:
+    """A persistent HTTP/1.1 connection to a back-end service
+
+    :param host: The IP/FQDN/DNS shortname of the back-end service.
+    :type host: String
+
+    :param port: The port of the back-end service.
+    :type port: Integer
+
+    :param timeout: Seconds to wait on the socket. Default is no timeout.
+    :type timeout: Float
+    """
+    default_port = 80
+
+    def __init__(self, host, port=None, timeout=None):
+        self.host = host
+        self.port = port or self.default_port
+        self.timeout = timeout
+        self.sock = None
+        self._buf = bytearray(BUFFER_SIZE)
+        self._view = memoryview(self._buf)
+        # the unread bytes are self._buf[self._start:self._end]
+        self._start = 0
+        self._end = 0
+        self._pending = deque()
+        self._response = None
+        if port is None or port == self.default_port:
+            self._host_header = host
+        else:
+            self._host_header = '{}:{}'.format(host, port)
+
+    def connect(self):
+        """Open the TCP connection to the back-end
+
+        :Returns: None
+        """
+        self.sock = socket.create_connection((self.host, self.port), self.timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def close(self):
+        """Close the connection; any pending responses are lost
+
+        :Returns: None
+        """
+        sock, self.sock = self.sock, None
+        self._start = self._end = 0
+        self._pending.clear()
+        self._response = None
+        if sock is not None:
+            sock.close()
+
+    def request(self, method, url, body=None, headers=None):
+        """Send a request. The response is obtained with ``getresponse()``; more
+        requests can be sent before that (i.e. pipelined).
+
+        :Returns: None
+
+        :param method: The HTTP method to envoke (i.e. GET, POST, etc...)
+        :type method: String
+
+        :param url: The path and query string to request
+        :type url: String
+
+        :param body: The HTTP body to send.
+        :type body: Bytes, String, a file-like object, or an iterable of Bytes
+
+        :param headers: The HTTP headers to send.
+        :type headers: Dictionary
+        """
+        if self.sock is None:
+            self.connect()
+        lines = ['{} {} HTTP/1.1'.format(method, url)]
+        names = set()
+        for name, value in (headers or {}).items():
+            value = str(value)
+            if '\n' in value or '\r' in value or '\n' in name or '\r' in name:
+                raise ValueError('Invalid header {!r}: {!r}'.format(name, value))
+            names.add(name.lower())
+            lines.append('{}: {}'.format(name, value))
+        if 'host' not in names:
+            lines.append('Host: {}'.format(self._host_header))
+        if 'accept-encoding' not in names:
+            lines.append('Accept-Encoding: identity')
+        if isinstance(body, str):
+            body = body.encode('iso-8859-1')
+        chunked = False
+        if 'content-length' not in names and 'transfer-encoding' not in names:
+            if isinstance(body, (bytes, bytearray)):
+                lines.append('Content-Length: {}'.format(len(body)))
+            elif body is not None:
+                lines.append('Transfer-Encoding: chunked')
+                chunked = True
+            elif method in METHODS_EXPECTING_BODY:
+                lines.append('Content-Length: 0')
+        lines.append('\r\n')
+        head = '\r\n'.join(lines).encode('iso-8859-1')
+        if body is None:
+            self.sock.sendall(head)
+        elif isinstance(body, (bytes, bytearray)):
+            # one write, so the back-end doesn't wait on a second packet
+            self.sock.sendall(head + body)
+        else:
+            self.sock.sendall(head)
+            self._send_body(body, chunked)
+        self._pending.append(method)
+
+    def _send_body(self, body, chunked):
+        if hasattr(body, 'read'):
+            blocks = iter(lambda: body.read(BLOCK_SIZE), b'')
+        else:
+            blocks = body
+        sendall = self.sock.sendall
+        for block in blocks:
+            if isinstance(block, str):
+                block = block.encode('iso-8859-1')
+            if not block:
+                continue
+            if chunked:
+                sendall(b'%x\r\n%s\r\n' % (len(block), block))
+            else:
+                sendall(block)
+        if chunked:
+            sendall(b'0\r\n\r\n')
+
+    def getresponse(self):
+        """Read the head of the response to the oldest request
+
+        :Returns: HTTPResponse
+
+        :Raises: http.client.RemoteDisconnected, BadResponse
+        """
+        if self._response is not None and not self._response.isclosed():
+            raise ResponseNotReady('The body of the previous response has not been read')
+        if not self._pending:
+            raise ResponseNotReady('No request was sent')
+        method = self._pending.popleft()
+        while True:
+            version, status, reason, headers = self._read_head()
+            # skip interim responses (i.e. 100 Continue); 101 is the final response to an Upgrade
+            if not 100 <= status < 200 or status == 101:
+                break
+        self._response = HTTPResponse(self, method, version, status, reason, headers)
+        return self._response
+
+    def _read_head(self):
+        """Parse the status line and headers of a response out of the buffer
+
+        :Returns: Tuple (version, status, reason, headers)
+        """
+        # relative to self._start, because filling the buffer can move the unread bytes
+        scanned = 0
+        while True:
+            found = self._buf.find(b'\r\n\r\n', self._start + scanned, self._end)
+            if found != -1:
+                break
+            received = self._end - self._start
+            # the terminator could straddle what's buffered and the next read
+            scanned = max(0, received - 3)
+            if not self._fill(MAX_HEAD_SIZE):
+                if received:
+                    raise BadResponse('Connection closed in the middle of the response head')
+                raise RemoteDisconnected('Remote end closed connection without response')
+            if self._end - self._start > MAX_HEAD_SIZE:
+                raise BadResponse('Response head is larger than {} bytes'.format(MAX_HEAD_SIZE))
+        lines = self._buf[self._start:found].decode('iso-8859-1').split('\r\n')
+        self._start = found + 4
+        version, _, rest = lines[0].partition(' ')
+        code, _, reason = rest.partition(' ')
+        if not version.startswith('HTTP/1.') or len(code) != 3 or not code.isdigit():
+            raise BadResponse('Invalid status line {!r}'.format(lines[0]))
+        headers = []
+        for line in lines[1:]:
+            if line[:1] in (' ', '\t') and headers:
+                # obsolete line folding
+                name, value = headers[-1]
+                headers[-1] = (name, value + ' ' + line.strip())
+                continue
+            name, sep, value = line.partition(':')
+            if not sep or not name or name != name.strip():
+                raise BadResponse('Invalid header line {!r}'.format(line))
+            headers.append((name, value.strip()))
+        return version, int(code), reason, headers
+
+    def _fill(self, limit=BUFFER_SIZE):
+        """Read more bytes from the socket into the buffer
+
+        :Returns: Integer (the number of bytes read; zero means the back-end closed the connection)
+
+        :param limit: How large the buffer may grow to hold unread bytes.
+        :type limit: Integer
+        """
+        if self._start == self._end:
+            self._start = self._end = 0
+        elif self._end == len(self._buf):
+            unread = self._end - self._start
+            if self._start:
+                # make room by moving the unread bytes to the front
+                self._buf[:unread] = self._buf[self._start:self._end]
+                self._start, self._end = 0, unread
+            elif len(self._buf) < limit:
+                self._view.release()
+                self._buf.extend(bytes(len(self._buf)))
+                self._view = memoryview(self._buf)
+            else:
+                return 0
+        received = self.sock.recv_into(self._view[self._end:])
+        self._end += received
+        return received
+
+    def _readline(self):
+        """Read a CRLF terminated line (i.e. the size of a chunk) out of the buffer
+
+        :Returns: Bytes
+        """
+        while True:
+            found = self._buf.find(b'\r\n', self._start, self._end)
+            if found != -1:
+                line = bytes(self._buf[self._start:found])
+                self._start = found + 2
+                return line
+            if self._end - self._start > MAX_HEAD_SIZE or not self._fill(MAX_HEAD_SIZE):
+                raise IncompleteRead(b'')
+
+    def _read_some(self, amt):
+        """Read up to ``amt`` bytes, waiting for the back-end only if nothing is buffered
+
+        :Returns: Bytes (empty if the back-end closed the connection)
+        """
+        available = self._end - self._start
+        if not available:
+            # skip the buffer; one copy, straight from the kernel
+            return self.sock.recv(amt)
+        amt = min(amt, available)
+        data = bytes(self._view[self._start:self._start + amt])
+        self._start += amt
+        return data
+
+    def _readable(self):
+        """Check if the back-end has sent bytes that haven't been read from the socket
+
+        :Returns: Boolean
+        """
+        if self.sock is None:
+            return False
+        if getattr(self.sock, 'pending', None) and self.sock.pending():
+            # decrypted TLS records the socket has already taken from the kernel
+            return True
+        return bool(select.select([self.sock], [], [], 0)[0])
+
+    def pop_buffered(self):
+        """Take the bytes the back-end sent past the end of the last response (i.e.
+        the first frames after a 101 Switching Protocols)
+
+        :Returns: Bytes
+        """
+        data = bytes(self._buf[self._start:self._end])
+        self._start = self._end = 0
+        return data
+
+
+class HTTPSConnection(HTTPConnection):
+    """A persistent HTTP/1.1 connection to a back-end service, over TLS
+
+    :param context: The TLS settings to use
+    :type context: ssl.SSLContext
+    """
+    default_port = 443
+
+    def __init__(self, host, port=None, timeout=None, context=None):
+        super().__init__(host, port, timeout)
+        self.context = context
+
+    def connect(self):
+        super().connect()
+        self.sock = self.context.wrap_socket(self.sock, server_hostname=self.host)
+
+
+class HTTPResponse:
+    """The response to a request sent over an ``HTTPConnection``
+
+    :param conn: The connection the response is read from
+    :type conn: HTTPConnection
+
+    :param method: The HTTP method of the request
+    :type method: String
+
+    :param version: The HTTP version of the response, i.e. 'HTTP/1.1'
+    :type version: String
+
+    :param status: The HTTP status code
+    :type status: Integer
+
+    :param reason: The HTTP reason phrase
+    :type reason: String
+
+    :param headers: Every header in the response
+    :type headers: List
+    """
+    def __init__(self, conn, method, version, status, reason, headers):
+        self._conn = conn
+        self.version = version
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.length = None
+        self._chunk_left = 0
+        self._in_chunks = False
+        self._mode = UNTIL_CLOSE
+        connection = set()
+        transfer_encoding = None
+        content_length = None
+        for name, value in headers:
+            lower = name.lower()
+            if lower == 'connection':
+                connection.update(x.strip().lower() for x in value.split(','))
+            elif lower == 'transfer-encoding':
+                transfer_encoding = value.lower()
+            elif lower == 'content-length':
+                content_length = value
+        if version == 'HTTP/1.0':
+            self.will_close = 'keep-alive' not in connection
+        else:
+            self.will_close = 'close' in connection
+        # Per RFC 9112, section 6.3
+        if method == 'HEAD' or status in (204, 304) or 100 <= status < 200:
+            self._mode = NO_BODY
+            self.length = 0
+        elif transfer_encoding is not None:
+            if transfer_encoding.rsplit(',', 1)[-1].strip() == 'chunked':
+                self._mode = CHUNKED
+            else:
+                self.will_close = True
+        elif content_length is not None:
+            if not content_length.isdigit():
+                raise BadResponse('Invalid Content-Length {!r}'.format(content_length))
+            self._mode = LENGTH
+            self.length = int(content_length)
+            if not self.length:
+                self._mode = NO_BODY
+        else:
+            self.will_close = True
+        self._forward = self._end_to_end(headers, connection)
+
+    def _end_to_end(self, headers, connection):
+        if self.status == 101:
+            # the client needs the Upgrade and Connection headers to switch protocols too
+            return list(headers)
+        drop = HOP_BY_HOP | connection
+        if self._mode == CHUNKED:
+            # a Content-Length alongside chunking is invalid; the chunking wins
+            drop = drop | {'content-length'}
+        return [(name, value) for name, value in headers if name.lower() not in drop]
+
+    def getheaders(self):
+        """The end-to-end headers of the response, which are safe to relay
+
+        :Returns: List
+        """
+        return self._forward
+
+    def getheader(self, name, default=None):
+        """Look up a header of the response
+
+        :Returns: String
+        """
+        name = name.lower()
+        for header, value in self.headers:
+            if header.lower() == name:
+                return value
+        return default
+
+    def isclosed(self):
+        """Check if the whole body has been read (or the response was closed)
+
+        :Returns: Boolean
+        """
+        return self._mode == NO_BODY
+
+    def read1(self, amt=BLOCK_SIZE):
+        """Read up to ``amt`` bytes of the body, waiting for the back-end only if
+        nothing is buffered
+
+        :Returns: Bytes (empty once the whole body has been read)
+
+        :Raises: http.client.IncompleteRead
+        """
+        mode = self._mode
+        if mode == NO_BODY:
+            return b''
+        elif mode == LENGTH:
+            data = self._conn._read_some(min(amt, self.length))
+            if not data:
+                self._close_conn()
+                raise IncompleteRead(b'', self.length)
+            self.length -= len(data)
+            if not self.length:
+                self._mode = NO_BODY
+            return data
+        elif mode == CHUNKED:
+            # join the chunks that are already buffered, so small chunks aren't relayed one by one
+            conn = self._conn
+            pieces = []
+            size = 0
+            while True:
+                if not self._chunk_left:
+                    if pieces and not self._chunk_head_buffered():
+                        # don't hold back what's been read while waiting on the next chunk
+                        break
+                    self._chunk_left = self._next_chunk()
+                    if not self._chunk_left:
+                        break
+                data = conn._read_some(min(amt - size, self._chunk_left))
+                if not data:
+                    self._close_conn()
+                    raise IncompleteRead(b''.join(pieces), self._chunk_left)
+                self._chunk_left -= len(data)
+                pieces.append(data)
+                size += len(data)
+                if size >= amt or conn._start == conn._end:
+                    break
+            return b''.join(pieces)
+        data = self._conn._read_some(amt)
+        if not data:
+            self._mode = NO_BODY
+        return data
+
+    def would_block(self):
+        """Check if reading more of the body would wait on the back-end
+
+        :Returns: Boolean
+        """
+        if self._mode == NO_BODY:
+            return False
+        conn = self._conn
+        if self._mode == CHUNKED and not self._chunk_left:
+            buffered = self._chunk_head_buffered()
+        else:
+            buffered = conn._end > conn._start
+        return not buffered and not conn._readable()
+
+    def _chunk_head_buffered(self):
+        """Check if the framing of the next chunk can be read without waiting on the back-end
+
+        :Returns: Boolean
+        """
+        conn = self._conn
+        # the CRLF that ends the previous chunk, then the size line of the next one
+        return conn._buf.find(b'\r\n', conn._start + 2, conn._end) != -1
+
+    def _next_chunk(self):
+        """Read the framing of the next chunk
+
+        :Returns: Integer (zero once the last chunk has been read)
+        """
+        conn = self._conn
+        if self._in_chunks:
+            # the CRLF that ends the previous chunk; usually buffered, so check for it in place
+            start = conn._start
+            if conn._end - start >= 2 and conn._buf[start] == 13 and conn._buf[start + 1] == 10:
+                conn._start = start + 2
+            elif conn._readline():
+                self._close_conn()
+                raise BadResponse('Chunk is larger than its size')
+        self._in_chunks = True
+        line = conn._readline()
+        if b';' in line:
+            # drop any chunk extensions
+            line = line[:line.index(b';')]
+        try:
+            size = int(line, 16)
+        except ValueError:
+            self._close_conn()
+            raise BadResponse('Invalid chunk size {!r}'.format(line))
+        if not size:
+            # discard any trailers
+            while conn._readline():
+                pass
+            self._mode = NO_BODY
+        return size
+
+    def read(self, amt=None):
+        """Read the body
+
+        :Returns: Bytes
+
+        :param amt: The max number of bytes to read. Default is the whole body.
+        :type amt: Integer
+        """
+        chunks = []
+        while amt is None or amt > 0:
+            data = self.read1(BLOCK_SIZE if amt is None else amt)
+            if not data:
+                break
+            chunks.append(data)
+            if amt is not None:
+                amt -= len(data)
+        return b''.join(chunks)
+
+    def _close_conn(self):
+        self._mode = NO_BODY
+        self.will_close = True
+        self._conn.close()
+
+    def close(self):
+        """Stop reading the response. If the body wasn't fully read, the
+        connection can't be reused, so it's closed.
+
+        :Returns: None
+        """
+        if self._mode != NO_BODY:
+            self._close_conn()